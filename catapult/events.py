@@ -0,0 +1,279 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+from django.db import close_old_connections, transaction
+
+from catapult.models import File, FolderWatchingLocation
+from catapult.scanner import SCAN_BATCH_SIZE, Acquisition, get_extensions, sync_files
+from catapult.size_tracker import AcquisitionSizeTracker
+
+logger = logging.getLogger("catapult.events")
+
+# seconds a path has to be quiet before its events are applied
+COALESCE_WINDOW = 2.0
+# seconds after which the events of a path are applied even if it is still being written to
+COALESCE_MAX_DELAY = 30.0
+# times the events of a path are applied before they are dropped when applying them keeps failing
+MAX_APPLY_ATTEMPTS = 5
+
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+MOVED = "moved"
+
+
+class PendingEvent:
+    """
+    The coalesced state of the events received for a single path
+    - kind: the last kind of event, one of CREATED, MODIFIED, DELETED or MOVED
+    - dest_path: destination of a MOVED event
+    - first_seen: monotonic time of the first event since the path was last applied
+    - last_seen: monotonic time of the last event
+    - count: number of events coalesced
+    - children: paths touched inside an acquisition folder
+    - attempts: number of times applying the events failed
+    """
+    __slots__ = ("kind", "dest_path", "first_seen", "last_seen", "count", "children", "attempts")
+
+    def __init__(self, kind: str, dest_path: str | None, now: float):
+        self.kind = kind
+        self.dest_path = dest_path
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 1
+        self.children = set()
+        self.attempts = 0
+
+
+class EventCoalescer:
+    """
+    Queue of file system events of a folder watching location. Events are coalesced per acquisition path,
+    events inside a Bruker .d folder are attributed to the folder itself and only the touched children are stat'ed
+    again by the size tracker, and a path is applied once it
+    has been quiet for the coalescing window. File changes are written in batched transactions from a
+    background thread so watchdog handler threads never wait on the database.
+    """
+
+    def __init__(self, folder_watching_location: FolderWatchingLocation, window: float = COALESCE_WINDOW,
+                 max_delay: float = COALESCE_MAX_DELAY, on_config: Callable[[str], None] = None,
+                 batch_size: int = SCAN_BATCH_SIZE):
+        """
+        :param folder_watching_location: the location the events belong to
+        :param window: seconds a path has to be quiet before it is applied
+        :param max_delay: seconds after which a path is applied even if events keep arriving
+        :param on_config: called with the path of every created, modified or moved .cat.yml or .cat.yaml file
+        :param batch_size: number of rows per bulk insert, update or delete
+        """
+        self.folder_watching_location = folder_watching_location
+        self.folder_path = folder_watching_location.folder_path
+        self.extensions = get_extensions(folder_watching_location)
+        self.ignore_term = folder_watching_location.ignore_term
+        self.window = window
+        self.max_delay = max(max_delay, window)
+        self.on_config = on_config
+        self.batch_size = batch_size
+        self.pending: dict[str, PendingEvent] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.sizes = AcquisitionSizeTracker()
+        self.received = 0
+        self.applied = 0
+
+    def resolve_path(self, path: str) -> str | None:
+        """
+        Return the path events are coalesced under: the acquisition the path belongs to, the path itself
+        for run configs, or None if the path is not watched.
+        """
+        if self.ignore_term and self.ignore_term in path:
+            return None
+        if path.endswith(".cat.yml") or path.endswith(".cat.yaml"):
+            return path
+        if not path.startswith(self.folder_path):
+            return None
+        relative = path[len(self.folder_path):]
+        parts = relative.split(os.sep)
+        for i, part in enumerate(parts):
+            if os.path.splitext(part)[1] in self.extensions:
+                return self.folder_path + os.sep.join(parts[:i + 1])
+        return None
+
+    def submit(self, kind: str, path: str, dest_path: str = None):
+        """
+        Record a file system event, this only takes a lock and never touches the database.
+        """
+        key = self.resolve_path(path)
+        if key is None:
+            if kind != MOVED or dest_path is None:
+                return
+            # a file moved into the watched set behaves like a created file
+            kind, key, dest_path = CREATED, self.resolve_path(dest_path), None
+            if key is None:
+                return
+        if kind == MOVED:
+            dest_path = self.resolve_path(dest_path)
+            if key != path:
+                # a file moved inside an acquisition folder only changes the folder size
+                kind, dest_path = MODIFIED, None
+            elif dest_path is None:
+                kind = DELETED
+        elif kind == DELETED and key != path:
+            kind = MODIFIED
+        now = time.monotonic()
+        with self.lock:
+            self.received += 1
+            event = self.pending.get(key)
+            if event is None:
+                event = self.pending[key] = PendingEvent(kind, dest_path, now)
+                if key != path:
+                    event.children.add(path)
+                return
+            if key != path:
+                event.children.add(path)
+            event.count += 1
+            event.last_seen = now
+            if kind == MODIFIED and event.kind == CREATED:
+                return
+            if kind == CREATED and event.kind == DELETED:
+                kind = MODIFIED
+            event.kind = kind
+            event.dest_path = dest_path
+
+    def take_due(self, force: bool = False) -> dict[str, PendingEvent]:
+        now = time.monotonic()
+        with self.lock:
+            if force:
+                due, self.pending = self.pending, {}
+                return due
+            due = {
+                path: event for path, event in self.pending.items()
+                if now - event.last_seen >= self.window or now - event.first_seen >= self.max_delay
+            }
+            for path in due:
+                del self.pending[path]
+        return due
+
+    def requeue(self, events: dict[str, PendingEvent]):
+        """
+        Put back events whose application failed, they are applied again once the coalescing window passed.
+        Events received for the same paths in the meantime are newer and replace them, events that failed
+        MAX_APPLY_ATTEMPTS times are dropped and left to the next full scan.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for path, event in events.items():
+                event.attempts += 1
+                if event.attempts >= MAX_APPLY_ATTEMPTS:
+                    logger.error(f"dropping the events of {path} after {event.attempts} failed attempts")
+                    continue
+                newer = self.pending.get(path)
+                if newer is None:
+                    event.first_seen = event.last_seen = now
+                    self.pending[path] = event
+                else:
+                    newer.count += event.count
+                    newer.children |= event.children
+                    newer.attempts = event.attempts
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Apply the events of every path that is due, or of every pending path if force is set. Events whose
+        application fails are queued again.
+        :return: number of paths applied
+        """
+        due = self.take_due(force)
+        if not due:
+            return 0
+        configs = {}
+        files = {}
+        moved = []
+        deleted = []
+        acquisitions = []
+        for path, event in due.items():
+            if path.endswith(".cat.yml") or path.endswith(".cat.yaml"):
+                if event.kind == MOVED:
+                    configs[path] = event.dest_path
+                elif event.kind != DELETED:
+                    configs[path] = path
+                continue
+            files[path] = event
+            if event.kind == MOVED:
+                moved.append((path, event.dest_path))
+                self.sizes.forget(path)
+            elif event.kind == DELETED:
+                deleted.append(path)
+                self.sizes.forget(path)
+            else:
+                acquisition = self.stat_acquisition(path, event.children)
+                if acquisition is not None:
+                    acquisitions.append(acquisition)
+                elif not os.path.exists(path):
+                    deleted.append(path)
+                    self.sizes.forget(path)
+
+        failed = {}
+        try:
+            if moved:
+                with transaction.atomic():
+                    for src_path, dest_path in moved:
+                        File.objects.filter(
+                            folder_watching_location=self.folder_watching_location,
+                            file_path=src_path.replace(self.folder_path, "")
+                        ).update(file_path=dest_path.replace(self.folder_path, ""))
+            if acquisitions or deleted:
+                counts = sync_files(
+                    self.folder_watching_location, acquisitions, removed=deleted,
+                    batch_size=self.batch_size, known_paths_only=True
+                )
+                logger.info(
+                    f"{len(files)} paths applied from {sum(e.count for e in files.values())} events: "
+                    f"{counts['created']} files created, {counts['updated']} updated and {counts['deleted']} deleted"
+                )
+        except Exception as e:
+            # moving, creating and updating files can be applied again, the whole batch is queued again
+            logger.exception(f"unable to apply the events of {len(files)} paths of {self.folder_path}: {e}")
+            failed.update(files)
+        if self.on_config is not None:
+            for path, config_path in configs.items():
+                try:
+                    self.on_config(config_path)
+                except Exception as e:
+                    logger.exception(f"unable to load the run config {config_path}: {e}")
+                    failed[path] = due[path]
+        if failed:
+            self.requeue(failed)
+        self.applied += len(due) - len(failed)
+        return len(due) - len(failed)
+
+    def stat_acquisition(self, path: str, children: set[str]) -> Acquisition | None:
+        try:
+            if os.path.isdir(path):
+                return Acquisition(path, self.sizes.update(path, children), os.path.getmtime(path))
+            stat = os.stat(path)
+            return Acquisition(path, stat.st_size, stat.st_mtime)
+        except OSError:
+            return None
+
+    def run(self):
+        interval = min(self.window, 1.0) or 0.1
+        while not self.stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"unable to apply file system events of {self.folder_path}: {e}")
+            finally:
+                close_old_connections()
+        self.flush(force=True)
+        close_old_connections()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"coalescer-{self.folder_watching_location.id}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -1,6 +1,10 @@
-from django.db.models import JSONField
+import operator
+from functools import reduce
+
+from django.db.models import JSONField, Q
 from django_filters import FilterSet, Filter
 from django_filters.fields import Lookup
+from rest_framework.filters import SearchFilter, search_smart_split
 
 from catapult.models import CatapultRunConfig
 
@@ -25,4 +29,50 @@ class CatapultRunConfigFilter(FilterSet):
             JSONField: {
                 'filter_class': JSONFilter,
             },
-        }
\ No newline at end of file
+        }
+
+
+# separator of the genes and proteins of a group in DIA-NN reports, also used to ask for several of them at once
+TERM_SEPARATOR = ";"
+
+
+def split_terms(value: str) -> list[str]:
+    return [term.strip() for term in value.split(TERM_SEPARATOR) if term.strip()]
+
+
+def text_query(field: str, value: str) -> Q:
+    """
+    Case-insensitive substring match of a report text field against one or more ;-separated terms, rows
+    matching any of the terms are kept. The icontains lookups are served by the trigram indexes of the field.
+    """
+    terms = split_terms(value)
+    if not terms:
+        return Q()
+    return reduce(operator.or_, (Q(**{f"{field}__icontains": term}) for term in terms))
+
+
+class ReportSearchFilter(SearchFilter):
+    """
+    SearchFilter for the report tables where ?search=TP53;EGFR returns the rows matching any of the ;-separated
+    alternatives. Within an alternative, the whitespace separated terms must all match as with SearchFilter.
+    The default lookup of the search fields is icontains, which uses the trigram indexes of the text columns,
+    terms shorter than three characters cannot use them.
+    """
+
+    def get_search_alternatives(self, request) -> list[list[str]]:
+        value = request.query_params.get(self.search_param, "")
+        return [terms for terms in (search_smart_split(alternative) for alternative in split_terms(value)) if terms]
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        alternatives = self.get_search_alternatives(request)
+        if not search_fields or not alternatives:
+            return queryset
+        orm_lookups = [self.construct_search(str(field), queryset) for field in search_fields]
+        query = Q()
+        for terms in alternatives:
+            alternative = Q()
+            for term in terms:
+                alternative &= reduce(operator.or_, (Q(**{lookup: term}) for lookup in orm_lookups))
+            query |= alternative
+        return queryset.filter(query)
@@ -0,0 +1,557 @@
+import hashlib
+import io
+import logging
+import os
+import time
+
+import pandas as pd
+import psutil
+from django.conf import settings
+from django.db import transaction, connection
+from django.utils import timezone
+
+from catapult.models import File, ResultSummary, PrecursorReportContent, ProteinGroupReportContent, \
+    ReportFileFingerprint, GeneGroup, ProteinGroup, Precursor
+from catapult.partitions import ensure_partitions
+from catapult.result_store import ResultStore, PRECURSOR_TABLE, PROTEIN_GROUP_TABLE, get_result_store
+
+logger = logging.getLogger("catapult.ingestion")
+
+# number of long-format rows written per transaction
+INGESTION_CHUNK_SIZE = 50000
+# number of run columns melted at once, bounds the size of the long-format frame held in memory
+MELT_BLOCK_SIZE = 16
+# size of the blocks read when hashing report files
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+# number of strings looked up or created per query when interning report strings
+INTERN_BATCH_SIZE = 5000
+
+# available loaders for report content, "copy" streams rows with COPY FROM STDIN and is only available on PostgreSQL
+REPORT_LOADERS = ["copy", "orm"]
+
+PRECURSOR_COLUMNS = {
+    "Precursor.Id": "precursor_id",
+    "Genes": "gene_names",
+    "Protein.Group": "protein_group",
+    "Proteotypic": "proteotypic",
+}
+
+PROTEIN_GROUP_COLUMNS = {
+    "Genes": "gene_names",
+    "Protein.Group": "protein_group",
+}
+
+
+class StringInterner:
+    """
+    Map the strings of a report column to the ids of their dictionary entry, creating the missing entries.
+    The ids are cached for the whole ingestion, each distinct string costs one lookup however many runs repeat it.
+    """
+
+    def __init__(self, model, batch_size: int = INTERN_BATCH_SIZE):
+        """
+        :param model: GeneGroup, ProteinGroup or Precursor
+        :param batch_size: number of strings looked up or created per query
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.ids: dict[str, int] = {}
+
+    def lookup(self, values: list[str]):
+        for start in range(0, len(values), self.batch_size):
+            batch = values[start:start + self.batch_size]
+            self.ids.update(self.model.objects.filter(value__in=batch).values_list("value", "id"))
+
+    def intern(self, values) -> dict[str, int]:
+        """
+        Make sure every string of values has an id, other ingestions may create the same entries concurrently.
+        """
+        missing = list({str(value) for value in values if value is not None and str(value) not in self.ids})
+        if not missing:
+            return self.ids
+        self.lookup(missing)
+        new = [value for value in missing if value not in self.ids]
+        if new:
+            for start in range(0, len(new), self.batch_size):
+                self.model.objects.bulk_create(
+                    [self.model(value=value) for value in new[start:start + self.batch_size]], ignore_conflicts=True
+                )
+            self.lookup(new)
+        return self.ids
+
+    def keys(self, values: pd.Series) -> pd.Series:
+        """
+        Ids of the strings of a column, None where the column has no value.
+        """
+        codes, uniques = pd.factorize(values)
+        ids = self.intern(uniques)
+        # one id per distinct string, taken by code for the rows, the code of missing values -1 picks the None
+        unique_ids = pd.array([ids[str(value)] for value in uniques] + [None], dtype=object)
+        return pd.Series(unique_ids.take(codes), dtype=object, index=values.index)
+
+
+def report_interners() -> dict[str, StringInterner]:
+    """
+    One interner per report text column, shared by the precursor and protein group tables.
+    """
+    return {
+        "gene_names": StringInterner(GeneGroup),
+        "protein_group": StringInterner(ProteinGroup),
+        "precursor_id": StringInterner(Precursor),
+    }
+
+
+def key_rows(model, rows: pd.DataFrame, interners: dict[str, StringInterner]) -> pd.DataFrame:
+    """
+    Replace the text columns of prepared rows with the ids of their dictionary entries.
+    :param model: PrecursorReportContent or ProteinGroupReportContent
+    :param rows: frame whose columns are model field names or report column names
+    :param interners: interner of each report text column, as returned by report_interners
+    """
+    rows = rows.copy()
+    for name, key in model.text_fields.items():
+        if name in rows.columns:
+            rows[f"{key}_id"] = interners[name].keys(rows[name])
+            rows = rows.drop(columns=[name])
+    return rows
+
+
+class IngestionStats:
+    """
+    Keep track of the number of rows written, the elapsed time and the peak resident memory of an ingestion run
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.process = psutil.Process()
+        self.peak_rss = self.process.memory_info().rss
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def add(self, rows: int):
+        self.rows += rows
+        self.sample()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.rows / self.elapsed
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1),
+        }
+
+
+def read_matrix(matrix_path: str, id_columns: list[str], run_columns: list[str]) -> tuple[pd.DataFrame, list[str]]:
+    """
+    Read a DIA-NN matrix file once, keeping only the identifier columns and the run columns that are present.
+    Identifier columns are converted to categoricals so that melting does not copy the strings for every run.
+    :param matrix_path: path to the report.pr_matrix.tsv or report.pg_matrix.tsv file
+    :param id_columns: identifier columns to keep
+    :param run_columns: run columns (File.Name from report.stats.tsv) to keep
+    :return: the matrix and the run columns found in it
+    """
+    header = pd.read_csv(matrix_path, sep="\t", nrows=0).columns
+    present_runs = [c for c in run_columns if c in header]
+    matrix = pd.read_csv(matrix_path, sep="\t", usecols=id_columns + present_runs)
+    for column in id_columns:
+        matrix[column] = matrix[column].astype("category")
+    return matrix, present_runs
+
+
+def iter_long_matrix(matrix: pd.DataFrame, id_columns: list[str], run_columns: list[str], block_size: int = MELT_BLOCK_SIZE):
+    """
+    Melt a wide matrix into long format, one block of run columns at a time, dropping missing intensities.
+    :param matrix: wide matrix as returned by read_matrix
+    :param id_columns: identifier columns
+    :param run_columns: run columns to melt
+    :param block_size: number of run columns melted at once
+    """
+    for start in range(0, len(run_columns), block_size):
+        block = run_columns[start:start + block_size]
+        long = matrix.melt(id_vars=id_columns, value_vars=block, var_name="File.Name", value_name="Intensity")
+        long = long[long["Intensity"].notna()]
+        if len(long) > 0:
+            yield long.reset_index(drop=True)
+
+
+def prepare_rows(long: pd.DataFrame, column_map: dict[str, str], runs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a long-format block into the column layout of the report content model.
+    :param long: long-format block from iter_long_matrix
+    :param column_map: mapping of matrix column to model field
+    :param runs: frame indexed by File.Name with result_summary_id and file_id columns
+    :return: frame whose columns are model field names
+    """
+    rows = pd.DataFrame({
+        "result_summary_id": long["File.Name"].map(runs["result_summary_id"]).to_numpy(),
+        "file_id": long["File.Name"].map(runs["file_id"]).to_numpy(),
+    })
+    for column, field in column_map.items():
+        values = long[column]
+        if field == "proteotypic":
+            rows[field] = (values.astype(float) == 1).to_numpy()
+        else:
+            values = values.astype(object)
+            rows[field] = values.where(values.notna(), None).to_numpy()
+    rows["intensity"] = long["Intensity"].astype(float).to_numpy()
+    return rows
+
+
+def bulk_create_rows(model, rows: pd.DataFrame, chunk_size: int = INGESTION_CHUNK_SIZE, stats: IngestionStats = None):
+    """
+    Write prepared rows into a report content model in chunked bulk inserts, one transaction per chunk.
+    :param model: PrecursorReportContent or ProteinGroupReportContent
+    :param rows: frame whose columns are model field names
+    :param chunk_size: number of rows per transaction
+    :param stats: optional IngestionStats to update
+    """
+    fields = list(rows.columns)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows.iloc[start:start + chunk_size]
+        columns = [chunk[f].tolist() for f in fields]
+        objects = [model(**dict(zip(fields, values))) for values in zip(*columns)]
+        with transaction.atomic():
+            model.objects.bulk_create(objects, batch_size=5000)
+        if stats:
+            stats.add(len(objects))
+
+
+def copy_rows(model, rows: pd.DataFrame, chunk_size: int = INGESTION_CHUNK_SIZE, stats: IngestionStats = None):
+    """
+    Stream prepared rows into a report content model with PostgreSQL COPY FROM STDIN, one transaction per chunk.
+    :param model: PrecursorReportContent or ProteinGroupReportContent
+    :param rows: frame whose columns are model field names
+    :param chunk_size: number of rows per transaction
+    :param stats: optional IngestionStats to update
+    """
+    columns = ", ".join(connection.ops.quote_name(model._meta.get_field(f).column) for f in rows.columns)
+    sql = f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows.iloc[start:start + chunk_size]
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, header=False, index=False, na_rep="")
+        buffer.seek(0)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.cursor.copy_expert(sql, buffer)
+        if stats:
+            stats.add(len(chunk))
+
+
+def resolve_loader(loader: str = None) -> str:
+    """
+    Return the report content loader to use, falling back to the ORM loader when COPY is not available.
+    :param loader: requested loader, one of REPORT_LOADERS, defaults to settings.REPORT_LOADER
+    """
+    if loader is None:
+        loader = getattr(settings, "REPORT_LOADER", "copy")
+    if loader not in REPORT_LOADERS:
+        raise ValueError(f"Unknown report loader {loader}, expected one of {', '.join(REPORT_LOADERS)}")
+    if loader == "copy" and connection.vendor != "postgresql":
+        logger.info(f"COPY loader is not available on {connection.vendor}, using the ORM loader")
+        return "orm"
+    return loader
+
+
+def load_report_matrix(matrix_path: str, column_map: dict[str, str], run_names: list[str]) -> tuple[pd.DataFrame | None, list[str]]:
+    """
+    Load a DIA-NN matrix for the given runs, returning no matrix if the file does not exist.
+    :param matrix_path: path to the matrix file
+    :param column_map: mapping of matrix column to model field
+    :param run_names: File.Name of the runs to keep
+    """
+    if not os.path.exists(matrix_path):
+        logger.warning(f"matrix file {matrix_path} does not exist, skipping")
+        return None, []
+    return read_matrix(matrix_path, list(column_map.keys()), run_names)
+
+
+def ingest_matrix(model, matrix: pd.DataFrame, column_map: dict[str, str], run_columns: list[str], runs: pd.DataFrame,
+                  chunk_size: int = INGESTION_CHUNK_SIZE, stats: IngestionStats = None, loader: str = "orm",
+                  result_store: ResultStore = None, store_table: str = None, analysis_id: int = None, write_db: bool = True,
+                  interners: dict[str, StringInterner] = None):
+    """
+    Stream the non-missing intensities of the given runs of a loaded matrix into a report content model
+    and, when a result store is given, into its Parquet table.
+    :param model: PrecursorReportContent or ProteinGroupReportContent
+    :param matrix: matrix as returned by load_report_matrix
+    :param column_map: mapping of matrix column to model field
+    :param run_columns: run columns of the matrix to ingest
+    :param runs: frame indexed by File.Name with result_summary_id and file_id columns
+    :param chunk_size: number of rows per transaction
+    :param stats: optional IngestionStats to update
+    :param loader: "copy" or "orm"
+    :param result_store: optional Parquet result store
+    :param store_table: table of the result store to write to
+    :param analysis_id: the analysis the rows belong to, used to partition the result store and the report tables
+    :param write_db: write the rows to the report content model
+    :param interners: interners of the text columns, a new set is used when not given
+    """
+    if matrix is None or len(run_columns) == 0:
+        return
+    if write_db:
+        interners = interners or report_interners()
+        for column, field in column_map.items():
+            if field in interners:
+                # intern the distinct strings of the matrix once, the blocks then only read the cache
+                interners[field].intern(matrix[column].cat.categories)
+    if stats:
+        stats.sample()
+    for long in iter_long_matrix(matrix, list(column_map.keys()), run_columns):
+        rows = prepare_rows(long, column_map, runs)
+        if result_store:
+            result_store.write_rows(store_table, analysis_id, rows)
+            if not write_db and stats:
+                stats.add(len(rows))
+        if not write_db:
+            continue
+        rows = key_rows(model, rows, interners)
+        rows["analysis_id"] = analysis_id
+        if loader == "copy":
+            copy_rows(model, rows, chunk_size=chunk_size, stats=stats)
+        else:
+            bulk_create_rows(model, rows, chunk_size=chunk_size, stats=stats)
+
+
+def fingerprint_file(file_path: str, previous: ReportFileFingerprint = None) -> dict:
+    """
+    Compute the size, modification time and content hash of a report file.
+    The content is only hashed when the size or modification time differ from the previous fingerprint.
+    :param file_path: path to the file
+    :param previous: fingerprint recorded at the last import
+    """
+    stat = os.stat(file_path)
+    if previous and previous.size == stat.st_size and previous.modified_time == stat.st_mtime:
+        content_hash = previous.content_hash
+    else:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+    return {"size": stat.st_size, "modified_time": stat.st_mtime, "content_hash": content_hash}
+
+
+def run_digests(stats_data: pd.DataFrame, matrices: list[tuple[pd.DataFrame | None, list[str], list[str]]]) -> dict[str, str]:
+    """
+    Compute a digest per run from its report.stats.tsv row and its column in each matrix,
+    so that only the runs whose results differ are re-imported.
+    :param stats_data: report.stats.tsv content indexed by File.Name
+    :param matrices: (matrix, identifier columns, run columns) of each loaded matrix
+    :return: mapping of File.Name to digest
+    """
+    id_hashes = []
+    for matrix, id_columns, _ in matrices:
+        if matrix is not None:
+            id_hashes.append(pd.util.hash_pandas_object(matrix[id_columns], index=False).to_numpy().tobytes())
+        else:
+            id_hashes.append(b"")
+    stats_columns = [c for c in stats_data.columns if c != "file_path"]
+    digests = {}
+    for run_name, row in stats_data[stats_columns].astype(str).iterrows():
+        digest = hashlib.sha256("\t".join(row.tolist()).encode("utf-8"))
+        for (matrix, _, run_columns), id_hash in zip(matrices, id_hashes):
+            digest.update(id_hash)
+            if run_name in run_columns:
+                digest.update(pd.util.hash_pandas_object(matrix[run_name], index=False).to_numpy().tobytes())
+        digests[run_name] = digest.hexdigest()
+    return digests
+
+
+def upsert_result_summaries(analysis, stats_data: pd.DataFrame, file_ids: dict[str, int], stats_file: str, log_file: str) -> dict[int, ResultSummary]:
+    """
+    Create or update the ResultSummary of every run in report.stats.tsv with one query to read and one to write each.
+    :param analysis: the analysis the results belong to
+    :param stats_data: report.stats.tsv content with an additional file_path column
+    :param file_ids: mapping of file path to File id
+    :param stats_file: stats file path relative to the watched folder
+    :param log_file: log file path relative to the watched folder
+    :return: mapping of File id to ResultSummary
+    """
+    summaries = {}
+    for summary in ResultSummary.objects.filter(analysis=analysis, file_id__in=file_ids.values()):
+        summaries.setdefault(summary.file_id, summary)
+    created = []
+    updated = []
+    now = timezone.now()
+    for _, r in stats_data.iterrows():
+        file_id = file_ids.get(r["file_path"])
+        if file_id is None:
+            continue
+        protein_identified = int(r["Proteins.Identified"])
+        precursor_identified = int(r["Precursors.Identified"])
+        summary = summaries.get(file_id)
+        if summary is None:
+            summary = ResultSummary(
+                analysis=analysis,
+                file_id=file_id,
+                protein_identified=protein_identified,
+                precursor_identified=precursor_identified,
+                stats_file=stats_file,
+                log_file=log_file,
+            )
+            summaries[file_id] = summary
+            created.append(summary)
+        elif protein_identified != summary.protein_identified or precursor_identified != summary.precursor_identified:
+            summary.protein_identified = protein_identified
+            summary.precursor_identified = precursor_identified
+            summary.stats_file = stats_file
+            summary.updated_at = now
+            updated.append(summary)
+    with transaction.atomic():
+        if created:
+            ResultSummary.objects.bulk_create(created)
+        if updated:
+            ResultSummary.objects.bulk_update(updated, ["protein_identified", "precursor_identified", "stats_file", "updated_at"])
+    return summaries
+
+
+def record_fingerprints(analysis, fingerprints: dict[str, dict]):
+    """
+    Store the fingerprints of the imported report files in the import ledger.
+    :param analysis: the analysis the report files belong to
+    :param fingerprints: mapping of file path to fingerprint as returned by fingerprint_file
+    """
+    for file_path, fingerprint in fingerprints.items():
+        ReportFileFingerprint.objects.update_or_create(analysis=analysis, file_path=file_path, defaults=fingerprint)
+
+
+def ingest_diann_report(analysis, config, parent_folder: str, report_stats_file: str, chunk_size: int = INGESTION_CHUNK_SIZE,
+                        loader: str = None, force: bool = False) -> dict:
+    """
+    Ingest report.stats.tsv, report.pr_matrix.tsv and report.pg_matrix.tsv of a DIA-NN run into the database,
+    and into the Parquet result store when one is configured.
+    Each matrix is read once for all runs and the File ids are resolved with a single query.
+    The import is skipped when the report files match the fingerprints recorded at the last import,
+    otherwise only the runs whose results changed are re-imported.
+    :param analysis: the analysis the results belong to
+    :param config: the CatapultRunConfig of the analysis
+    :param parent_folder: the folder containing the config file
+    :param report_stats_file: path to report.stats.tsv
+    :param chunk_size: number of rows per transaction
+    :param loader: report content loader, one of REPORT_LOADERS, defaults to settings.REPORT_LOADER
+    :param force: re-import every run regardless of the recorded fingerprints
+    :return: ingestion statistics
+    """
+    loader = resolve_loader(loader)
+    result_store = get_result_store()
+    write_db = result_store is None or getattr(settings, "STORE_REPORT_CONTENT_IN_DB", True)
+    stats = IngestionStats()
+    folder_path = config.folder_watching_location.folder_path
+    prefix = config.content["prefix"]
+    relative_folder = os.path.join(str(parent_folder.replace(folder_path, "")), prefix)
+    precursor_path = os.path.join(parent_folder, prefix, "report.pr_matrix.tsv")
+    protein_group_path = os.path.join(parent_folder, prefix, "report.pg_matrix.tsv")
+
+    report_files = [str(report_stats_file)] + [p for p in [precursor_path, protein_group_path] if os.path.exists(p)]
+    previous = {f.file_path: f for f in ReportFileFingerprint.objects.filter(analysis=analysis, file_path__in=report_files)}
+    fingerprints = {p: fingerprint_file(p, previous.get(p)) for p in report_files}
+    unchanged = all(
+        p in previous and previous[p].content_hash == fingerprints[p]["content_hash"] for p in report_files
+    )
+    if unchanged and not force and analysis.result_summary.exists():
+        logger.info(f"report files of {report_stats_file} are unchanged since the last import, skipping")
+        result = stats.as_dict()
+        result.update({"loader": loader, "skipped": True, "runs": 0})
+        return result
+
+    stats_data = pd.read_csv(str(report_stats_file), sep="\t")
+    stats_data["file_path"] = stats_data["File.Name"].str.replace(folder_path, "", regex=False)
+    file_ids = dict(
+        File.objects.filter(file_path__in=stats_data["file_path"].unique().tolist()).values_list("file_path", "id")
+    )
+    missing = set(stats_data["file_path"]) - set(file_ids)
+    if missing:
+        logger.warning(f"{len(missing)} runs in {report_stats_file} have no matching file record and were skipped")
+
+    summaries = upsert_result_summaries(
+        analysis,
+        stats_data,
+        file_ids,
+        os.path.join(relative_folder, "report.stats.tsv"),
+        os.path.join(relative_folder, "report.log.txt"),
+    )
+    stats_data = stats_data[stats_data["file_path"].isin(file_ids.keys())].drop_duplicates("File.Name").set_index("File.Name")
+    run_names = stats_data.index.tolist()
+    precursor_matrix, precursor_runs = load_report_matrix(precursor_path, PRECURSOR_COLUMNS, run_names)
+    protein_group_matrix, protein_group_runs = load_report_matrix(protein_group_path, PROTEIN_GROUP_COLUMNS, run_names)
+    digests = run_digests(stats_data, [
+        (precursor_matrix, list(PRECURSOR_COLUMNS.keys()), precursor_runs),
+        (protein_group_matrix, list(PROTEIN_GROUP_COLUMNS.keys()), protein_group_runs),
+    ])
+
+    changed = [
+        run_name for run_name in run_names
+        if force or summaries[file_ids[stats_data.at[run_name, "file_path"]]].content_hash != digests[run_name]
+    ]
+    runs = pd.DataFrame({
+        "file_id": [file_ids[stats_data.at[r, "file_path"]] for r in changed],
+        "result_summary_id": [summaries[file_ids[stats_data.at[r, "file_path"]]].id for r in changed],
+    }, index=changed)
+
+    if len(runs) > 0:
+        interners = report_interners()
+        summary_ids = runs["result_summary_id"].tolist()
+        if write_db:
+            ensure_partitions(analysis.id)
+        PrecursorReportContent.objects.filter(analysis=analysis, result_summary_id__in=summary_ids).delete()
+        ProteinGroupReportContent.objects.filter(analysis=analysis, result_summary_id__in=summary_ids).delete()
+
+        ingest_matrix(
+            PrecursorReportContent,
+            precursor_matrix,
+            PRECURSOR_COLUMNS,
+            [r for r in precursor_runs if r in runs.index],
+            runs,
+            chunk_size=chunk_size,
+            stats=stats,
+            loader=loader,
+            result_store=result_store,
+            store_table=PRECURSOR_TABLE,
+            analysis_id=analysis.id,
+            write_db=write_db,
+            interners=interners,
+        )
+        ingest_matrix(
+            ProteinGroupReportContent,
+            protein_group_matrix,
+            PROTEIN_GROUP_COLUMNS,
+            [r for r in protein_group_runs if r in runs.index],
+            runs,
+            chunk_size=chunk_size,
+            stats=stats,
+            loader=loader,
+            result_store=result_store,
+            store_table=PROTEIN_GROUP_TABLE,
+            analysis_id=analysis.id,
+            write_db=write_db,
+            interners=interners,
+        )
+        changed_summaries = []
+        for run_name in changed:
+            summary = summaries[file_ids[stats_data.at[run_name, "file_path"]]]
+            summary.content_hash = digests[run_name]
+            changed_summaries.append(summary)
+        ResultSummary.objects.bulk_update(changed_summaries, ["content_hash"])
+    record_fingerprints(analysis, fingerprints)
+
+    result = stats.as_dict()
+    result.update({"loader": loader, "skipped": False, "runs": len(runs)})
+    logger.info(
+        f"ingested {result['rows']} rows for {len(runs)} of {len(run_names)} runs from {report_stats_file} "
+        f"with the {loader} loader in {result['elapsed']}s "
+        f"({result['rows_per_second']} rows/s, peak memory {result['peak_rss_mb']}MB)"
+    )
+    return result
@@ -0,0 +1,38 @@
+from catapult.logstore import append_chunk, next_line
+from catapult.models import CeleryTask
+from catapult.process import BufferedSink, send_log_message, LOG_FLUSH_LINES, LOG_FLUSH_INTERVAL
+
+
+class LogSink(BufferedSink):
+    """
+    Buffered sink for the output lines of a subprocess. Lines are queued by the reader loop without blocking,
+    a background thread stores them as one compressed LogChunk per flush and sends them to a channel group as one
+    log_message per flush, with the lines joined by newlines. A flush happens when max_lines are buffered
+    or when the oldest buffered line is older than max_delay seconds.
+    """
+
+    def __init__(self, task: CeleryTask | None, task_id: str = "", hostname: str = "", group: str | None = "analysis_log",
+                 max_lines: int = LOG_FLUSH_LINES, max_delay: float = LOG_FLUSH_INTERVAL):
+        """
+        :param task: the task the log chunks belong to, None to only broadcast the lines
+        :param task_id: task id sent with the channel messages
+        :param hostname: worker hostname sent with the channel messages
+        :param group: channel group the lines are sent to, None to only store the lines
+        :param max_lines: number of buffered lines that triggers a flush
+        :param max_delay: seconds a line can stay buffered
+        """
+        super().__init__(max_lines=max_lines, max_delay=max_delay, name=f"logsink-{task_id}")
+        self.task = task
+        self.task_id = task_id
+        self.hostname = hostname
+        self.group = group
+        self.line_number = None
+
+    def handle(self, lines: list[tuple[float, str]]):
+        if self.task is not None:
+            if self.line_number is None:
+                self.line_number = next_line(self.task)
+            append_chunk(self.task, lines, start_line=self.line_number)
+            self.line_number += len(lines)
+        if self.group is not None:
+            send_log_message(self.group, self.task_id, self.hostname, lines)
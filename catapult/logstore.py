@@ -0,0 +1,178 @@
+import gzip
+import json
+from datetime import datetime
+
+from django.db.models import QuerySet, Max
+from django.utils import timezone
+
+from catapult.models import CeleryTask, LogChunk, LogRecord
+
+# number of lines per chunk when converting LogRecord rows
+LOG_CHUNK_LINES = 1000
+
+
+def encode_lines(lines: list[tuple[float, str]]) -> bytes:
+    return gzip.compress(json.dumps(lines, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_chunk(chunk: LogChunk) -> list[tuple[float, str]]:
+    return json.loads(gzip.decompress(bytes(chunk.data)).decode("utf-8"))
+
+
+def next_line(task: CeleryTask) -> int:
+    return LogChunk.objects.filter(task=task).aggregate(end=Max("end_line"))["end"] or 0
+
+
+def append_chunk(task: CeleryTask, lines: list[tuple[float, str]], start_line: int = None) -> LogChunk:
+    """
+    Store lines as a new chunk at the end of the log of a task.
+    :param task: the task the lines belong to
+    :param lines: (timestamp, line) pairs in order
+    :param start_line: number of the first line, looked up from the existing chunks if not given
+    """
+    if start_line is None:
+        start_line = next_line(task)
+    return LogChunk.objects.create(
+        task=task,
+        start_line=start_line,
+        end_line=start_line + len(lines),
+        line_count=len(lines),
+        start_time=datetime.fromtimestamp(lines[0][0], tz=timezone.get_current_timezone()),
+        end_time=datetime.fromtimestamp(lines[-1][0], tz=timezone.get_current_timezone()),
+        data=encode_lines(lines),
+    )
+
+
+def chunk_lines(chunk: LogChunk) -> list[dict]:
+    """
+    Decompress a chunk into line dictionaries with their task, line number and timestamp.
+    """
+    return [
+        {
+            "task": chunk.task_id,
+            "line": chunk.start_line + offset,
+            "log": log,
+            "timestamp": timestamp,
+        } for offset, (timestamp, log) in enumerate(decode_chunk(chunk))
+    ]
+
+
+def line_records(lines: list[dict]) -> list[LogRecord]:
+    """
+    Unsaved LogRecord instances of chunked lines, so they are serialized like the rows written before the chunks.
+    Their id is None, the line number is kept in line.
+    """
+    tz = timezone.get_current_timezone()
+    records = []
+    for line in lines:
+        created_at = datetime.fromtimestamp(line["timestamp"], tz=tz)
+        record = LogRecord(task_id=line["task"], log=line["log"], created_at=created_at, updated_at=created_at)
+        record.line = line["line"]
+        records.append(record)
+    return records
+
+
+class LogLines:
+    """
+    A lazily evaluated, sliceable sequence of the lines stored in log chunks, usable with the rest framework
+    paginators. Only chunk metadata is loaded to count and locate lines, chunks are decompressed when a slice
+    touches them. Lines can be restricted to a line number and a time window, chunks entirely outside of the
+    window are skipped using their line and time ranges. A search keeps the lines containing it, case insensitive
+    like the search of the LogRecord rows, which decompresses every chunk to count them. Descending returns the
+    lines last first, which within a task is also by descending time.
+    """
+
+    def __init__(self, chunks: QuerySet, from_line: int = None, since: datetime = None, until: datetime = None,
+                 search: str = None, descending: bool = False):
+        if from_line is not None:
+            chunks = chunks.filter(end_line__gt=from_line)
+        if since is not None:
+            chunks = chunks.filter(end_time__gte=since)
+        if until is not None:
+            chunks = chunks.filter(start_time__lte=until)
+        self.chunks = chunks.order_by("-task_id", "-start_line") if descending else chunks.order_by("task_id", "start_line")
+        self.search = search.casefold() if search else None
+        self.descending = descending
+        self.from_line = from_line
+        self.since = since.timestamp() if since is not None else None
+        self.until = until.timestamp() if until is not None else None
+        self._entries = None
+
+    def is_partial(self, start_line: int, start_time: datetime, end_time: datetime) -> bool:
+        return (
+            (self.from_line is not None and start_line < self.from_line) or
+            (self.since is not None and start_time.timestamp() < self.since) or
+            (self.until is not None and end_time.timestamp() > self.until)
+        )
+
+    def visible(self, chunk: LogChunk) -> list[dict]:
+        lines = [
+            line for line in chunk_lines(chunk)
+            if (self.from_line is None or line["line"] >= self.from_line) and
+               (self.since is None or line["timestamp"] >= self.since) and
+               (self.until is None or line["timestamp"] <= self.until) and
+               (self.search is None or self.search in line["log"].casefold())
+        ]
+        return lines[::-1] if self.descending else lines
+
+    def entries(self) -> list[list]:
+        """
+        [chunk id, number of visible lines, visible lines of partially visible chunks or None]
+        """
+        if self._entries is None:
+            self._entries = []
+            if self.search is not None:
+                for chunk in self.chunks.iterator(chunk_size=50):
+                    lines = self.visible(chunk)
+                    if lines:
+                        self._entries.append([chunk.id, len(lines), lines])
+                return self._entries
+            for chunk_id, start_line, line_count, start_time, end_time in self.chunks.values_list(
+                    "id", "start_line", "line_count", "start_time", "end_time"):
+                if self.is_partial(start_line, start_time, end_time):
+                    lines = self.visible(LogChunk.objects.get(id=chunk_id))
+                    self._entries.append([chunk_id, len(lines), lines])
+                else:
+                    self._entries.append([chunk_id, line_count, None])
+        return self._entries
+
+    def count(self) -> int:
+        return sum(entry[1] for entry in self.entries())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        stop = item.stop if item.stop is not None else self.count()
+        wanted = []
+        position = 0
+        for entry in self.entries():
+            chunk_id, count, lines = entry
+            if position + count > start and position < stop:
+                wanted.append((position, entry))
+            position += count
+            if position >= stop:
+                break
+        to_load = [entry[0] for _, entry in wanted if entry[2] is None]
+        loaded = LogChunk.objects.in_bulk(to_load) if to_load else {}
+        result = []
+        for position, (chunk_id, count, lines) in wanted:
+            if lines is None:
+                lines = self.visible(loaded[chunk_id])
+            result.extend(lines[max(start - position, 0):stop - position])
+        return result
+
+
+def tail(chunks: QuerySet, n: int) -> list[dict]:
+    """
+    Return the last n lines, reading chunks backwards until enough lines are found.
+    """
+    lines = []
+    for chunk in chunks.order_by("-task_id", "-start_line").iterator(chunk_size=10):
+        lines = chunk_lines(chunk) + lines
+        if len(lines) >= n:
+            break
+    return lines[-n:] if n > 0 else []
@@ -0,0 +1,165 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from catapult.filters import split_terms
+
+TABLE = "catapult_search_benchmark"
+# the same rows with the gene names in a dictionary table, as stored since migration 0058
+KEYED_TABLE = f"{TABLE}_keyed"
+GENE_TABLE = f"{TABLE}_genes"
+
+# (FROM clause, condition matching one term, id column) of each layout, as compiled by Django
+FLAT = (TABLE, "UPPER((gene_names)::text) LIKE UPPER(%s)", "id")
+KEYED = (
+    f"{KEYED_TABLE} r LEFT OUTER JOIN {GENE_TABLE} g ON g.id = r.gene_names_key_id",
+    "UPPER((g.value)::text) LIKE UPPER(%s)",
+    "r.id",
+)
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the gene searches of the report endpoints on a synthetic table: with the gene names stored in the
+    rows, before and after a trigram index on them, and with the gene names in a dictionary table with the trigram
+    index on the dictionary. The sizes of the tables and indexes of both layouts are compared. The tables are
+    unlogged, filled with generated gene names and dropped at the end unless --keep is given. PostgreSQL only.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50_000_000,
+                            help="Number of rows of the synthetic table (default: %(default)r)")
+        parser.add_argument("--genes", type=int, default=20_000,
+                            help="Number of distinct gene names, each row has one to three of them (default: %(default)r)")
+        parser.add_argument("--query", action="append", dest="queries",
+                            help="Search to run, ;-separated genes are alternatives. Can be given several times")
+        parser.add_argument("--repeat", type=int, default=3,
+                            help="Runs of each query, the median is reported (default: %(default)r)")
+        parser.add_argument("--limit", type=int, default=20,
+                            help="Page size of the paged queries (default: %(default)r)")
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic table")
+
+    def handle(self, rows: int, genes: int, queries: list[str] = None, repeat: int = 3, limit: int = 20,
+               keep: bool = False, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("the benchmark needs PostgreSQL with the pg_trgm extension")
+        queries = queries or [
+            f"GENE{genes // 3:05d}",
+            f"GENE{genes // 3:05d};GENE{genes // 2:05d}",
+            # prefix shared by ten genes
+            f"GENE{genes // 3:05d}"[:-1],
+        ]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                self.create_table(cursor, rows, genes)
+                before = self.run_queries(cursor, queries, repeat, limit, FLAT)
+                started = time.monotonic()
+                cursor.execute(
+                    f"CREATE INDEX {TABLE}_gene_names_trgm ON {TABLE} USING gin (UPPER((gene_names)::text) gin_trgm_ops)"
+                )
+                index_seconds = time.monotonic() - started
+                cursor.execute(f"ANALYZE {TABLE}")
+                after = self.run_queries(cursor, queries, repeat, limit, FLAT)
+                self.create_keyed_tables(cursor)
+                keyed = self.run_queries(cursor, queries, repeat, limit, KEYED)
+                sizes = {table: self.table_size(cursor, table) for table in [TABLE, KEYED_TABLE, GENE_TABLE]}
+        finally:
+            if not keep:
+                with connection.cursor() as cursor:
+                    for table in [KEYED_TABLE, GENE_TABLE, TABLE]:
+                        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+        self.stdout.write(f"trigram index on the rows built in {index_seconds:.1f}s")
+        self.stdout.write(f"{'table':<40} {'table MB':>10} {'indexes MB':>10}")
+        for table, (table_bytes, index_bytes) in sizes.items():
+            self.stdout.write(f"{table:<40} {table_bytes / 1024 ** 2:>10.1f} {index_bytes / 1024 ** 2:>10.1f}")
+        flat = sum(sizes[TABLE])
+        dictionary = sum(sizes[KEYED_TABLE]) + sum(sizes[GENE_TABLE])
+        self.stdout.write(f"dictionary layout is {flat / dictionary:.1f}x smaller" if dictionary else "")
+        self.stdout.write(f"{'query':<32} {'kind':<6} {'seq ms':>10} {'trgm ms':>10} {'dict ms':>10}  plan (dictionary)")
+        for (query, kind), (scanned, _) in before.items():
+            indexed = after[(query, kind)][0]
+            dictionary_ms, plan = keyed[(query, kind)]
+            self.stdout.write(f"{query:<32} {kind:<6} {scanned:>10.1f} {indexed:>10.1f} {dictionary_ms:>10.1f}  {plan}")
+
+    def create_table(self, cursor, rows: int, genes: int):
+        self.stdout.write(f"creating {TABLE} with {rows} rows")
+        started = time.monotonic()
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {TABLE} (id bigserial PRIMARY KEY, gene_names text, protein_group text)")
+        gene = f"'GENE' || lpad((floor(random() * {genes}))::int::text, 5, '0')"
+        cursor.execute(
+            f"INSERT INTO {TABLE} (gene_names, protein_group) "
+            f"SELECT CASE WHEN i %% 3 = 0 THEN {gene} || ';' || {gene} "
+            f"WHEN i %% 7 = 0 THEN {gene} || ';' || {gene} || ';' || {gene} ELSE {gene} END, "
+            f"'P' || lpad((i %% {genes * 2})::text, 5, '0') "
+            f"FROM generate_series(1, %s) AS i",
+            [rows],
+        )
+        cursor.execute(f"ANALYZE {TABLE}")
+        self.stdout.write(f"created in {time.monotonic() - started:.1f}s")
+
+    def create_keyed_tables(self, cursor):
+        self.stdout.write(f"creating {GENE_TABLE} and {KEYED_TABLE}")
+        started = time.monotonic()
+        cursor.execute(f"DROP TABLE IF EXISTS {KEYED_TABLE}")
+        cursor.execute(f"DROP TABLE IF EXISTS {GENE_TABLE}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {GENE_TABLE} (id serial PRIMARY KEY, value text UNIQUE)")
+        cursor.execute(f"INSERT INTO {GENE_TABLE} (value) SELECT DISTINCT gene_names FROM {TABLE}")
+        cursor.execute(
+            f"CREATE UNLOGGED TABLE {KEYED_TABLE} (id bigint PRIMARY KEY, gene_names_key_id integer, protein_group text)"
+        )
+        cursor.execute(
+            f"INSERT INTO {KEYED_TABLE} (id, gene_names_key_id, protein_group) "
+            f"SELECT t.id, g.id, t.protein_group FROM {TABLE} t JOIN {GENE_TABLE} g ON g.value = t.gene_names"
+        )
+        cursor.execute(f"CREATE INDEX {KEYED_TABLE}_gene_names_key_id ON {KEYED_TABLE} (gene_names_key_id)")
+        cursor.execute(
+            f"CREATE INDEX {GENE_TABLE}_value_trgm ON {GENE_TABLE} USING gin (UPPER((value)::text) gin_trgm_ops)"
+        )
+        cursor.execute(f"ANALYZE {GENE_TABLE}")
+        cursor.execute(f"ANALYZE {KEYED_TABLE}")
+        self.stdout.write(f"created in {time.monotonic() - started:.1f}s")
+
+    def table_size(self, cursor, table: str) -> tuple[int, int]:
+        cursor.execute(f"SELECT pg_table_size('{table}'), pg_indexes_size('{table}')")
+        return cursor.fetchone()
+
+    def run_queries(self, cursor, queries: list[str], repeat: int, limit: int, layout: tuple[str, str, str]) -> dict:
+        """
+        Median execution time of each query as a page of limit rows ordered by id, as served by the report
+        endpoints, and as a count, with the scans in the plan.
+        :param layout: FLAT or KEYED
+        """
+        results = {}
+        source, match, id_column = layout
+        for query in queries:
+            terms = split_terms(query)
+            condition = " OR ".join([match] * len(terms))
+            params = [f"%{term}%" for term in terms]
+            for kind, sql in [
+                ("page", f"SELECT {id_column} FROM {source} WHERE {condition} ORDER BY {id_column} LIMIT {limit}"),
+                ("count", f"SELECT COUNT(*) FROM {source} WHERE {condition}"),
+            ]:
+                timings = []
+                plan = None
+                for _ in range(repeat):
+                    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+                    explained = cursor.fetchone()[0]
+                    if isinstance(explained, str):
+                        explained = json.loads(explained)
+                    timings.append(explained[0]["Execution Time"])
+                    plan = scan_types(explained[0]["Plan"])
+                results[(query, kind)] = (statistics.median(timings), plan)
+        return results
+
+
+def scan_types(plan: dict) -> str:
+    nodes = [plan["Node Type"]] if "Scan" in plan["Node Type"] else []
+    for child in plan.get("Plans", []):
+        nodes.append(scan_types(child))
+    return ",".join(node for node in nodes if node)
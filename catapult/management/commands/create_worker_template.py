@@ -21,6 +21,8 @@ class Command(BaseCommand):
             "type": "worker",
             "options": {
                 "concurrency": 1,
+                "cpu": None,
+                "memory": None,
                 "loglevel": "INFO",
                 "app": "catapult_backend",
                 "hostname": f"{worker_name}@{options['hostname']}",
@@ -8,16 +8,8 @@ from django.db.models import Q
 from django.utils.timezone import make_aware
 from django.db import transaction
 from catapult.models import Experiment, File, Analysis, CatapultRunConfig, ResultSummary
-from catapult.tasks import run_analysis, run_quant, run_diann, run_diann_worker
-
-
-def get_folder_size(folder_path):
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(folder_path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    return total_size
+from catapult.readiness import ReadinessScheduler, SWEEP_INTERVAL, check_files_ready, evaluate_configs, pending_configs
+from catapult.tasks import run_analysis, run_quant
 
 
 class Command(BaseCommand):
@@ -41,9 +33,26 @@ class Command(BaseCommand):
             action="store_true",
             help="Process using queue",
         )
+        parser.add_argument(
+            "--listen",
+            action="store_true",
+            help="Wait for file change notifications from the sentinel instead of polling the database",
+        )
+        parser.add_argument(
+            "--sweep-interval",
+            type=int,
+            default=SWEEP_INTERVAL,
+            help="Seconds between full checks of the database when listening for notifications (default: %(default)r)",
+        )
 
 
-    def handle(self, interval: int, threshold: int, queue: bool, *args, **options):
+    def handle(self, interval: int, threshold: int, queue: bool, listen: bool = False, sweep_interval: int = SWEEP_INTERVAL,
+               *args, **options):
+        if listen:
+            try:
+                ReadinessScheduler(threshold, queue=queue, sweep_interval=sweep_interval).run(fallback_interval=interval)
+            except KeyboardInterrupt:
+                quit(0)
         try:
             while True:
 
@@ -55,78 +64,9 @@ class Command(BaseCommand):
 
                 if files:
                     print(files)
-                    file_d = files.filter(experiment__vendor=".d")
-                    ready_files = files.filter(~Q(experiment__vendor=".d"))
-                    for r in ready_files:
-                        print(r.folder_watching_location.folder_path, r.file_path)
-                        if r.size == os.path.getsize(r.get_path()):
-                            r.ready_for_processing = True
-                            r.save()
-                    ready_files = list(ready_files)
-                    with transaction.atomic():
-                        for f in file_d:
-                            folder_size = get_folder_size(f.get_path())
-                            if folder_size == f.size:
-                                f.ready_for_processing = True
-                                ready_files.append(f)
-                            else:
-                                f.size = folder_size
-                            f.save()
-
-                configs = CatapultRunConfig.objects.filter(
-                    analysis__isnull=False,
-                    analysis__completed=False,
-                    analysis__processing=False,
-                )
-                for config in configs:
-
-                    if config.fasta_required:
-                        for fasta in config.fasta.all():
-                            if not fasta.ready:
-                                fasta.check_ready()
-
-                    if config.spectral_library_required:
-                        for lib in config.spectral_library.all():
-                            if not lib.ready:
-                                lib.check_ready()
-                    if config.check_fasta_ready() and config.check_spectral_library_ready():
-                        analysis = config.analysis.first()
-                        if analysis.total_files:
-                            if analysis.generated_quant.all().count() == analysis.total_files:
-                                commands = analysis.create_commands_from_config(dry_run=False, all_files=True)
-                                analysis.processing = True
-                                analysis.save()
-                                if len(commands) > 0:
-                                    if not queue:
-                                        run_diann(commands=commands, analysis_id=analysis.id, config_id=config.id)
-                                    else:
-                                        run_diann_worker.enqueue(commands=commands, analysis_id=analysis.id,
-                                                                 config_id=config.id)
-                            else:
-                                if analysis.generated_quant.all().count() < analysis.experiment.files.filter(
-                                    ready_for_processing=True).count():
-                                    commands = analysis.create_commands_from_config(dry_run=False)
-                                    analysis.processing = True
-                                    analysis.save()
-                                    if len(commands) > 0:
-                                        if not queue:
-                                            run_diann(commands=commands, analysis_id=analysis.id, config_id=config.id)
-                                        else:
-                                            run_diann_worker.enqueue(commands=commands, analysis_id=analysis.id,
-                                                                     config_id=config.id)
-                        else:
-                            if analysis.generated_quant.all().count() < analysis.experiment.files.filter(
-                                    ready_for_processing=True).count():
-                                commands = analysis.create_commands_from_config(dry_run=False)
-                                analysis.processing = True
-                                analysis.save()
-                                if len(commands) > 0:
-                                    if not queue:
-                                        run_diann(commands=commands, analysis_id=analysis.id, config_id=config.id)
-                                    else:
-                                        run_diann_worker.enqueue(commands=commands, analysis_id=analysis.id, config_id=config.id)
-
+                    check_files_ready(files, threshold)
 
+                evaluate_configs(pending_configs(), queue)
 
                     # experiments = Experiment.objects.filter(
                     #                    files__in=ready_files,
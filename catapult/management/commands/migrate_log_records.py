@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from catapult.logstore import LOG_CHUNK_LINES, append_chunk
+from catapult.models import CeleryTask, LogChunk, LogRecord
+
+
+class Command(BaseCommand):
+    """
+    A command that converts LogRecord rows into compressed log chunks, one task at a time
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-lines",
+            type=int,
+            default=LOG_CHUNK_LINES,
+            help="Number of lines per chunk (default: %(default)r)",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the LogRecord rows after converting them",
+        )
+
+    def handle(self, *args, chunk_lines: int = LOG_CHUNK_LINES, keep: bool = False, **options):
+        total = 0
+        for task in CeleryTask.objects.filter(logs__isnull=False).distinct().iterator():
+            with transaction.atomic():
+                records = LogRecord.objects.filter(task=task).order_by("id")
+                count = records.count()
+                # records predate the chunks written by the log sink, move existing chunks after them
+                LogChunk.objects.filter(task=task).update(start_line=F("start_line") + count, end_line=F("end_line") + count)
+                line = 0
+                buffer = []
+                for created_at, log in records.values_list("created_at", "log").iterator(chunk_size=chunk_lines):
+                    buffer.append((created_at.timestamp(), log))
+                    if len(buffer) >= chunk_lines:
+                        append_chunk(task, buffer, start_line=line)
+                        line += len(buffer)
+                        buffer = []
+                if buffer:
+                    append_chunk(task, buffer, start_line=line)
+                if not keep:
+                    records.delete()
+            total += count
+            self.stdout.write(f"{task.task_id}: {count} log records converted")
+        self.stdout.write(self.style.SUCCESS(f"{total} log records converted"))
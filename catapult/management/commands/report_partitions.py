@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catapult.partitions import report_models, is_partitioned, partitions, create_partition, default_analyses, \
+    orphan_partitions, default_partition, drop_partition
+
+
+class Command(BaseCommand):
+    """
+    Manage the partitions by analysis of the report tables on PostgreSQL. Without options the partitions are
+    listed. Analyses ingested before the tables were partitioned stay in the default partition until they are
+    moved to their own partition with --create or --migrate-default.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--create", type=int, nargs="+", metavar="ANALYSIS",
+                            help="Create the partitions of these analyses, moving their rows out of the default partition")
+        parser.add_argument("--migrate-default", action="store_true",
+                            help="Move every analysis of the default partition to its own partition")
+        parser.add_argument("--limit", type=int, default=None,
+                            help="Number of analyses moved by --migrate-default, the largest first")
+        parser.add_argument("--drop-orphans", action="store_true",
+                            help="Drop the partitions of analyses that no longer exist")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Show what --migrate-default or --drop-orphans would do")
+
+    def handle(self, create: list[int] = None, migrate_default: bool = False, limit: int = None,
+               drop_orphans: bool = False, dry_run: bool = False, *args, **options):
+        tables = [model._meta.db_table for model in report_models()]
+        if not all(is_partitioned(table) for table in tables):
+            raise CommandError("the report tables are not partitioned, this needs PostgreSQL and migration 0061")
+
+        if create:
+            for analysis_id in create:
+                for table in tables:
+                    created = create_partition(table, analysis_id)
+                    self.stdout.write(f"{table} analysis {analysis_id}: {'created' if created else 'exists'}")
+
+        if migrate_default:
+            for table in tables:
+                analyses = default_analyses(table, limit)
+                self.stdout.write(f"{table}: {len(analyses)} analyses to move out of {default_partition(table)}")
+                for analysis_id in analyses:
+                    if not dry_run:
+                        create_partition(table, analysis_id)
+                    self.stdout.write(f"  analysis {analysis_id}")
+
+        if drop_orphans:
+            for name in orphan_partitions():
+                if dry_run:
+                    self.stdout.write(f"would drop {name}")
+                elif drop_partition(name):
+                    self.stdout.write(f"dropped {name}")
+                else:
+                    self.stdout.write(f"could not drop {name}, the table is busy")
+
+        if not (create or migrate_default or drop_orphans):
+            for table in tables:
+                self.stdout.write(table)
+                for partition in partitions(table):
+                    label = "default" if partition["default"] else f"analysis {partition['analysis']}"
+                    self.stdout.write(
+                        f"  {partition['table']:<50} {label:<16} {partition['rows']:>12} rows "
+                        f"{partition['bytes'] / 1024 ** 2:>10.1f} MB"
+                    )
@@ -11,7 +11,11 @@ from django.db.models import Q
 from watchdog.observers.polling import PollingObserverVFS
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from catapult.models import File, FolderWatchingLocation, Experiment, CatapultRunConfig, ResultSummary
+from catapult.events import EventCoalescer, COALESCE_WINDOW, CREATED, MODIFIED, DELETED, MOVED
+from catapult.ingestion import REPORT_LOADERS
+from catapult.notify import notify, EXPERIMENT_CHANNEL
+from catapult.models import FolderWatchingLocation, Experiment, CatapultRunConfig, ResultSummary
+from catapult.scanner import SCAN_WORKERS, scan_tree, sync_files, get_extensions, load_scan_cache, save_scan_cache
 from catapult.util import extract_cmd_from_diann_log, convert_cmd_to_array, convert_cmd_array_to_config, \
     add_stats_and_report
 
@@ -36,192 +40,112 @@ def load_config_yaml(file_path, folder_watching_location):
                     config_file_path=file_path,
                     folder_watching_location=folder_watching_location,
                 )
+                notify(EXPERIMENT_CHANNEL, [exp[0].id])
                 logger.info(f"config file {file_path} loaded successfully")
 
-def get_folder_size(folder_path):
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(folder_path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    return total_size
-
-def initial_scan(folder_watching_location: FolderWatchingLocation):
-    for root, dirs, files in os.walk(folder_watching_location.folder_path):
-        for file in files:
-            if folder_watching_location.ignore_term in file:
-                continue
-            extension = os.path.splitext(file)[1]
-            file_path = os.path.join(root, file)
-            if extension in folder_watching_location.extensions:
-                if file_path.endswith(".converted.mzML"):
-                    file_size = os.path.getsize(file_path)
-                    modified_time = os.path.getmtime(file_path)
-                    created_time = os.path.getctime(file_path)
-                    try:
-                        file = File.objects.get(file_path=file_path.replace(folder_watching_location.folder_path, ""))
-                        file.size = file_size
-                        file.save()
-                    except File.DoesNotExist:
-                        file_location = file_path
-                        if file.endswith(".d"):
-                            root, file = os.path.split(file_path)
-                            parent_folder = os.path.dirname(root)
-                            file_location = root
-                            file_size = get_folder_size(file_location)
-                        else:
-                            parent_folder = os.path.dirname(file_path)
-                        exp = Experiment.objects.get_or_create(experiment_name=parent_folder)
-                        file = File.objects.create(
-                            file_path=file_location.replace(folder_watching_location.folder_path, ""),
-                            folder_watching_location=folder_watching_location,
-                            size=file_size,
-                            experiment=exp[0],
-                        )
-            elif file.endswith(".cat.yml") or file.endswith(".cat.yaml"):
-                load_config_yaml(file_path, folder_watching_location)
-            elif file.endswith("report.stats.tsv"):
-                #check if the file is already in the database
-                file_path_from_watch = file_path.replace(folder_watching_location.folder_path, "")
-                if not ResultSummary.objects.filter(stats_file=file_path_from_watch).exists():
-                    #check if report.log.txt exists in the same folder
-                    report_log = os.path.join(root, "report.log.txt")
-                    experiment, prefix = os.path.split(root)
-                    experiment_obj = Experiment.objects.get_or_create(experiment_name=experiment)[0]
-                    cat_config = CatapultRunConfig.objects.filter(content__prefix=prefix, experiment=experiment_obj)
-                    print(cat_config)
-                    if not cat_config.exists():
-                        cat_file = os.path.join(experiment, f"{uuid.uuid4().hex}.cat.yml")
-                        if os.path.exists(report_log):
-                            cmd = extract_cmd_from_diann_log(report_log)
-                            cmd_array = convert_cmd_to_array(cmd)
-                            config = convert_cmd_array_to_config(cmd_array)
-                            config["prefix"] = prefix
-
-                            config_obj = CatapultRunConfig(
-                                content=config,
-                                folder_watching_location=folder_watching_location,
-                                experiment=experiment_obj,
-                                config_file_path=cat_file,
-                            )
-                            with open(cat_file, "w") as f:
-                                yaml.dump(config, f)
-                            config_obj.save()
-                        else:
-                            continue
-                    else:
-                        config_obj = cat_config.first()
-                    add_stats_and_report(
-                        analysis=config_obj.analysis.first(),
-                        config=config_obj,
-                        parent_folder=os.path.dirname(config_obj.config_file_path),
-                        report_stats_file=file_path
-                    )
+def import_report_stats(file_path: str, folder_watching_location: FolderWatchingLocation, loader: str = None):
+    root = os.path.dirname(file_path)
+    #check if report.log.txt exists in the same folder
+    report_log = os.path.join(root, "report.log.txt")
+    experiment, prefix = os.path.split(root)
+    experiment_obj = Experiment.objects.get_or_create(experiment_name=experiment)[0]
+    cat_config = CatapultRunConfig.objects.filter(content__prefix=prefix, experiment=experiment_obj)
+    if not cat_config.exists():
+        cat_file = os.path.join(experiment, f"{uuid.uuid4().hex}.cat.yml")
+        if os.path.exists(report_log):
+            cmd = extract_cmd_from_diann_log(report_log)
+            cmd_array = convert_cmd_to_array(cmd)
+            config = convert_cmd_array_to_config(cmd_array)
+            config["prefix"] = prefix
+
+            config_obj = CatapultRunConfig(
+                content=config,
+                folder_watching_location=folder_watching_location,
+                experiment=experiment_obj,
+                config_file_path=cat_file,
+            )
+            with open(cat_file, "w") as f:
+                yaml.dump(config, f)
+            config_obj.save()
+        else:
+            return
+    else:
+        config_obj = cat_config.first()
+    add_stats_and_report(
+        analysis=config_obj.analysis.first(),
+        config=config_obj,
+        parent_folder=os.path.dirname(config_obj.config_file_path),
+        report_stats_file=file_path,
+        loader=loader
+    )
+
+
+def initial_scan(folder_watching_location: FolderWatchingLocation, loader: str = None, max_workers: int = SCAN_WORKERS, full_scan: bool = False):
+    """
+    Reconcile the files of a folder watching location with the database. Directories whose modification time
+    did not change since the last scan are taken from the scan-state cache, unless full_scan is set.
+    """
+    started = time.perf_counter()
+    cache = None if full_scan else load_scan_cache(folder_watching_location)
+    result = scan_tree(
+        folder_watching_location.folder_path,
+        get_extensions(folder_watching_location),
+        folder_watching_location.ignore_term,
+        max_workers=max_workers,
+        cache=cache
+    )
+    logger.info(
+        f"scanned {result.entries} entries in {result.directories} folders of {folder_watching_location.folder_path} "
+        f"({result.cached_directories} unchanged) in {result.elapsed:.2f}s ({result.entries_per_second:.1f} files/s)"
+    )
+    counts = sync_files(folder_watching_location, result.changed_acquisitions, removed=result.removed_acquisitions)
+    logger.info(
+        f"{counts['created']} files created, {counts['updated']} files updated and {counts['deleted']} files deleted "
+        f"for {folder_watching_location.folder_path}"
+    )
+    if counts["refused"]:
+        # keep the previous cache, so the removals are found again on the next scan
+        result.listings = []
+        result.removed_directories = []
+    for file_path in result.configs:
+        load_config_yaml(file_path, folder_watching_location)
+    for file_path in result.stats_files:
+        import_report_stats(file_path, folder_watching_location, loader=loader)
+    logger.info(f"initial scan of {folder_watching_location.folder_path} completed in {time.perf_counter() - started:.2f}s")
+    return result
 
 class Watcher(FileSystemEventHandler):
-    def __init__(self, folder: FolderWatchingLocation, *args, **kwargs):
-        initial_scan(folder)
+    def __init__(self, folder: FolderWatchingLocation, *args, loader: str = None, scan_workers: int = SCAN_WORKERS,
+                 full_scan: bool = False, debounce: float = COALESCE_WINDOW, **kwargs):
+        result = initial_scan(folder, loader=loader, max_workers=scan_workers, full_scan=full_scan)
+        save_scan_cache(folder, result)
         self.folder_path = folder.folder_path
         self.file_extensions = set(folder.extensions.split(","))
         self.ignore_term = folder.ignore_term
         self.network_folder = folder.network_folder
         self.folder_watching_location = folder
+        self.events = EventCoalescer(
+            folder,
+            window=debounce,
+            on_config=lambda file_path: load_config_yaml(file_path, folder),
+        )
+        self.events.start()
         super().__init__(*args, **kwargs)
 
-    def process_file(self, file_path):
-        file_size = os.path.getsize(file_path)
-        modified_time = os.path.getmtime(file_path)
-        created_time = os.path.getctime(file_path)
-        return file_size, modified_time, created_time
-
-
     def on_created(self, event):
-        if self.ignore_term in event.src_path:
-            return
-        if event.is_directory:
-            return
-        extension = os.path.splitext(event.src_path)[1]
-
-        if extension in self.file_extensions:
-            file_size, modified_time, created_time = self.process_file(event.src_path)
-            # get parent folder
-            try:
-                file = File.objects.get(file_path=event.src_path.replace(self.folder_path, ""))
-                file.size = file_size
-                file.save()
-            except File.DoesNotExist:
-                file_location = event.src_path
-                if event.src_path.endswith(".d"):
-                    root, file = os.path.split(event.src_path)
-                    parent_folder = os.path.dirname(root)
-                    file_location = root
-                    file_size = get_folder_size(file_location)
-                else:
-                    parent_folder = os.path.dirname(event.src_path)
-                exp = Experiment.objects.get_or_create(experiment_name=parent_folder)
-                file = File.objects.create(
-                    file_path=file_location.replace(self.folder_path, ""),
-                    folder_watching_location=self.folder_watching_location,
-                    size=file_size,
-                    experiment=exp[0],
-                )
-
-            print(f"{event.src_path} has been created at {modified_time}")
-
-        elif event.src_path.endswith(".cat.yml") or event.src_path.endswith(".cat.yaml"):
-            print(event.src_path)
-            load_config_yaml(event.src_path, self.folder_watching_location)
+        self.events.submit(CREATED, event.src_path)
 
     def on_deleted(self, event):
-        if self.folder_watching_location.ignore_term in event.src_path:
-            return
-        File.objects.filter(file_path=event.src_path).delete()
+        self.events.submit(DELETED, event.src_path)
         logger.info(f"{event.src_path} has been deleted at {datetime.datetime.now()}")
 
     def on_modified(self, event):
-        logger.info(f"{event.src_path} has been modified at {datetime.datetime.now()}")
-        if self.folder_watching_location.ignore_term in event.src_path:
-            return
         if event.is_directory:
             return
-        extension = os.path.splitext(event.src_path)[1]
-        if extension in self.file_extensions:
-            file_size, modified_time, created_time = self.process_file(event.src_path)
-            try:
-                file = File.objects.get(file_path=event.src_path.replace(self.folder_path, ""))
-                file.size = file_size
-                file.save()
-            except File.DoesNotExist:
-                file_location = event.src_path
-                if event.src_path.endswith(".d"):
-                    root, file = os.path.split(event.src_path)
-                    parent_folder = os.path.dirname(root)
-                    file_location = root
-                    file_size = get_folder_size(file_location)
-                else:
-                    parent_folder = os.path.dirname(event.src_path)
-                exp = Experiment.objects.get_or_create(experiment_name=parent_folder)
-                file = File.objects.create(
-                    file_path=file_location.replace(self.folder_path, ""),
-                    folder_watching_location=self.folder_watching_location,
-                    experiment=exp[0],
-                    size=file_size,
-                )
-        elif event.src_path.endswith(".cat.yml") or event.src_path.endswith(".cat.yaml"):
-            print(event.src_path)
-            load_config_yaml(event.src_path, self.folder_watching_location)
+        self.events.submit(MODIFIED, event.src_path)
+
     def on_moved(self, event):
-        print(event)
-        if self.folder_watching_location.ignore_term in event.src_path:
-            return
-        if event.is_directory:
-            if not event.src_path.endswith(".d"):
-                return
-        extension = os.path.splitext(event.src_path)[1]
-        if extension in self.file_extensions:
-            File.objects.filter(file_path=event.src_path).update(file_path=event.dest_path)
-        elif event.dest_path.endswith(".cat.yml") or event.dest_path.endswith(".cat.yaml"):
-            load_config_yaml(event.dest_path, self.folder_watching_location)
+        self.events.submit(MOVED, event.src_path, event.dest_path)
         logger.info(f"{event.src_path} has been moved to {event.dest_path} at {datetime.datetime.now()}")
 
 
@@ -230,7 +154,34 @@ class Command(BaseCommand):
     A command that watch a folder, check if the folder is a network folder and load data from provided txt files
     """
 
-    def handle(self, *args, **options):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loader",
+            type=str,
+            choices=REPORT_LOADERS,
+            default=None,
+            help="Loader used to import report content found during the initial scan (default: settings.REPORT_LOADER)",
+        )
+        parser.add_argument(
+            "--scan-workers",
+            type=int,
+            default=SCAN_WORKERS,
+            help="Number of threads used to walk each folder during the initial scan (default: %(default)r)",
+        )
+        parser.add_argument(
+            "--full-scan",
+            action="store_true",
+            help="List every folder during the initial scan instead of reusing the scan-state of unchanged folders",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=COALESCE_WINDOW,
+            help="Seconds a file has to stop changing before its file system events are written to the database (default: %(default)r)",
+        )
+
+    def handle(self, *args, loader: str = None, scan_workers: int = SCAN_WORKERS, full_scan: bool = False,
+               debounce: float = COALESCE_WINDOW, **options):
         observers = []
         logging_path = "sentinel.log"
         logger.setLevel(logging.INFO)
@@ -243,25 +194,28 @@ class Command(BaseCommand):
             handler.setLevel(logging.INFO)
             logger.addHandler(handler)
         logger.info(f"Logging to {logging_path}")
+        started = time.perf_counter()
         for f in FolderWatchingLocation.objects.all():
-            w = Watcher(f)
+            w = Watcher(f, loader=loader, scan_workers=scan_workers, full_scan=full_scan, debounce=debounce)
             if w.network_folder:
                 observer = PollingObserverVFS(os.stat, os.scandir, 1)
             else:
                 observer = Observer()
             observer.schedule(w, f.folder_path, recursive=True)
 
-            observers.append(observer)
+            observers.append((observer, w))
             observer.start()
+        logger.info(f"sentinel started in {time.perf_counter() - started:.2f}s")
         try:
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
             logger.info("Stopping observers")
-            for observer in observers:
+            for observer, _ in observers:
                 observer.unschedule_all()
                 observer.stop()
-        for observer in observers:
+        for observer, watcher in observers:
             observer.join()
+            watcher.events.stop()
 
 
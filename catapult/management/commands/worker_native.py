@@ -2,82 +2,237 @@ import json
 import logging
 import platform
 import random
+import threading
 import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, Future
 from types import FrameType
 from typing import Optional
 
 import psutil
 from django.core.management import BaseCommand
-from django.db import transaction
+from django.db import transaction, close_old_connections
+from django.utils import timezone
 from django_tasks import DEFAULT_QUEUE_NAME, DEFAULT_TASK_BACKEND_ALIAS
 from django_tasks.backends.database.management.commands.db_worker import valid_interval, valid_backend_name, logger, \
     Worker
 from django_tasks.backends.database.models import DBTaskResult
 
 from catapult.models import CeleryWorker, CeleryTask
+from catapult.notify import Listener, TASK_CHANNEL
+from catapult.scheduling import candidate_ids, rank_tasks
+from catapult.placement import PlacementEngine, task_profile, PLACEMENT_GRACE
+from catapult.slots import TaskCost, WorkerCapacity, task_cost
+
+# seconds between two heartbeats of an idle worker
+HEARTBEAT_INTERVAL = 15.0
+# number of ready tasks considered when looking for one that fits the free capacity
+CLAIM_CANDIDATES = 20
+# seconds between two checks for ready tasks while the worker is woken up by notifications
+FALLBACK_INTERVAL = 30.0
+# seconds the listener blocks before checking whether the worker is still running
+LISTEN_TIMEOUT = 5.0
 
 logger = logging.getLogger("catapult.worker")
 
 
 class CatapultWorker(Worker):
+    """
+    Database task worker that runs up to capacity.slots tasks at the same time. Each task runs in its own thread,
+    the work of the analysis tasks happens in the DIA-NN subprocess it starts. A task is only claimed when its
+    cpu and memory cost fits the free capacity of the worker, the cost comes from the threads of its run config
+    and the size of its input files. Tasks expected to run clearly faster on another online worker with a free slot
+    are left to it, see PlacementEngine. The worker records a heartbeat and the task of every slot on its CeleryWorker.
+    On Postgres a listener thread waits for the notification sent when a task is enqueued and wakes the worker up,
+    ready tasks are then only polled every fallback_interval seconds in case a notification was missed. Other
+    databases are polled every interval seconds.
+    """
+
     def __init__(self, *args, **kwargs):
-        self.c_worker: CeleryWorker = kwargs["c_worker"]
-        kwargs.pop("c_worker")
+        self.c_worker: CeleryWorker = kwargs.pop("c_worker")
+        self.capacity: WorkerCapacity = kwargs.pop("capacity", None) or WorkerCapacity()
+        self.heartbeat_interval: float = kwargs.pop("heartbeat_interval", HEARTBEAT_INTERVAL)
+        self.fallback_interval: float = kwargs.pop("fallback_interval", FALLBACK_INTERVAL)
+        self.placement = PlacementEngine(self.c_worker, grace=kwargs.pop("placement_grace", PLACEMENT_GRACE))
         super().__init__(*args, **kwargs)
-
+        self.executor = ThreadPoolExecutor(max_workers=self.capacity.slots, thread_name_prefix="slot")
+        self.slots: dict[int, dict] = {}
+        self.futures: dict[Future, int] = {}
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.last_heartbeat = 0.0
+        self.last_poll = 0.0
+        self.listening = False
+        self.listener_ready = threading.Event()
+
+    def ready_tasks(self):
+        tasks = DBTaskResult.objects.ready().filter(backend_name=self.backend_name)
+        if not self.process_all_queues:
+            tasks = tasks.filter(queue_name__in=self.queue_names)
+        return tasks
+
+    def claim(self) -> tuple[DBTaskResult | None, TaskCost | None]:
+        """
+        Lock the highest priority and the longest waiting ready tasks, rank them by priority with aging and
+        fair share between folder watching locations, and claim the first one whose cost fits the free capacity.
+        """
+        ids = candidate_ids(self.ready_tasks(), CLAIM_CANDIDATES)
+        if not ids:
+            return None, None
+        # During this transaction, the candidate tasks are locked. Therefore, it's important
+        # it be as efficient as possible.
+        with transaction.atomic():
+            candidates = list(self.ready_tasks().filter(id__in=ids).select_for_update(skip_locked=True))
+            self.placement.refresh()
+            for _, task_result in rank_tasks(candidates):
+                cost = task_cost(task_result)
+                if not self.placement.should_claim(task_result, task_profile(task_result, memory=cost.memory)):
+                    continue
+                cost = cost.clamp(self.capacity)
+                if not self.capacity.fits(cost):
+                    continue
+                # "claim" the task, so it isn't run by another worker process
+                if "task_id" in task_result.args_kwargs["kwargs"]:
+                    ui = task_result.args_kwargs["kwargs"]["task_id"]
+                    c_task = CeleryTask.objects.get_or_create(task_id=ui)[0]
+                    c_task.task_id = str(task_result.id)
+                else:
+                    c_task = CeleryTask.objects.get_or_create(task_id=str(task_result.id))[0]
+                    c_task.status = "PENDING"
+                    task_result.args_kwargs["kwargs"]["task_id"] = c_task.task_id
+                task_result.args_kwargs["kwargs"]["worker_hostname"] = self.c_worker.worker_hostname
+                task_result.save(update_fields=["args_kwargs"])
+                c_task.save()
+                self.c_worker.tasks.add(c_task)
+
+                task_result.claim()
+                return task_result, cost
+        return None, None
+
+    def submit(self, task_result: DBTaskResult, cost: TaskCost):
+        with self.lock:
+            slot = self.capacity.reserve(cost)
+            self.slots[slot] = {
+                "task_id": str(task_result.id),
+                "task_path": task_result.task_path,
+                "started_at": timezone.now().isoformat(),
+                **cost.to_dict(),
+            }
+        logger.info(f"Slot {slot} running task {task_result.id} ({cost})")
+        future = self.executor.submit(self.run_slot, task_result)
+        self.futures[future] = slot
+        future.add_done_callback(lambda _: self.wake.set())
+        self.heartbeat(force=True)
+
+    def run_slot(self, task_result: DBTaskResult):
+        try:
+            self.run_task(task_result)
+        finally:
+            close_old_connections()
+
+    def reap(self) -> int:
+        """
+        Release the slots of finished tasks.
+        """
+        finished = [future for future in self.futures if future.done()]
+        for future in finished:
+            slot = self.futures.pop(future)
+            with self.lock:
+                self.capacity.release(slot)
+                self.slots.pop(slot, None)
+        if finished:
+            self.heartbeat(force=True)
+        return len(finished)
+
+    def listen(self):
+        """
+        Wake the worker up when a task is enqueued on one of its queues.
+        """
+        try:
+            with Listener(TASK_CHANNEL) as listener:
+                self.listening = listener.listening
+                self.listener_ready.set()
+                while self.listening and self.running:
+                    for _, queue_name in listener.wait(LISTEN_TIMEOUT):
+                        if self.process_all_queues or queue_name in self.queue_names:
+                            self.wake.set()
+        except Exception as e:
+            logger.exception(f"Listening for enqueued tasks failed, polling every {self.interval} seconds: {e}")
+        finally:
+            self.listening = False
+            self.listener_ready.set()
+            close_old_connections()
+
+    def start_listener(self):
+        threading.Thread(target=self.listen, name="task-listener", daemon=True).start()
+        self.listener_ready.wait()
+
+    def wait_for_tasks(self) -> bool:
+        """
+        Sleep until a task is enqueued, a slot is released or the polling interval expires.
+        :return: True if the ready tasks should be checked
+        """
+        if not self.listening:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            return True
+        timeout = min(self.fallback_interval - (time.monotonic() - self.last_poll), self.heartbeat_interval)
+        woken = self.wake.wait(max(timeout, 0))
+        self.wake.clear()
+        return woken or time.monotonic() - self.last_poll >= self.fallback_interval
+
+    def heartbeat(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_heartbeat < self.heartbeat_interval:
+            return
+        self.last_heartbeat = now
+        with self.lock:
+            slots = {
+                "capacity": self.capacity.to_dict(),
+                "running": [{"slot": slot, **info} for slot, info in sorted(self.slots.items())],
+            }
+        CeleryWorker.objects.filter(id=self.c_worker.id).update(heartbeat=timezone.now(), slots=slots)
 
     def start(self) -> None:
         self.configure_signals()
 
-        logger.info("Starting worker for queues=%s", ",".join(self.queue_names))
+        logger.info("Starting worker for queues=%s with %s slots", ",".join(self.queue_names), self.capacity.slots)
 
         if self.interval:
             # Add a random small delay before starting the loop to avoid a thundering herd
             time.sleep(random.random())
 
-        while self.running:
-            tasks = DBTaskResult.objects.ready().filter(backend_name=self.backend_name)
-            if not self.process_all_queues:
-                tasks = tasks.filter(queue_name__in=self.queue_names)
-
-            try:
-                self.running_task = True
-
-                # During this transaction, all "ready" tasks are locked. Therefore, it's important
-                # it be as efficient as possible.
-                with transaction.atomic():
-                    task_result = tasks.get_locked()
-
-                    if task_result is not None:
-                        # "claim" the task, so it isn't run by another worker process
-                        if "task_id" in task_result.args_kwargs["kwargs"]:
-                            ui = task_result.args_kwargs["kwargs"]["task_id"]
-                            c_task = CeleryTask.objects.get_or_create(task_id=ui)[0]
-                            c_task.task_id = str(task_result.id)
-                        else:
-                            c_task = CeleryTask.objects.get_or_create(task_id=str(task_result.id))[0]
-                            c_task.status = "PENDING"
-                            task_result.args_kwargs["kwargs"]["task_id"] = c_task.task_id
-                        task_result.args_kwargs["kwargs"]["worker_hostname"] = self.c_worker.worker_hostname
-                        task_result.save(update_fields=["args_kwargs"])
-                        c_task.save()
-                        self.c_worker.tasks.add(c_task)
-
-                        task_result.claim()
+        if not self.batch:
+            self.start_listener()
+
+        poll = True
+        try:
+            while self.running:
+                self.reap()
+                task_result = None
+                if poll and self.capacity.free_slot() is not None:
+                    try:
+                        self.running_task = True
+                        task_result, cost = self.claim()
+                        self.last_poll = time.monotonic()
+                        if task_result is not None:
+                            self.submit(task_result, cost)
+                    finally:
+                        self.running_task = bool(self.futures)
 
                 if task_result is not None:
-                    self.run_task(task_result)
+                    # try to fill the remaining slots right away
+                    continue
 
-            finally:
-                self.running_task = False
+                if self.batch and not self.futures:
+                    # If we're running in "batch" mode, terminate the loop (and thus the worker)
+                    return None
 
-            if self.batch and task_result is None:
-                # If we're running in "batch" mode, terminate the loop (and thus the worker)
-                return None
-
-            # Wait before checking for another task
-            time.sleep(self.interval)
+                self.heartbeat()
+                poll = self.wait_for_tasks()
+        finally:
+            self.executor.shutdown(wait=True)
+            self.reap()
 
     def shutdown(self, signum: int, frame: Optional[FrameType]) -> None:
         self.c_worker.worker_info = get_system_info()
@@ -85,6 +240,7 @@ class CatapultWorker(Worker):
         self.c_worker.save()
 
         super().shutdown(signum, frame)
+        self.wake.set()
 
 
 def get_size(bytes, suffix="B"):
@@ -151,6 +307,36 @@ class Command(BaseCommand):
             type=str,
             help="Path to the worker config file",
         )
+        parser.add_argument(
+            "--fallback-interval",
+            type=float,
+            default=FALLBACK_INTERVAL,
+            help="The interval (in seconds) at which to check for tasks while notifications of enqueued tasks are received (default: %(default)r)",
+        )
+        parser.add_argument(
+            "--placement-grace",
+            type=float,
+            default=PLACEMENT_GRACE,
+            help="Seconds after which a task is taken even if another worker is expected to run it faster (default: %(default)r)",
+        )
+        parser.add_argument(
+            "--slots",
+            type=int,
+            default=None,
+            help="Number of tasks run at the same time (default: the concurrency option of the worker config)",
+        )
+        parser.add_argument(
+            "--cpu",
+            type=int,
+            default=None,
+            help="Number of cpu cores tasks can reserve (default: the cpu option of the worker config or all cores)",
+        )
+        parser.add_argument(
+            "--memory",
+            type=float,
+            default=None,
+            help="Gigabytes of memory tasks can reserve (default: the memory option of the worker config or all memory)",
+        )
 
     def configure_logging(self, verbosity: int, logging_path: str) -> None:
         logger = logging.getLogger(f"catapult.worker{logging_path}")
@@ -186,6 +372,11 @@ class Command(BaseCommand):
         batch: bool,
         backend_name: str,
             config: str,
+        fallback_interval: float = FALLBACK_INTERVAL,
+        placement_grace: float = PLACEMENT_GRACE,
+        slots: int = None,
+        cpu: int = None,
+        memory: float = None,
         **options: dict,
     ) -> None:
         print(verbosity)
@@ -194,18 +385,28 @@ class Command(BaseCommand):
         self.configure_logging(verbosity, config["options"]["logfile"])
         cWorker = CeleryWorker.objects.get_or_create(worker_name=config["name"], worker_hostname=config["options"]["hostname"])[0]
         cWorker.worker_params = config
+        cWorker.folder_path_translations = config.get("folder_path_translations") or None
         cWorker.worker_info = get_system_info()
         cWorker.worker_status = "ONLINE"
         for task in cWorker.tasks.all():
             cWorker.tasks.remove(task)
         cWorker.save()
 
+        memory = memory if memory is not None else config["options"].get("memory")
+        capacity = WorkerCapacity(
+            slots=max(slots or int(config["options"].get("concurrency", 1)), 1),
+            cpu=cpu or config["options"].get("cpu"),
+            memory=int(memory * 1024 ** 3) if memory else None,
+        )
         worker = CatapultWorker(
             queue_names=queue_name.split(","),
             interval=interval,
             batch=batch,
             backend_name=backend_name,
-            c_worker=cWorker
+            c_worker=cWorker,
+            capacity=capacity,
+            fallback_interval=fallback_interval,
+            placement_grace=placement_grace,
         )
 
         worker.start()
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0044_analysis_analysis_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultsummary',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReportFileFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('file_path', models.TextField()),
+                ('size', models.BigIntegerField()),
+                ('modified_time', models.FloatField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_fingerprints', to='catapult.analysis')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('analysis', 'file_path')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0045_reportfilefingerprint_resultsummary_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryScanState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('path', models.TextField()),
+                ('modified_time', models.FloatField()),
+                ('scan_signature', models.TextField(blank=True, default='')),
+                ('entries', models.JSONField(default=dict)),
+                ('folder_watching_location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='directory_states', to='catapult.folderwatchinglocation')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('folder_watching_location', 'path')},
+            },
+        ),
+    ]
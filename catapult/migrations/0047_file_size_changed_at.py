@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0046_directoryscanstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='size_changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0047_file_size_changed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('start_line', models.IntegerField()),
+                ('end_line', models.IntegerField()),
+                ('line_count', models.IntegerField()),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('data', models.BinaryField()),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_chunks', to='catapult.celerytask')),
+            ],
+            options={
+                'ordering': ['task', 'start_line'],
+                'indexes': [models.Index(fields=['task', 'start_line'], name='catapult_lo_task_id_b6bf33_idx'), models.Index(fields=['task', 'end_time'], name='catapult_lo_task_id_6b3f10_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0048_logchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerytask',
+            name='exit_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='celerytask',
+            name='resource_usage',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0049_celerytask_exit_code_resource_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskResourceSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('cpu_percent', models.FloatField()),
+                ('rss', models.BigIntegerField()),
+                ('read_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('write_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('threads', models.IntegerField()),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resource_samples', to='catapult.celerytask')),
+            ],
+            options={
+                'ordering': ['task', 'timestamp'],
+                'indexes': [models.Index(fields=['task', 'timestamp'], name='catapult_ta_task_id_d4651b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0050_taskresourcesample'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerytask',
+            name='progress',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0051_celerytask_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celeryworker',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='celeryworker',
+            name='slots',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
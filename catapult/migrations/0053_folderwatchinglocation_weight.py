@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0052_celeryworker_heartbeat_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folderwatchinglocation',
+            name='weight',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
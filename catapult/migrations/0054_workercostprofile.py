@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 05:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0053_folderwatchinglocation_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerCostProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('engine', models.CharField(max_length=50)),
+                ('seconds_per_gb', models.FloatField()),
+                ('runs', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_profiles', to='catapult.celeryworker')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('worker', 'engine')},
+            },
+        ),
+    ]
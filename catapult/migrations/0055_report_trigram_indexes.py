@@ -0,0 +1,46 @@
+from django.db import migrations
+
+# Django turns icontains into UPPER(column::text) LIKE UPPER(%s) on PostgreSQL, the indexes are built on the
+# same expression so the report filters and searches can use them.
+TRIGRAM_INDEXES = [
+    ("catapult_precursorreportcontent", "gene_names"),
+    ("catapult_precursorreportcontent", "protein_group"),
+    ("catapult_precursorreportcontent", "precursor_id"),
+    ("catapult_proteingroupreportcontent", "gene_names"),
+    ("catapult_proteingroupreportcontent", "protein_group"),
+]
+
+
+def index_name(table, column):
+    return f"{table.removeprefix('catapult_')}_{column}_trgm"
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index_name(table, column)}" '
+            f'ON "{table}" USING gin (UPPER(("{column}")::text) gin_trgm_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name(table, column)}"')
+
+
+class Migration(migrations.Migration):
+    # indexes are built concurrently, so the report tables stay writable while they are built
+    atomic = False
+
+    dependencies = [
+        ('catapult', '0054_workercostprofile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,113 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# the trigram indexes of 0055 on the report text columns, the columns are removed in 0058 and the searches match
+# the dictionary values indexed in 0059
+TRIGRAM_INDEXES = [
+    ("catapult_precursorreportcontent", "gene_names"),
+    ("catapult_precursorreportcontent", "protein_group"),
+    ("catapult_precursorreportcontent", "precursor_id"),
+    ("catapult_proteingroupreportcontent", "gene_names"),
+    ("catapult_proteingroupreportcontent", "protein_group"),
+]
+
+
+def index_name(table, column):
+    return f"{table.removeprefix('catapult_')}_{column}_trgm"
+
+
+def drop_indexes(apps, schema_editor):
+    """
+    Drop the trigram indexes first, so they are not maintained while 0057 rewrites every report row.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{index_name(table, column)}"')
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{index_name(table, column)}" '
+            f'ON "{table}" USING gin (UPPER(("{column}")::text) gin_trgm_ops)'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0055_report_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_indexes, create_indexes),
+        # the text columns are removed in 0058, nullable until then so the migrations can be reversed
+        migrations.AlterField(
+            model_name='precursorreportcontent',
+            name='precursor_id',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='proteingroupreportcontent',
+            name='protein_group',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.CreateModel(
+            name='GeneGroup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('value', models.TextField(unique=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Precursor',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('value', models.TextField(unique=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProteinGroup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('value', models.TextField(unique=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='precursorreportcontent',
+            name='precursor_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='precursor_report_content', to='catapult.precursor'),
+        ),
+        migrations.AddField(
+            model_name='precursorreportcontent',
+            name='gene_names_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='precursor_report_content', to='catapult.genegroup'),
+        ),
+        migrations.AddField(
+            model_name='precursorreportcontent',
+            name='protein_group_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='precursor_report_content', to='catapult.proteingroup'),
+        ),
+        migrations.AddField(
+            model_name='proteingroupreportcontent',
+            name='gene_names_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='protein_group_report_content', to='catapult.genegroup'),
+        ),
+        migrations.AddField(
+            model_name='proteingroupreportcontent',
+            name='protein_group_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='protein_group_report_content', to='catapult.proteingroup'),
+        ),
+    ]
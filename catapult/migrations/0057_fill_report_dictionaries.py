@@ -0,0 +1,96 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 50000
+
+# (report model, text column, key field, dictionary model)
+COLUMNS = [
+    ("PrecursorReportContent", "precursor_id", "precursor_key", "Precursor"),
+    ("PrecursorReportContent", "gene_names", "gene_names_key", "GeneGroup"),
+    ("PrecursorReportContent", "protein_group", "protein_group_key", "ProteinGroup"),
+    ("ProteinGroupReportContent", "gene_names", "gene_names_key", "GeneGroup"),
+    ("ProteinGroupReportContent", "protein_group", "protein_group_key", "ProteinGroup"),
+]
+
+
+def report_columns(apps):
+    """
+    Report models with the (text column, key column, dictionary table) of each of their text columns.
+    """
+    tables = {}
+    for model_name, column, key, dictionary_name in COLUMNS:
+        model = apps.get_model("catapult", model_name)
+        dictionary = apps.get_model("catapult", dictionary_name)
+        tables.setdefault(model, []).append((column, model._meta.get_field(key).column, dictionary._meta.db_table))
+    return tables
+
+
+def update_batches(schema_editor, model, assignments: list[tuple[str, str]], joins: list[str]):
+    """
+    Rewrite the rows of a report table in batches of ids, one UPDATE ... FROM per batch that sets every column
+    at once, each batch in its own transaction.
+    :param assignments: (column, expression) pairs, the expressions refer to the row as r
+    :param joins: LEFT JOIN clauses of the dictionaries
+    """
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+        first, last = cursor.fetchone()
+    if first is None:
+        return
+    sql = (
+        f"UPDATE {table} SET {', '.join(f'{quote(column)} = {expression}' for column, expression in assignments)} "
+        f"FROM {table} r {' '.join(joins)} "
+        f"WHERE r.id = {table}.id AND r.id >= %s AND r.id < %s"
+    )
+    for start in range(first, last + 1, BATCH_SIZE):
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(sql, [start, start + BATCH_SIZE])
+
+
+def fill_dictionaries(apps, schema_editor):
+    """
+    Add the distinct strings of the report columns to the dictionaries, then point every row at its entries.
+    """
+    quote = schema_editor.connection.ops.quote_name
+    for model_name, column, key, dictionary_name in COLUMNS:
+        model = apps.get_model("catapult", model_name)
+        dictionary = apps.get_model("catapult", dictionary_name)
+        schema_editor.execute(
+            f"INSERT INTO {quote(dictionary._meta.db_table)} (value) "
+            f"SELECT DISTINCT {quote(column)} FROM {quote(model._meta.db_table)} r "
+            f"WHERE {quote(column)} IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM {quote(dictionary._meta.db_table)} d WHERE d.value = r.{quote(column)})"
+        )
+    for model, columns in report_columns(apps).items():
+        update_batches(
+            schema_editor, model,
+            [(key, f"d{i}.id") for i, (column, key, dictionary) in enumerate(columns)],
+            [f"LEFT JOIN {quote(dictionary)} d{i} ON d{i}.value = r.{quote(column)}"
+             for i, (column, key, dictionary) in enumerate(columns)],
+        )
+
+
+def fill_text(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    for model, columns in report_columns(apps).items():
+        update_batches(
+            schema_editor, model,
+            [(column, f"d{i}.value") for i, (column, key, dictionary) in enumerate(columns)],
+            [f"LEFT JOIN {quote(dictionary)} d{i} ON d{i}.id = r.{quote(key)}"
+             for i, (column, key, dictionary) in enumerate(columns)],
+        )
+
+
+class Migration(migrations.Migration):
+    # the rows are rewritten in batches that commit on their own, so a large table is not held in one transaction
+    atomic = False
+
+    dependencies = [
+        ('catapult', '0056_report_dictionaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_dictionaries, fill_text),
+    ]
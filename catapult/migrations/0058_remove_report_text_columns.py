@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0057_fill_report_dictionaries'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='precursorreportcontent',
+            name='precursor_id',
+        ),
+        migrations.RemoveField(
+            model_name='precursorreportcontent',
+            name='gene_names',
+        ),
+        migrations.RemoveField(
+            model_name='precursorreportcontent',
+            name='protein_group',
+        ),
+        migrations.RemoveField(
+            model_name='proteingroupreportcontent',
+            name='gene_names',
+        ),
+        migrations.RemoveField(
+            model_name='proteingroupreportcontent',
+            name='protein_group',
+        ),
+        migrations.AlterField(
+            model_name='precursorreportcontent',
+            name='precursor_key',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='precursor_report_content', to='catapult.precursor'),
+        ),
+        migrations.AlterField(
+            model_name='proteingroupreportcontent',
+            name='protein_group_key',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='protein_group_report_content', to='catapult.proteingroup'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# the trigram indexes of 0055 went with the report text columns, the searches now match the dictionary values
+TRIGRAM_INDEXES = [
+    ("catapult_genegroup", "value"),
+    ("catapult_proteingroup", "value"),
+    ("catapult_precursor", "value"),
+]
+
+
+def index_name(table, column):
+    return f"{table.removeprefix('catapult_')}_{column}_trgm"
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index_name(table, column)}" '
+            f'ON "{table}" USING gin (UPPER(("{column}")::text) gin_trgm_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name(table, column)}"')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('catapult', '0058_remove_report_text_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_analysis(apps, schema_editor):
+    ResultSummary = apps.get_model("catapult", "ResultSummary")
+    for model_name in ["PrecursorReportContent", "ProteinGroupReportContent"]:
+        model = apps.get_model("catapult", model_name)
+        model.objects.update(analysis_id=Subquery(
+            ResultSummary.objects.filter(id=OuterRef("result_summary_id")).values("analysis_id")[:1]
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0059_dictionary_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='precursorreportcontent',
+            name='analysis',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='precursor_report_content', to='catapult.analysis'),
+        ),
+        migrations.AddField(
+            model_name='proteingroupreportcontent',
+            name='analysis',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='protein_group_report_content', to='catapult.analysis'),
+        ),
+        migrations.RunPython(fill_analysis, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,127 @@
+from django.db import migrations
+
+TABLES = ["catapult_precursorreportcontent", "catapult_proteingroupreportcontent"]
+
+
+def partition_table(schema_editor, table):
+    """
+    Turn a report table into a table partitioned by LIST (analysis_id) without copying its rows: the existing
+    table becomes the DEFAULT partition and its indexes are attached to partitioned indexes of the new parent.
+    The foreign keys are added to the parent so every partition inherits them, the existing ones of the default
+    partition are attached to them when it is attached. The primary key stays on the partitions, primary and
+    unique keys of a partitioned table have to include analysis_id. The analyses of the default partition are
+    bounded by a check constraint at the largest one at migration time, otherwise creating the partition of any
+    later analysis would scan the whole default partition for its rows.
+    """
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    default = f"{table}_default"
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'", [table]
+        )
+        identity = cursor.fetchone()[0] != ""
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+        indexes = connection.introspection.get_constraints(cursor, table)
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT COALESCE(MAX(analysis_id), 0) FROM {quote(table)}")
+        max_analysis = cursor.fetchone()[0]
+
+    # a table with an identity column cannot be attached as a partition, the parent takes over the sequence
+    if identity:
+        schema_editor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN id DROP IDENTITY")
+        sequence = f"{table}_id_seq"
+        schema_editor.execute(f"CREATE SEQUENCE {quote(sequence)}")
+        schema_editor.execute(
+            f"SELECT setval(%s, COALESCE(MAX(id), 0) + 1, false) FROM {quote(table)}", [sequence]
+        )
+    else:
+        schema_editor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN id DROP DEFAULT")
+    schema_editor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(default)}")
+    schema_editor.execute(
+        f"CREATE TABLE {quote(table)} (LIKE {quote(default)} INCLUDING DEFAULTS) PARTITION BY LIST (analysis_id)"
+    )
+    schema_editor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote(table)}.id")
+    schema_editor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)", [sequence])
+
+    for name, index in indexes.items():
+        # plain column indexes, the foreign key indexes of the report tables
+        if not index["index"] or index["primary_key"] or index["unique"] or index.get("definition") \
+                or index["type"] != "idx" or not index["columns"]:
+            continue
+        parent_index = f"{name[:61]}_p"
+        columns = ", ".join(quote(column) for column in index["columns"])
+        schema_editor.execute(f"CREATE INDEX {quote(parent_index)} ON ONLY {quote(table)} ({columns})")
+        schema_editor.execute(f"ALTER INDEX {quote(parent_index)} ATTACH PARTITION {quote(name)}")
+
+    schema_editor.execute(
+        f"ALTER TABLE {quote(default)} ADD CONSTRAINT {quote(f'{default}_analysis_bound')} "
+        f"CHECK (analysis_id IS NULL OR analysis_id <= %s)",
+        [max_analysis],
+    )
+
+    # the parent is empty, so adding the foreign keys does not scan anything
+    for name, definition in foreign_keys:
+        schema_editor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f'{name[:61]}_p')} {definition}")
+
+    schema_editor.execute(f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(default)} DEFAULT")
+
+
+def unpartition_table(schema_editor, table):
+    """
+    Move the rows of the analysis partitions back into the default partition and make it the table again.
+    """
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    default = f"{table}_default"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass",
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+    for name in names:
+        if name == default:
+            continue
+        schema_editor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}")
+        schema_editor.execute(f"INSERT INTO {quote(default)} SELECT * FROM {quote(name)}")
+        schema_editor.execute(f"DROP TABLE {quote(name)}")
+    schema_editor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(default)}")
+    schema_editor.execute(f"ALTER TABLE {quote(default)} DROP CONSTRAINT IF EXISTS {quote(f'{default}_analysis_bound')}")
+    schema_editor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote(default)}.id")
+    schema_editor.execute(f"ALTER TABLE {quote(default)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)", [sequence])
+    schema_editor.execute(f"DROP TABLE {quote(table)}")
+    schema_editor.execute(f"ALTER TABLE {quote(default)} RENAME TO {quote(table)}")
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in TABLES:
+        partition_table(schema_editor, table)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in TABLES:
+        unpartition_table(schema_editor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0060_report_content_analysis'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catapult', '0061_partition_report_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='quant_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
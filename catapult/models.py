@@ -1,24 +1,26 @@
 import os
 import pathlib
-import subprocess
 from datetime import datetime
 
 import yaml
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from click import command
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.db.models import JSONField
 from django_filters import Filter
 from django_filters.fields import Lookup
 from rest_framework_api_key.crypto import KeyGenerator
 from rest_framework_api_key.models import BaseAPIKeyManager, AbstractAPIKey
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
 from django.conf import settings
+from catapult.process import ProcessRunner, ChannelSink
+from catapult.notify import notify, TASK_CHANNEL
+from catapult.partitions import drop_partitions
+from catapult.result_store import get_result_store
+from django_tasks.backends.database.models import DBTaskResult
 from catapult_backend.settings import DIANN_PATH, CPU_COUNT, DEFAULT_DIANN_PARAMS, DEFAULT_MSCONVERT_PARAMS, \
     MSCONVERT_PATH
 
@@ -29,6 +31,7 @@ class FolderWatchingLocation(models.Model):
     - folder_path: the path of the folder to be watched
     - created_at: the date and time the folder watching location was created
     - updated_at: the date and time the folder watching location was last updated
+    - weight: the share of the workers the tasks of the location get when tasks of several locations are queued
     """
     folder_path = models.TextField(blank=False, null=False, unique=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -36,6 +39,7 @@ class FolderWatchingLocation(models.Model):
     network_folder = models.BooleanField(default=False)
     ignore_term = models.TextField(blank=True, null=True, default="DONOTPROCESS")
     extensions = models.TextField(blank=True, null=True, default=".raw,.wiff,.d,.mzML,.dia")
+    weight = models.FloatField(default=1.0)
 
     class Meta:
         ordering = ["id"]
@@ -87,7 +91,7 @@ class Experiment(models.Model):
         super().delete(using=using, keep_parents=keep_parents)
 
     def ready_for_processing(self):
-        return len(self.files.filter(ready_for_processing=True)) == self.sample_count
+        return self.files.filter(ready_for_processing=True).count() == self.sample_count
 
     def is_being_processed(self):
         return len(self.analysis.filter(processing=True)) > 0
@@ -109,7 +113,12 @@ class File(models.Model):
     - ready_for_processing: a boolean value indicating if the file is ready for processing
     - experiment: the experiment the file belongs to
     - size: the size of the file
+    - size_changed_at: the date and time the sentinel last saw the size of the file change
+    - quant_failures: the number of failed first pass shards the file was part of
     """
+    # failed first pass shards after which a file is no longer dispatched
+    MAX_QUANT_FAILURES = 3
+
     file_path = models.TextField(blank=False, null=False, unique=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -117,7 +126,9 @@ class File(models.Model):
     ready_for_processing = models.BooleanField(default=False)
     experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, related_name="files")
     size = models.BigIntegerField(blank=False, null=False)
+    size_changed_at = models.DateTimeField(blank=True, null=True)
     processing = models.BooleanField(default=False)
+    quant_failures = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ["id"]
@@ -168,26 +179,10 @@ class MSConvert(models.Model):
         commands.append("-o")
         commands.append(converted_folder)
         commands.extend(self.commands.split(" "))
-        process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        channel_layer = get_channel_layer()
         self.processing = True
         self.completed = False
         self.save()
-        while process.poll() is None:
-            output = process.stdout.readline()
-            if output:
-                output_line = output.decode("utf-8")
-                async_to_sync(channel_layer.group_send)(
-                    "analysis_log", {
-                        "type": "log_message",
-                        "message": {
-                            "task_id": task_id,
-                            "log": output_line,
-                            "hostname": hostname,
-                            "timestamp": f"{datetime.now().timestamp()}"
-                        },
-                    }
-                )
+        ProcessRunner(commands, sinks=[ChannelSink(task_id=task_id, hostname=hostname)], shell=True).run()
         self.processing = False
         self.completed = True
         self.save()
@@ -242,7 +237,21 @@ class Analysis(models.Model):
     def __repr__(self):
         return f"{self.analysis_path}"
 
+    def quant_total_files(self) -> int | None:
+        """
+        Number of files the final run covers, total_files without the files that failed File.MAX_QUANT_FAILURES
+        shards and never get a quant file.
+        """
+        if self.total_files is None:
+            return None
+        return self.total_files - self.experiment.files.filter(
+            ready_for_processing=True, quant_failures__gte=File.MAX_QUANT_FAILURES
+        ).count()
+
     def delete(self, using=None, keep_parents=False):
+        # outside of a transaction the report partitions are dropped before the cascade so it has no rows to delete
+        if not transaction.get_connection(using).in_atomic_block:
+            drop_partitions(self.id)
         super().delete(using=using, keep_parents=keep_parents)
 
     def start_analysis(self, task_id="", hostname=""):
@@ -276,24 +285,7 @@ class Analysis(models.Model):
         self.save()
         # run the commands and stream the output to websocket channel
         print(commands)
-        process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        channel_layer = get_channel_layer()
-        while process.poll() is None:
-            output = process.stdout.readline()
-            print(output)
-            if output:
-                output_line = output.decode("utf-8")
-                async_to_sync(channel_layer.group_send)(
-                    "analysis_log", {
-                        "type": "log_message",
-                        "message": {
-                            "task_id": task_id,
-                            "log": output_line,
-                            "hostname": hostname,
-                            "timestamp": f"{datetime.now().timestamp()}",
-                        },
-                    }
-                )
+        ProcessRunner(commands, sinks=[ChannelSink(task_id=task_id, hostname=hostname)], shell=True).run()
 
 
         #subprocess.run(commands, shell=True, check=True)
@@ -308,9 +300,11 @@ class Analysis(models.Model):
         commands = []
         parent_folder = os.path.dirname(self.config.config_file_path)
         if all_files:
-            files = self.experiment.files.filter(ready_for_processing=True)
+            files = self.experiment.files.filter(ready_for_processing=True, quant_failures__lt=File.MAX_QUANT_FAILURES)
         else:
-            files = self.experiment.files.filter(ready_for_processing=True, processing=False)
+            files = self.experiment.files.filter(
+                ready_for_processing=True, processing=False, quant_failures__lt=File.MAX_QUANT_FAILURES
+            )
         if config["engine"] == "DIA-NN":
             commands = [settings.DIANN_PATH]
             if files.count() == 0:
@@ -391,7 +385,7 @@ class Analysis(models.Model):
                         commands.append(file_path)
 
             for key, value in config.items():
-                if key not in ["diann_path", "ready", "lib", "fasta", "out_lib", "prefix"]:
+                if key not in ["diann_path", "ready", "lib", "fasta", "out_lib", "prefix", "cat_priority", "cat_qc", "cat_shard_size"]:
                     key = key.replace("_", "-")
                     if value is not None:
                         if key == "channels":
@@ -487,7 +481,7 @@ class Analysis(models.Model):
         return commands
 
     def run_analysis(self, commands):
-        subprocess.run(commands, shell=True, check=True)
+        ProcessRunner(commands, shell=True).run().check()
 
     def create_quant_file(self, task_id="", hostname=""):
         commands = []
@@ -516,23 +510,7 @@ class Analysis(models.Model):
         if len(commands) > 0:
             commands.extend(self.commands.split(" "))
             os.makedirs(os.path.join(self.output_folder, "temp"), exist_ok=True)
-            process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-            channel_layer = get_channel_layer()
-            while process.poll() is None:
-                output = process.stdout.readline()
-                if output:
-                    output_line = output.decode("utf-8")
-                    async_to_sync(channel_layer.group_send)(
-                        "analysis_log", {
-                            "type": "log_message",
-                            "message": {
-                                "task_id": task_id,
-                                "log": output_line,
-                                "hostname": hostname,
-                                "timestamp": f"{datetime.now().timestamp()}"
-                            },
-                        }
-                    )
+            ProcessRunner(commands, sinks=[ChannelSink(task_id=task_id, hostname=hostname)], shell=True).run()
             self.generated_quant.add(*files)
             self.save()
         else:
@@ -706,6 +684,7 @@ class ResultSummary(models.Model):
     - file: the file the result summary belongs to
     - protein_identified: the number of proteins identified
     - precursor_identified: the number of precursor ions identified
+    - content_hash: digest of the run's stats and matrix content at the last import
     """
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -715,6 +694,7 @@ class ResultSummary(models.Model):
     precursor_identified = models.IntegerField(blank=True, null=True)
     stats_file = models.TextField(blank=True, null=True)
     log_file = models.TextField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
 
     class Meta:
         ordering = ["id"]
@@ -730,6 +710,68 @@ class ResultSummary(models.Model):
         super().delete(using=using, keep_parents=keep_parents)
 
 
+class ReportFileFingerprint(models.Model):
+    """
+    A data model for storing the fingerprint of a report file at the time it was imported with the following column:
+    - created_at: the date and time the fingerprint was created
+    - updated_at: the date and time the fingerprint was last updated
+    - analysis: the analysis the report file belongs to
+    - file_path: the path of the stats or matrix file
+    - size: the size of the file
+    - modified_time: the modification time of the file
+    - content_hash: the sha256 digest of the file content
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name="report_fingerprints")
+    file_path = models.TextField(blank=False, null=False)
+    size = models.BigIntegerField(blank=False, null=False)
+    modified_time = models.FloatField(blank=False, null=False)
+    content_hash = models.CharField(max_length=64, blank=False, null=False)
+
+    class Meta:
+        ordering = ["id"]
+        app_label = "catapult"
+        unique_together = [("analysis", "file_path")]
+
+    def __str__(self):
+        return f"{self.file_path}"
+
+    def __repr__(self):
+        return f"{self.file_path}"
+
+
+class DirectoryScanState(models.Model):
+    """
+    A data model for caching the listing of a watched directory between sentinel restarts with the following column:
+    - created_at: the date and time the state was created
+    - updated_at: the date and time the state was last updated
+    - folder_watching_location: the folder watching location the directory belongs to
+    - path: the absolute path of the directory
+    - modified_time: the modification time of the directory when it was listed
+    - scan_signature: the extensions and ignore term of the location when the directory was listed
+    - entries: the acquisitions, configs, report stats files and subdirectories found in the directory
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    folder_watching_location = models.ForeignKey(FolderWatchingLocation, on_delete=models.CASCADE, related_name="directory_states")
+    path = models.TextField(blank=False, null=False)
+    modified_time = models.FloatField(blank=False, null=False)
+    scan_signature = models.TextField(blank=True, null=False, default="")
+    entries = models.JSONField(blank=False, null=False, default=dict)
+
+    class Meta:
+        ordering = ["id"]
+        app_label = "catapult"
+        unique_together = [("folder_watching_location", "path")]
+
+    def __str__(self):
+        return f"{self.path}"
+
+    def __repr__(self):
+        return f"{self.path}"
+
+
 class UserAPIKeyManager(BaseAPIKeyManager):
     key_generator = KeyGenerator(prefix_length=8, secret_key_length=128)
 
@@ -808,33 +850,175 @@ class LogRecord(models.Model):
     def delete(self, using=None, keep_parents=False):
         super().delete(using=using, keep_parents=keep_parents)
 
+
+class TaskResourceSample(models.Model):
+    """
+    A data model for storing the resource usage of the process of a task at a point in time with the following column:
+    - task: the task the process belongs to
+    - timestamp: the date and time of the sample
+    - cpu_percent: the cpu usage of the process and its children, 100 per fully used core
+    - rss: the resident memory of the process and its children in bytes
+    - read_bytes: the bytes read by the process and its children since it started
+    - write_bytes: the bytes written by the process and its children since it started
+    - threads: the number of threads of the process and its children
+    """
+    task = models.ForeignKey("CeleryTask", on_delete=models.CASCADE, related_name="resource_samples")
+    timestamp = models.DateTimeField(blank=False, null=False)
+    cpu_percent = models.FloatField(blank=False, null=False)
+    rss = models.BigIntegerField(blank=False, null=False)
+    read_bytes = models.BigIntegerField(blank=True, null=True)
+    write_bytes = models.BigIntegerField(blank=True, null=True)
+    threads = models.IntegerField(blank=False, null=False)
+
+    class Meta:
+        ordering = ["task", "timestamp"]
+        app_label = "catapult"
+        indexes = [
+            models.Index(fields=["task", "timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"{self.task_id}:{self.timestamp}"
+
+    def __repr__(self):
+        return f"{self.task_id}:{self.timestamp}"
+
+
+class LogChunk(models.Model):
+    """
+    A data model for storing a gzip compressed block of consecutive log lines of a task with the following column:
+    - created_at: the date and time the chunk was created
+    - task: the task the log lines belong to
+    - start_line: the number of the first line of the chunk in the log of the task, starting at 0
+    - end_line: the number of the line following the last line of the chunk
+    - line_count: the number of lines in the chunk
+    - start_time: the date and time of the first line
+    - end_time: the date and time of the last line
+    - data: gzip compressed JSON list of [timestamp, line] pairs
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    task = models.ForeignKey("CeleryTask", on_delete=models.CASCADE, related_name="log_chunks")
+    start_line = models.IntegerField(blank=False, null=False)
+    end_line = models.IntegerField(blank=False, null=False)
+    line_count = models.IntegerField(blank=False, null=False)
+    start_time = models.DateTimeField(blank=False, null=False)
+    end_time = models.DateTimeField(blank=False, null=False)
+    data = models.BinaryField(blank=False, null=False)
+
+    class Meta:
+        ordering = ["task", "start_line"]
+        app_label = "catapult"
+        indexes = [
+            models.Index(fields=["task", "start_line"]),
+            models.Index(fields=["task", "end_time"]),
+        ]
+
+    def __str__(self):
+        return f"{self.task_id}:{self.start_line}-{self.end_line}"
+
+    def __repr__(self):
+        return f"{self.task_id}:{self.start_line}-{self.end_line}"
+
+class GeneGroup(models.Model):
+    """
+    A dictionary of the Genes entries of the reports with the following column:
+    - value: the ;-separated gene names as written in the report
+    Report rows refer to an entry by its integer id instead of repeating the names for every run.
+    """
+    id = models.AutoField(primary_key=True)
+    value = models.TextField(unique=True)
+
+    class Meta:
+        ordering = ["id"]
+        app_label = "catapult"
+
+    def __str__(self):
+        return f"{self.value}"
+
+    def __repr__(self):
+        return f"{self.value}"
+
+class ProteinGroup(models.Model):
+    """
+    A dictionary of the Protein.Group entries of the reports with the following column:
+    - value: the ;-separated protein ids as written in the report
+    """
+    id = models.AutoField(primary_key=True)
+    value = models.TextField(unique=True)
+
+    class Meta:
+        ordering = ["id"]
+        app_label = "catapult"
+
+    def __str__(self):
+        return f"{self.value}"
+
+    def __repr__(self):
+        return f"{self.value}"
+
+class Precursor(models.Model):
+    """
+    A dictionary of the Precursor.Id entries of the reports with the following column:
+    - value: the precursor id
+    """
+    id = models.AutoField(primary_key=True)
+    value = models.TextField(unique=True)
+
+    class Meta:
+        ordering = ["id"]
+        app_label = "catapult"
+
+    def __str__(self):
+        return f"{self.value}"
+
+    def __repr__(self):
+        return f"{self.value}"
+
+class ReportContentQuerySet(models.QuerySet):
+    def with_text(self):
+        """
+        Annotate the rows with the strings of their dictionary entries under the names of the report columns,
+        so they can be read, filtered and ordered like fields.
+        """
+        return self.annotate(**{
+            name: models.F(f"{key}__value") for name, key in self.model.text_fields.items()
+        })
+
 class PrecursorReportContent(models.Model):
     """
     A data model for storing the precursor report with the following column:
     - result_summary: the result summary the precursor report belongs to
-    - precursor_id: precursor id
-    - gene_names: gene names
-    - protein_group: protein groups
+    - analysis: the analysis of the result summary, the partition key of the table on PostgreSQL
+    - precursor_key: precursor id
+    - gene_names_key: gene names
+    - protein_group_key: protein groups
     - proteotypic: proteotypic
     - intensity: intensity
+    The text columns are stored once in the Precursor, GeneGroup and ProteinGroup dictionaries,
+    objects.with_text() adds them back as precursor_id, gene_names and protein_group.
     """
     result_summary = models.ForeignKey(ResultSummary, on_delete=models.CASCADE, related_name="precursor_report_content")
-    precursor_id = models.TextField(blank=False, null=False)
-    gene_names = models.TextField(blank=True, null=True)
-    protein_group = models.TextField(blank=True, null=True)
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name="precursor_report_content", blank=True, null=True)
+    precursor_key = models.ForeignKey(Precursor, on_delete=models.PROTECT, related_name="precursor_report_content")
+    gene_names_key = models.ForeignKey(GeneGroup, on_delete=models.PROTECT, related_name="precursor_report_content", blank=True, null=True)
+    protein_group_key = models.ForeignKey(ProteinGroup, on_delete=models.PROTECT, related_name="precursor_report_content", blank=True, null=True)
     proteotypic = models.BooleanField(default=False)
     intensity = models.FloatField(blank=True, null=True)
     file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="precursor_report_content", blank=True, null=True)
 
+    objects = ReportContentQuerySet.as_manager()
+    # report column name of each dictionary key
+    text_fields = {"precursor_id": "precursor_key", "gene_names": "gene_names_key", "protein_group": "protein_group_key"}
+
     class Meta:
         ordering = ["id"]
         app_label = "catapult"
 
     def __str__(self):
-        return f"{self.precursor_id}"
+        return f"{getattr(self, 'precursor_id', self.precursor_key_id)}"
 
     def __repr__(self):
-        return f"{self.precursor_id}"
+        return f"{getattr(self, 'precursor_id', self.precursor_key_id)}"
 
     def delete(self, using=None, keep_parents=False):
         super().delete(using=using, keep_parents=keep_parents)
@@ -843,25 +1027,32 @@ class ProteinGroupReportContent(models.Model):
     """
     A data model for storing the protein group report with the following column:
     - result_summary: the result summary the protein group report belongs to
-    - gene_names: gene names
-    - protein_group: protein group
+    - analysis: the analysis of the result summary, the partition key of the table on PostgreSQL
+    - gene_names_key: gene names
+    - protein_group_key: protein group
     - file: the file the protein group report belongs to
+    The text columns are stored once in the GeneGroup and ProteinGroup dictionaries,
+    objects.with_text() adds them back as gene_names and protein_group.
     """
     result_summary = models.ForeignKey(ResultSummary, on_delete=models.CASCADE, related_name="protein_group_report_content")
-    gene_names = models.TextField(blank=True, null=True)
-    protein_group = models.CharField(max_length=200, blank=False, null=False)
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name="protein_group_report_content", blank=True, null=True)
+    gene_names_key = models.ForeignKey(GeneGroup, on_delete=models.PROTECT, related_name="protein_group_report_content", blank=True, null=True)
+    protein_group_key = models.ForeignKey(ProteinGroup, on_delete=models.PROTECT, related_name="protein_group_report_content")
     file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="protein_group_report_content", blank=True, null=True)
     intensity = models.FloatField(blank=True, null=True)
 
+    objects = ReportContentQuerySet.as_manager()
+    text_fields = {"gene_names": "gene_names_key", "protein_group": "protein_group_key"}
+
     class Meta:
         ordering = ["id"]
         app_label = "catapult"
 
     def __str__(self):
-        return f"{self.protein_group}"
+        return f"{getattr(self, 'protein_group', self.protein_group_key_id)}"
 
     def __repr__(self):
-        return f"{self.protein_group}"
+        return f"{getattr(self, 'protein_group', self.protein_group_key_id)}"
 
     def delete(self, using=None, keep_parents=False):
         super().delete(using=using, keep_parents=keep_parents)
@@ -877,6 +1068,9 @@ class CeleryTask(models.Model):
     - user: the user that created the task
     - task_status: the status of the task
     - analysis: the analysis the task belongs to
+    - exit_code: the exit code of the process run by the task
+    - resource_usage: the elapsed time, cpu time and peak memory of the process run by the task
+    - progress: the current file, phase, percent complete and estimated seconds left of the process run by the task
     """
     task_id = models.CharField(max_length=200, blank=False, null=False, unique=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -887,6 +1081,9 @@ class CeleryTask(models.Model):
     analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, blank=True, null=True, related_name="tasks")
     analysis_params = models.JSONField(blank=True, null=True)
     worker = models.ForeignKey("CeleryWorker", on_delete=models.SET_NULL, blank=True, null=True, related_name="tasks")
+    exit_code = models.IntegerField(blank=True, null=True)
+    resource_usage = models.JSONField(blank=True, null=True)
+    progress = models.JSONField(blank=True, null=True)
 
     class Meta:
         ordering = ["id"]
@@ -1022,6 +1219,8 @@ class CeleryWorker(models.Model):
     - worker_hostname: the hostname of the worker
     - folder_path_translations: a dictionary of the folder path used and its translated paths from the worker
     - worker_os: the operating system of the worker
+    - heartbeat: the date and time the worker last reported that it is alive
+    - slots: the capacity of the worker and the task running in each of its slots
     """
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -1032,6 +1231,35 @@ class CeleryWorker(models.Model):
     folder_path_translations = models.JSONField(blank=True, null=True)
     worker_os = models.CharField(max_length=20, blank=True, null=True)
     worker_info = models.JSONField(blank=True, null=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    slots = models.JSONField(blank=True, null=True)
+
+
+class WorkerCostProfile(models.Model):
+    """
+    A data model for storing the observed speed of a worker for an engine with the following column:
+    - worker: the worker the profile belongs to
+    - engine: the search engine, DIA-NN or Spectronaut
+    - seconds_per_gb: the exponentially weighted moving average of the runtime per gigabyte of input files
+    - runs: the number of runs the average was computed from
+    - updated_at: the date and time of the last observed run
+    """
+    worker = models.ForeignKey(CeleryWorker, on_delete=models.CASCADE, related_name="cost_profiles")
+    engine = models.CharField(max_length=50, blank=False, null=False)
+    seconds_per_gb = models.FloatField(blank=False, null=False)
+    runs = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+        app_label = "catapult"
+        unique_together = [["worker", "engine"]]
+
+    def __str__(self):
+        return f"{self.worker_id} {self.engine}"
+
+    def __repr__(self):
+        return f"{self.worker_id} {self.engine}"
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -1039,6 +1267,27 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
 
+@receiver(post_save, sender=DBTaskResult)
+def notify_task_enqueued(sender, instance=None, created=False, **kwargs):
+    """
+    Wake up the native workers listening on the queue of a newly enqueued task, the notification is delivered
+    once the enqueue transaction commits.
+    """
+    if created:
+        notify(TASK_CHANNEL, [instance.queue_name])
+
+@receiver(pre_delete, sender=Analysis)
+def drop_report_partitions(sender, instance=None, **kwargs):
+    """
+    Drop the report partitions and the Parquet result store partition of a deleted analysis once the deletion is
+    committed. Dropping a partition locks the whole report table, so it is not held for the rest of the cascade.
+    """
+    analysis_id = instance.id
+    transaction.on_commit(lambda: drop_partitions(analysis_id))
+    store = get_result_store()
+    if store is not None:
+        transaction.on_commit(lambda: store.delete_analysis(analysis_id))
+
 @receiver(post_save, sender=CatapultRunConfig)
 def create_analysis(sender, instance=None, created=False, **kwargs):
     if created:
@@ -0,0 +1,92 @@
+import logging
+import select
+import time
+
+from django.db import connection
+
+logger = logging.getLogger("catapult.notify")
+
+# payload: comma separated ids of experiments whose files, configs or analyses changed
+EXPERIMENT_CHANNEL = "catapult_experiment_changed"
+# payload: name of the queue a task was enqueued on
+TASK_CHANNEL = "catapult_task_enqueued"
+
+# postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_SIZE = 7900
+
+
+def notify_available() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def notify(channel: str, ids) -> bool:
+    """
+    Send ids on a Postgres NOTIFY channel, splitting them over several notifications if needed.
+    Notifications sent inside a transaction are delivered when it commits.
+    :return: False if the database does not support LISTEN/NOTIFY
+    """
+    if not notify_available():
+        return False
+    payloads = []
+    current = ""
+    for i in ids:
+        value = str(i)
+        if current and len(current) + len(value) + 1 > MAX_PAYLOAD_SIZE:
+            payloads.append(current)
+            current = ""
+        current = f"{current},{value}" if current else value
+    if current:
+        payloads.append(current)
+    with connection.cursor() as cursor:
+        for payload in payloads:
+            cursor.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+    return True
+
+
+def parse_ids(payload: str) -> set[int]:
+    return {int(i) for i in payload.split(",") if i.strip().isdigit()}
+
+
+class Listener:
+    """
+    A dedicated autocommit connection listening on Postgres NOTIFY channels. On other databases
+    wait only sleeps for the timeout so callers fall back to polling.
+    """
+
+    def __init__(self, *channels: str):
+        self.channels = channels
+        self.connection = None
+
+    def __enter__(self):
+        if notify_available():
+            self.connection = connection.get_new_connection(connection.get_connection_params())
+            self.connection.autocommit = True
+            with self.connection.cursor() as cursor:
+                for channel in self.channels:
+                    cursor.execute(f'LISTEN "{channel}"')
+            logger.info(f"listening on {', '.join(self.channels)}")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    @property
+    def listening(self) -> bool:
+        return self.connection is not None
+
+    def wait(self, timeout: float) -> list[tuple[str, str]]:
+        """
+        Block until notifications arrive or the timeout expires.
+        :return: list of (channel, payload)
+        """
+        if self.connection is None:
+            time.sleep(max(timeout, 0))
+            return []
+        if not self.connection.notifies:
+            select.select([self.connection], [], [], max(timeout, 0))
+            self.connection.poll()
+        notifications = [(n.channel, n.payload) for n in self.connection.notifies]
+        self.connection.notifies.clear()
+        return notifications
@@ -0,0 +1,241 @@
+import base64
+import json
+import logging
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import F, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+logger = logging.getLogger("catapult.pagination")
+
+# annotation holding the value of the ordering field of each row, used to build the cursors of a page
+KEYSET_VALUE = "keyset_value"
+FORWARD = "n"
+BACKWARD = "p"
+
+
+def estimate_count(queryset: QuerySet) -> int | None:
+    """
+    Number of rows of a queryset as estimated by the query planner, None when the database does not provide one.
+    An unfiltered table uses the row count kept by ANALYZE in pg_class, anything else the rows of the top plan node.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    try:
+        if not queryset.query.where and not queryset.query.distinct:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row is not None and row[0] >= 0:
+                return int(row[0])
+        plan = json.loads(queryset.order_by().explain(format="json"))
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        logger.warning(f"unable to estimate the count of {queryset.model.__name__}: {e}")
+        return None
+
+
+def encode_cursor(ordering: str, value, pk, direction: str) -> str:
+    # isoformat keeps the microseconds of date times, which DjangoJSONEncoder would round to milliseconds
+    data = json.dumps({"o": ordering, "v": value, "id": pk, "d": direction}, default=lambda o: o.isoformat(),
+                      separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    if not isinstance(data, dict) or {"o", "v", "id", "d"} - data.keys() or data["d"] not in (FORWARD, BACKWARD):
+        raise ValueError("incomplete cursor")
+    return data
+
+
+def keyset_filter(field: str, value, pk, descending: bool, after: bool) -> Q:
+    """
+    Rows after, or before, the row with the given ordering value and id when ordering by (field, id) with the
+    rows without a value last.
+    """
+    op = "lt" if descending == after else "gt"
+    if field == "id":
+        return Q(**{f"id__{op}": pk})
+    if after:
+        if value is None:
+            return Q(**{f"{field}__isnull": True, f"id__{op}": pk})
+        return Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk}) | Q(**{f"{field}__isnull": True})
+    if value is None:
+        return Q(**{f"{field}__isnull": False}) | Q(**{f"{field}__isnull": True, f"id__{op}": pk})
+    return Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk})
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that switches to keyset pagination when the cursor parameter is given. A keyset page
+    continues after the (ordering field, id) of the last row of the previous page instead of skipping offset rows,
+    so deep pages cost the same as the first one. Start with ?cursor= and follow the next and previous links,
+    the cursors are opaque and only valid for the ordering they were made with. Only the first field of ?ordering
+    is used, rows without a value for it come last.
+    A keyset page does not count the rows, ?count=estimate gives the estimate of the query planner instead and
+    ?count=exact the exact count. ?count=estimate also replaces the COUNT(*) of an offset page.
+    Pages of anything other than a queryset, like the rows of the result store, are always offset pages.
+    """
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self):
+        self.keyset = False
+        self.estimated = False
+        self.has_next = False
+        self.has_previous = False
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    def get_count_mode(self, request) -> str | None:
+        mode = request.query_params.get(self.count_query_param, None)
+        return mode if mode in ("estimate", "exact") else None
+
+    def get_keyset_ordering(self, request, queryset, view) -> str:
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or ["id"]
+        first = ordering[0]
+        return first.replace("pk", "id") if first.lstrip("-") == "pk" else first
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if not isinstance(queryset, QuerySet):
+            return super().paginate_queryset(queryset, request, view)
+        mode = self.get_count_mode(request)
+        if self.cursor_query_param in request.query_params:
+            return self.paginate_keyset(queryset, request, view, mode)
+        if mode == "estimate":
+            return self.paginate_estimated(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_estimated(self, queryset, request):
+        """
+        Offset page with the planner estimate as count. One row more than the limit is read to know whether
+        there is a next page, the estimate may be off in either direction.
+        """
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.estimated = True
+        self.count = estimate_count(queryset)
+        if self.count is None:
+            self.count = self.get_count(queryset)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[:self.limit]
+
+    def paginate_keyset(self, queryset, request, view, mode):
+        self.keyset = True
+        self.limit = self.get_limit(request) or self.default_limit or 20
+        ordering = self.get_keyset_ordering(request, queryset, view)
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        # the count is of every row, not of the rows left after the cursor
+        if mode == "estimate":
+            self.count = estimate_count(queryset)
+        elif mode == "exact":
+            self.count = queryset.count()
+        else:
+            self.count = None
+
+        cursor = request.query_params.get(self.cursor_query_param) or None
+        direction = FORWARD
+        if cursor is not None:
+            try:
+                data = decode_cursor(cursor)
+            except (ValueError, TypeError, UnicodeDecodeError):
+                raise NotFound(self.invalid_cursor_message)
+            if data["o"] != ordering:
+                raise NotFound(self.invalid_cursor_message)
+            direction = data["d"]
+            queryset = queryset.filter(keyset_filter(field, data["v"], data["id"], descending, direction == FORWARD))
+
+        backward = direction == BACKWARD
+        if field != "id":
+            queryset = queryset.annotate(**{KEYSET_VALUE: F(field)})
+            value_order = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+            if backward:
+                value_order = F(field).asc(nulls_first=True) if descending else F(field).desc(nulls_first=True)
+            id_order = "-id" if descending != backward else "id"
+            queryset = queryset.order_by(value_order, id_order)
+        else:
+            queryset = queryset.order_by("-id" if descending != backward else "id")
+
+        rows = list(queryset[:self.limit + 1])
+        more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if backward:
+            rows.reverse()
+        self.has_next = more if not backward else True
+        self.has_previous = cursor is not None if not backward else more
+        if rows:
+            first, last = rows[0], rows[-1]
+            self.next_cursor = encode_cursor(ordering, getattr(last, KEYSET_VALUE, None), last.pk, FORWARD) if self.has_next else None
+            self.previous_cursor = encode_cursor(ordering, getattr(first, KEYSET_VALUE, None), first.pk, BACKWARD) if self.has_previous else None
+        return rows
+
+    def cursor_link(self, cursor: str | None) -> str | None:
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if self.keyset:
+            return self.cursor_link(self.next_cursor)
+        if self.estimated:
+            if not self.has_next:
+                return None
+            url = self.request.build_absolute_uri()
+            url = replace_query_param(url, self.limit_query_param, self.limit)
+            return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset:
+            return self.cursor_link(self.previous_cursor)
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ("count", self.count),
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response = super().get_paginated_response_schema(schema)
+        response["properties"]["count"]["nullable"] = True
+        return response
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters += [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Keyset pagination cursor, empty for the first page.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "estimate for the planner estimate of the number of rows, exact for an exact count.",
+                "schema": {"type": "string", "enum": ["estimate", "exact"]},
+            },
+        ]
+        return parameters
@@ -0,0 +1,179 @@
+import logging
+
+from django.db import OperationalError, connection, transaction
+
+logger = logging.getLogger("catapult.partitions")
+
+# suffix of the partition holding the rows of the analyses without their own partition, the table of the
+# report content before it was partitioned
+DEFAULT_SUFFIX = "default"
+
+# how long dropping a partition waits for the lock on the partitioned table
+DROP_LOCK_TIMEOUT = "5s"
+
+
+def report_models() -> list:
+    from catapult.models import PrecursorReportContent, ProteinGroupReportContent
+    return [PrecursorReportContent, ProteinGroupReportContent]
+
+
+def quote(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def partition_name(table: str, analysis_id: int) -> str:
+    return f"{table}_a{analysis_id}"
+
+
+def default_partition(table: str) -> str:
+    return f"{table}_{DEFAULT_SUFFIX}"
+
+
+def is_partitioned(table: str) -> bool:
+    """
+    Whether a report table was converted to a table partitioned by analysis, only on PostgreSQL.
+    """
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def partitions(table: str) -> list[dict]:
+    """
+    Partitions of a report table with the analysis they hold, None for the default partition, and their size.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples, pg_total_relation_size(c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+            [table],
+        )
+        rows = cursor.fetchall()
+    result = []
+    prefix = f"{table}_a"
+    for name, bound, tuples, size in rows:
+        analysis_id = int(name[len(prefix):]) if name.startswith(prefix) and name[len(prefix):].isdigit() else None
+        result.append({
+            "table": name,
+            "analysis": analysis_id,
+            "default": bound == "DEFAULT",
+            "rows": max(int(tuples), 0),
+            "bytes": size,
+        })
+    return result
+
+
+def partition_exists(table: str, analysis_id: int) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [partition_name(table, analysis_id)])
+        return cursor.fetchone()[0]
+
+
+def create_partition(table: str, analysis_id: int) -> bool:
+    """
+    Create the partition of an analysis, moving its rows out of the default partition if it has any. The
+    partition inherits the foreign keys of the parent.
+    :return: False if the partition already existed
+    """
+    name = partition_name(table, analysis_id)
+    default = default_partition(table)
+    # named after the partition, the creations of an outer transaction each have their own
+    moved_rows = f"{name}_moved"
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # serialize with other ingestions of the same analysis
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [name])
+            if partition_exists(table, analysis_id):
+                return False
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {quote(default)} WHERE analysis_id = %s)", [analysis_id])
+            moving = cursor.fetchone()[0]
+            if moving:
+                cursor.execute(
+                    f"CREATE TEMPORARY TABLE {quote(moved_rows)} ON COMMIT DROP AS "
+                    f"WITH moved AS (DELETE FROM {quote(default)} WHERE analysis_id = %s RETURNING *) "
+                    f"SELECT * FROM moved",
+                    [analysis_id],
+                )
+            cursor.execute(f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES IN (%s)", [analysis_id])
+            cursor.execute(f"ALTER TABLE {quote(name)} ADD PRIMARY KEY (id)")
+            if moving:
+                cursor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(moved_rows)}")
+                cursor.execute(f"DROP TABLE {quote(moved_rows)}")
+    logger.info(f"created partition {name}" + (" with the rows of the default partition" if moving else ""))
+    return True
+
+
+def ensure_partitions(analysis_id: int):
+    """
+    Make sure the report tables have a partition for an analysis before its rows are written.
+    """
+    for model in report_models():
+        table = model._meta.db_table
+        if is_partitioned(table):
+            create_partition(table, analysis_id)
+
+
+def drop_partition(name: str) -> bool:
+    """
+    Drop a partition in its own short transaction. Dropping a partition locks the partitioned table, so it
+    gives up after DROP_LOCK_TIMEOUT instead of queueing the readers and ingestions behind it.
+    :return: False if the lock was not granted in time, the partition is left to report_partitions --drop-orphans
+    """
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{DROP_LOCK_TIMEOUT}'")
+            cursor.execute(f"DROP TABLE IF EXISTS {quote(name)}")
+    except OperationalError as e:
+        logger.warning(f"could not drop partition {name}: {e}")
+        return False
+    return True
+
+
+def drop_partitions(analysis_id: int) -> list[str]:
+    """
+    Drop the partitions of an analysis, its rows in the default partition are left to the cascade delete.
+    :return: the dropped partitions
+    """
+    dropped = []
+    for model in report_models():
+        table = model._meta.db_table
+        if not is_partitioned(table) or not partition_exists(table, analysis_id):
+            continue
+        name = partition_name(table, analysis_id)
+        if drop_partition(name):
+            dropped.append(name)
+    if dropped:
+        logger.info(f"dropped partitions {', '.join(dropped)} of analysis {analysis_id}")
+    return dropped
+
+
+def default_analyses(table: str, limit: int = None) -> list[int]:
+    """
+    Analyses with rows in the default partition, most rows first.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT analysis_id FROM {quote(default_partition(table))} WHERE analysis_id IS NOT NULL "
+            f"GROUP BY analysis_id ORDER BY COUNT(*) DESC" + (" LIMIT %s" if limit else ""),
+            [limit] if limit else [],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def orphan_partitions() -> list[str]:
+    """
+    Partitions of analyses that no longer exist.
+    """
+    from catapult.models import Analysis
+    orphans = []
+    for model in report_models():
+        table = model._meta.db_table
+        if not is_partitioned(table):
+            continue
+        found = {p["analysis"]: p["table"] for p in partitions(table) if p["analysis"] is not None}
+        existing = set(Analysis.objects.filter(id__in=found.keys()).values_list("id", flat=True))
+        orphans += [name for analysis_id, name in found.items() if analysis_id not in existing]
+    return orphans
@@ -0,0 +1,226 @@
+import datetime
+import logging
+import re
+
+from django.db.models import Sum
+from django.utils import timezone
+from django_tasks.backends.database.models import DBTaskResult
+
+from catapult.models import Analysis, CatapultRunConfig, CeleryWorker, File, FolderWatchingLocation, WorkerCostProfile
+from catapult.slots import config_threads
+
+logger = logging.getLogger("catapult.placement")
+
+GB = 1024 ** 3
+# runtime per gigabyte of input assumed for a worker without observed runs, on REFERENCE_CORES cores
+DEFAULT_SECONDS_PER_GB = 600.0
+REFERENCE_CORES = 8
+# weight of the latest run in the moving average of the runtime per gigabyte
+EWMA_ALPHA = 0.3
+# inputs smaller than this count as this size, so tiny runs do not skew the runtime per gigabyte
+MIN_INPUT_GB = 0.1
+# runtime factor of a worker reading the folder over a network mount
+NETWORK_FACTOR = 1.5
+# a worker takes a task when it is at most this much slower than the best worker with a free slot
+PLACEMENT_TOLERANCE = 0.25
+# seconds after which a waiting task is taken by any worker that can see its folder
+PLACEMENT_GRACE = 300
+# a worker without a heartbeat for this many seconds is not considered
+WORKER_TIMEOUT = 60
+
+LOCAL = "local"
+NETWORK = "network"
+SHARED = "shared"
+NONE = "none"
+
+MEMORY_PATTERN = re.compile(r"^([\d.]+)\s*([KMGTP]?)B$")
+NETWORK_PREFIXES = ("//", "\\\\", "smb:", "nfs:", "cifs:")
+
+
+def parse_memory(value) -> int | None:
+    """
+    Bytes from the Total Memory entry of worker_info, e.g. 62.50GB
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = MEMORY_PATTERN.match(str(value or "").strip())
+    if not match:
+        return None
+    return int(float(match.group(1)) * 1024 ** " KMGTP".index(match.group(2) or " "))
+
+
+def worker_resources(worker: CeleryWorker) -> tuple[int, int | None]:
+    """
+    Cores and bytes of memory of a worker, from the capacity reported with its heartbeat or from its system info.
+    """
+    capacity = (worker.slots or {}).get("capacity", {})
+    info = worker.worker_info or {}
+    cores = capacity.get("cpu") or info.get("Total cores") or 1
+    memory = capacity.get("memory") or parse_memory(info.get("Total Memory"))
+    return int(cores), memory
+
+
+def free_slots(worker: CeleryWorker) -> int:
+    return (worker.slots or {}).get("capacity", {}).get("free_slots", 1)
+
+
+def folder_access(worker: CeleryWorker, location: FolderWatchingLocation | None) -> str:
+    """
+    How a worker reaches the folder of a location. A worker without folder_path_translations shares the paths of
+    the server. Otherwise the folder must be translated, the translation tells whether it is a network mount.
+    """
+    if location is None:
+        return SHARED
+    translations = worker.folder_path_translations or {}
+    if not translations:
+        return NETWORK if location.network_folder else SHARED
+    for folder, translated in translations.items():
+        if location.folder_path.startswith(folder):
+            if str(translated).startswith(NETWORK_PREFIXES):
+                return NETWORK
+            return LOCAL
+    return NONE
+
+
+class TaskProfile:
+    """
+    What the placement of a queued task depends on: the engine, the input volume and memory, and the folder
+    """
+
+    def __init__(self, engine: str = "DIA-NN", input_bytes: int = 0, threads: int = None, memory: int = None,
+                 location: FolderWatchingLocation = None):
+        self.engine = engine
+        self.input_bytes = input_bytes
+        self.threads = threads
+        self.memory = memory
+        self.location = location
+
+    @property
+    def input_gb(self) -> float:
+        return max(self.input_bytes / GB, MIN_INPUT_GB)
+
+
+def analysis_input_bytes(analysis_id: int, file_ids: list[int] = None) -> int:
+    """
+    Size of the given files, of the files an analysis is generating quant files for, or of all the files of its
+    experiment.
+    """
+    if file_ids is not None:
+        return File.objects.filter(id__in=file_ids).aggregate(size=Sum("size"))["size"] or 0
+    size = File.objects.filter(quant_files__id=analysis_id).aggregate(size=Sum("size"))["size"]
+    if size:
+        return size
+    experiment_id = Analysis.objects.filter(id=analysis_id).values_list("experiment_id", flat=True).first()
+    if experiment_id is None:
+        return 0
+    return File.objects.filter(experiment_id=experiment_id).aggregate(size=Sum("size"))["size"] or 0
+
+
+def task_profile(task_result: DBTaskResult, memory: int = None) -> TaskProfile:
+    kwargs = task_result.args_kwargs.get("kwargs", {})
+    args = task_result.args_kwargs.get("args", [])
+    analysis_id = kwargs.get("analysis_id", args[0] if args and isinstance(args[0], int) else None)
+    config = None
+    if kwargs.get("config_id") is not None:
+        config = CatapultRunConfig.objects.filter(id=kwargs["config_id"]).select_related("folder_watching_location").first()
+    elif analysis_id is not None:
+        config = CatapultRunConfig.objects.filter(analysis__id=analysis_id).select_related("folder_watching_location").first()
+    content = (config.content or {}) if config is not None else {}
+    return TaskProfile(
+        engine=content.get("engine") or "DIA-NN",
+        input_bytes=analysis_input_bytes(analysis_id, kwargs.get("files")) if analysis_id is not None else 0,
+        threads=config_threads(content),
+        memory=memory,
+        location=config.folder_watching_location if config is not None else None,
+    )
+
+
+class PlacementEngine:
+    """
+    Estimate the runtime of a task on each online worker from the observed runtime per gigabyte of the worker for the
+    engine, or from its cores when it has no observed runs, and the way it reaches the folder of the task.
+    Workers that cannot see the folder or have too little memory are left out unless no worker qualifies.
+    A worker only claims a task if no other worker with a free slot is expected to be clearly faster, or once the
+    task waited PLACEMENT_GRACE seconds.
+    """
+
+    def __init__(self, worker: CeleryWorker, tolerance: float = PLACEMENT_TOLERANCE, grace: float = PLACEMENT_GRACE):
+        self.worker = worker
+        self.tolerance = tolerance
+        self.grace = grace
+        self.workers: list[CeleryWorker] = []
+        self.profiles: dict[tuple[int, str], float] = {}
+
+    def refresh(self):
+        """
+        Load the online workers and their cost profiles, once per claim.
+        """
+        cutoff = timezone.now() - datetime.timedelta(seconds=WORKER_TIMEOUT)
+        workers = list(CeleryWorker.objects.filter(worker_status="ONLINE", heartbeat__gte=cutoff).exclude(id=self.worker.id))
+        self.workers = [self.worker] + workers
+        self.profiles = {
+            (worker_id, engine): seconds_per_gb
+            for worker_id, engine, seconds_per_gb in WorkerCostProfile.objects.filter(
+                worker_id__in=[w.id for w in self.workers]
+            ).values_list("worker_id", "engine", "seconds_per_gb")
+        }
+
+    def estimate(self, worker: CeleryWorker, profile: TaskProfile) -> float | None:
+        """
+        Expected runtime in seconds of a task on a worker, None if the worker cannot run it.
+        """
+        access = folder_access(worker, profile.location)
+        if access == NONE:
+            return None
+        cores, memory = worker_resources(worker)
+        if profile.memory and memory and profile.memory > memory:
+            return None
+        seconds_per_gb = self.profiles.get((worker.id, profile.engine))
+        if seconds_per_gb is None:
+            used_cores = min(cores, profile.threads) if profile.threads else cores
+            seconds_per_gb = DEFAULT_SECONDS_PER_GB * REFERENCE_CORES / max(used_cores, 1)
+        if access == NETWORK:
+            seconds_per_gb *= NETWORK_FACTOR
+        return seconds_per_gb * profile.input_gb
+
+    def estimates(self, profile: TaskProfile) -> dict[int, float]:
+        return {
+            worker.id: seconds for worker in self.workers
+            if (seconds := self.estimate(worker, profile)) is not None
+        }
+
+    def should_claim(self, task_result: DBTaskResult, profile: TaskProfile = None) -> bool:
+        if self.grace is not None and (timezone.now() - task_result.enqueued_at).total_seconds() >= self.grace:
+            return True
+        profile = profile or task_profile(task_result)
+        estimates = self.estimates(profile)
+        if not estimates:
+            # no worker qualifies, do not strand the task
+            return True
+        own = estimates.get(self.worker.id)
+        if own is None:
+            return False
+        others = [
+            estimates[worker.id] for worker in self.workers
+            if worker.id != self.worker.id and worker.id in estimates and free_slots(worker) > 0
+        ]
+        return not others or own <= min(others) * (1 + self.tolerance)
+
+
+def observe_runtime(worker: CeleryWorker, engine: str, input_bytes: int, seconds: float,
+                    location: FolderWatchingLocation = None) -> WorkerCostProfile:
+    """
+    Feed the runtime of a finished run back into the moving average of the worker for the engine. Runs reading
+    their files over a network mount are scaled back by NETWORK_FACTOR, the profile holds the local speed.
+    """
+    observed = seconds / max(input_bytes / GB, MIN_INPUT_GB)
+    if folder_access(worker, location) == NETWORK:
+        observed /= NETWORK_FACTOR
+    profile, created = WorkerCostProfile.objects.get_or_create(
+        worker=worker, engine=engine, defaults={"seconds_per_gb": observed, "runs": 1}
+    )
+    if not created:
+        profile.seconds_per_gb = EWMA_ALPHA * observed + (1 - EWMA_ALPHA) * profile.seconds_per_gb
+        profile.runs += 1
+        profile.save(update_fields=["seconds_per_gb", "runs", "updated_at"])
+    return profile
@@ -0,0 +1,300 @@
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import close_old_connections
+
+logger = logging.getLogger("catapult.process")
+
+# number of buffered lines that triggers a flush
+LOG_FLUSH_LINES = 500
+# seconds a line can stay buffered before it is flushed
+LOG_FLUSH_INTERVAL = 1.0
+
+STDOUT = "stdout"
+STDERR = "stderr"
+
+_CLOSE = object()
+
+
+class ProcessResult:
+    """
+    Outcome of a process run by ProcessRunner
+    - returncode: the exit code of the process
+    - elapsed: wall clock seconds between start and exit
+    - resource_usage: user and system cpu seconds and peak resident memory of the process when the platform reports it
+    - lines: number of lines read from stdout and stderr
+    """
+
+    def __init__(self, commands, returncode: int, elapsed: float, resource_usage: dict | None, lines: dict):
+        self.commands = commands
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.resource_usage = resource_usage
+        self.lines = lines
+
+    def check(self):
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.commands)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "returncode": self.returncode,
+            "elapsed": self.elapsed,
+            "resource_usage": self.resource_usage,
+            "lines": self.lines,
+        }
+
+
+class ProcessSink:
+    """
+    Receives the output lines of a process. open is called before the process starts and close once both
+    streams are drained and the process exited.
+    """
+
+    def open(self):
+        pass
+
+    def write(self, line: str, stream: str = STDOUT):
+        raise NotImplementedError
+
+    def close(self, result: ProcessResult = None):
+        pass
+
+
+class BufferedSink(ProcessSink):
+    """
+    Sink that hands lines to a background thread, which calls handle with batches of (timestamp, line) once
+    max_lines are buffered or the oldest buffered line is older than max_delay seconds. write never blocks.
+    """
+
+    def __init__(self, max_lines: int = LOG_FLUSH_LINES, max_delay: float = LOG_FLUSH_INTERVAL, name: str = "sink"):
+        self.max_lines = max_lines
+        self.max_delay = max_delay
+        self.name = name
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lines_written = 0
+        self.flushes = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def write(self, line: str, stream: str = STDOUT):
+        self.queue.put((time.time(), line))
+
+    def close(self, result: ProcessResult = None):
+        """
+        Flush the remaining lines and stop the background thread.
+        """
+        if self.thread is None:
+            return
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        buffer = []
+        first_buffered = None
+        closing = False
+        try:
+            while not closing:
+                timeout = None if first_buffered is None else max(first_buffered + self.max_delay - time.monotonic(), 0)
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is _CLOSE:
+                    closing = True
+                elif item is not None:
+                    buffer.append(item)
+                    if first_buffered is None:
+                        first_buffered = time.monotonic()
+                if buffer and (closing or len(buffer) >= self.max_lines or time.monotonic() - first_buffered >= self.max_delay):
+                    self.flush(buffer)
+                    buffer = []
+                    first_buffered = None
+        finally:
+            close_old_connections()
+
+    def flush(self, lines: list[tuple[float, str]]):
+        try:
+            self.handle(lines)
+        except Exception as e:
+            logger.exception(f"unable to flush {len(lines)} lines of {self.name}: {e}")
+        self.lines_written += len(lines)
+        self.flushes += 1
+
+    def handle(self, lines: list[tuple[float, str]]):
+        raise NotImplementedError
+
+
+def send_log_message(group: str, task_id: str, hostname: str, lines: list[tuple[float, str]]):
+    async_to_sync(get_channel_layer().group_send)(
+        group, {
+            "type": "log_message",
+            "message": {
+                "task_id": task_id,
+                "log": "\n".join(line for _, line in lines),
+                "hostname": hostname,
+                "timestamp": f"{datetime.now().timestamp()}",
+            },
+        }
+    )
+
+
+class ChannelSink(BufferedSink):
+    """
+    Send batches of lines to a channel group as log_message events, with the lines joined by newlines.
+    """
+
+    def __init__(self, task_id: str = "", hostname: str = "", group: str = "analysis_log", **kwargs):
+        super().__init__(name=f"channel-{task_id}", **kwargs)
+        self.task_id = task_id
+        self.hostname = hostname
+        self.group = group
+
+    def handle(self, lines: list[tuple[float, str]]):
+        send_log_message(self.group, self.task_id, self.hostname, lines)
+
+
+class FileSink(ProcessSink):
+    """
+    Append lines to a text file, lines read from stderr are prefixed with [stderr].
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, line: str, stream: str = STDOUT):
+        self.file.write(f"[stderr] {line}\n" if stream == STDERR else f"{line}\n")
+
+    def close(self, result: ProcessResult = None):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class CallbackSink(ProcessSink):
+    """
+    Call a function with every line and the stream it was read from.
+    """
+
+    def __init__(self, callback: Callable[[str, str], None]):
+        self.callback = callback
+
+    def write(self, line: str, stream: str = STDOUT):
+        self.callback(line, stream)
+
+
+class ProcessRunner:
+    """
+    Run a process and drain stdout and stderr concurrently. Each pipe is read by its own thread which blocks
+    on readline, lines are handed over through a queue and delivered to the sinks from the calling thread,
+    so neither pipe can fill up and nothing polls while the process is idle.
+    On exit the exit code and, on POSIX, the resource usage of the process are recorded.
+    """
+
+    def __init__(self, commands, sinks: list[ProcessSink] = None, shell: bool = False, cwd: str = None, env: dict = None,
+                 encoding: str = "utf-8"):
+        self.commands = commands
+        self.sinks = list(sinks or [])
+        self.shell = shell
+        self.cwd = cwd
+        self.env = env
+        self.encoding = encoding
+        self.process = None
+        self.result = None
+        self.on_start: list[Callable[[subprocess.Popen], None]] = []
+
+    def add_sink(self, sink: ProcessSink):
+        self.sinks.append(sink)
+
+    def read_stream(self, stream, name: str, lines: queue.SimpleQueue):
+        try:
+            for raw in iter(stream.readline, b""):
+                lines.put((name, raw))
+        finally:
+            stream.close()
+            lines.put((name, None))
+
+    def wait(self) -> dict | None:
+        if hasattr(os, "wait4"):
+            try:
+                _, status, usage = os.wait4(self.process.pid, 0)
+            except ChildProcessError:
+                self.process.wait()
+                return None
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+            return {
+                "user_time": usage.ru_utime,
+                "system_time": usage.ru_stime,
+                # kilobytes on Linux
+                "max_rss": usage.ru_maxrss,
+            }
+        self.process.wait()
+        return None
+
+    def run(self) -> ProcessResult:
+        for sink in self.sinks:
+            sink.open()
+        started = time.perf_counter()
+        counts = {STDOUT: 0, STDERR: 0}
+        try:
+            self.process = subprocess.Popen(
+                self.commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=self.shell, cwd=self.cwd, env=self.env
+            )
+            for callback in self.on_start:
+                callback(self.process)
+            lines = queue.SimpleQueue()
+            readers = [
+                threading.Thread(target=self.read_stream, args=(self.process.stdout, STDOUT, lines), daemon=True),
+                threading.Thread(target=self.read_stream, args=(self.process.stderr, STDERR, lines), daemon=True),
+            ]
+            for reader in readers:
+                reader.start()
+            remaining = len(readers)
+            while remaining:
+                name, raw = lines.get()
+                if raw is None:
+                    remaining -= 1
+                    continue
+                line = raw.decode(self.encoding, errors="replace").strip()
+                if not line:
+                    continue
+                counts[name] += 1
+                for sink in self.sinks:
+                    sink.write(line, name)
+            for reader in readers:
+                reader.join()
+            resource_usage = self.wait()
+            self.result = ProcessResult(self.commands, self.process.returncode, time.perf_counter() - started, resource_usage, counts)
+            if self.result.returncode != 0:
+                logger.warning(f"{self.commands[0] if isinstance(self.commands, list) else self.commands} exited with code {self.result.returncode}")
+            return self.result
+        finally:
+            for sink in self.sinks:
+                try:
+                    sink.close(self.result)
+                except Exception as e:
+                    logger.exception(f"unable to close sink {sink}: {e}")
@@ -0,0 +1,318 @@
+import logging
+import re
+import statistics
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import close_old_connections
+from django.utils import timezone
+
+from catapult.models import Analysis, CeleryTask, CeleryWorker
+from catapult.process import ProcessSink, ProcessResult, STDOUT
+
+logger = logging.getLogger("catapult.progress")
+
+# minimum seconds between two progress updates of the same phase
+PROGRESS_INTERVAL = 2.0
+# number of recent analyses the historical per file duration is taken from
+HISTORY_SIZE = 20
+# share of the progress given to the per file first pass, the rest is the cross-run analysis and the reports
+FIRST_PASS_SHARE = 0.9
+
+FILE_PATTERN = re.compile(r"^File #(\d+)/(\d+)")
+ELAPSED_PATTERN = re.compile(r"^\[\d+:\d+(?::\d+)?\]\s*")
+
+# phases are matched in order, the first matching pattern wins
+PHASES = [
+    ("library", re.compile(r"^(Loading (spectral library|FASTA)|Generating (spectral )?library|Library contains)")),
+    ("loading", re.compile(r"^Loading run")),
+    ("cross-run", re.compile(r"^(Cross-run analysis|Second pass|Reading quantification information|Quantifying (peptides|proteins)|Assembling protein groups)")),
+    ("report", re.compile(r"^(Writing report|Report saved|Saving|Stats report saved)")),
+    ("quantification", re.compile(r"^Quantification")),
+    ("calibration", re.compile(r"^(Calibrating|Optimised mass accuracy|Recommended MS1 mass accuracy|RT window set)")),
+    ("scoring", re.compile(r"^(Training neural networks|Number of IDs|Calculating (protein )?q-values|Removing)")),
+    ("search", re.compile(r"^(Processing|\d+ library precursors are potentially detectable)")),
+    ("finished", re.compile(r"^Finished")),
+]
+# phases after the per file first pass, the parser does not go back to a per file phase once one is reached
+POST_PHASES = {"cross-run", "report", "finished"}
+
+
+def historical_file_seconds(analysis_type: str = None, limit: int = HISTORY_SIZE) -> float | None:
+    """
+    Median seconds per input file of the most recent completed analyses with a start and stop time.
+    :param analysis_type: only use analyses of this type, all types are used if there are none
+    """
+    analyses = Analysis.objects.filter(
+        start_time__isnull=False, stop_time__isnull=False, total_files__gt=0, completed=True
+    ).order_by("-stop_time")
+    if analysis_type and analyses.filter(analysis_type=analysis_type).exists():
+        analyses = analyses.filter(analysis_type=analysis_type)
+    durations = [
+        (stop_time - start_time).total_seconds() / total_files
+        for start_time, stop_time, total_files in analyses.values_list("start_time", "stop_time", "total_files")[:limit]
+        if stop_time > start_time
+    ]
+    if not durations:
+        return None
+    return statistics.median(durations)
+
+
+def send_progress(task_id: str, progress: dict, status: str = "RUNNING"):
+    async_to_sync(get_channel_layer().group_send)(
+        "alert",
+        {
+            "type": "notification_message",
+            "message": {
+                "task_id": task_id,
+                "status": status,
+                "progress": progress,
+            }
+        },
+    )
+
+
+class ProgressPublisher:
+    """
+    Background thread storing progress snapshots in CeleryTask.progress and sending them to a channel group.
+    Only the latest snapshot waits to be published, a newer one replaces it, so a slow database or channel layer
+    delays the updates without blocking the thread that delivers the process output.
+    """
+
+    def __init__(self, task: CeleryTask, group: str | None = "alert"):
+        """
+        :param task: the task the progress is stored on
+        :param group: channel group the snapshots are sent to, None to only store them
+        """
+        self.task = task
+        self.group = group
+        self.condition = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.closing = False
+        self.thread = None
+        self.published = 0
+
+    def open(self):
+        self.closing = False
+        self.thread = threading.Thread(target=self.run, name=f"progress-{self.task.task_id}", daemon=True)
+        self.thread.start()
+
+    def submit(self, progress: dict, status: str = "RUNNING"):
+        with self.condition:
+            self.pending = (progress, status)
+            self.condition.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until the submitted snapshots are published.
+        :return: False if the timeout expired first
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.pending is None and not self.busy, timeout=timeout)
+
+    def close(self):
+        """
+        Publish the last submitted snapshot and stop the background thread.
+        """
+        if self.thread is None:
+            return
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.pending is not None or self.closing)
+                    if self.pending is None:
+                        return
+                    progress, status = self.pending
+                    self.pending = None
+                    self.busy = True
+                try:
+                    self.publish(progress, status)
+                finally:
+                    with self.condition:
+                        self.busy = False
+                        self.condition.notify_all()
+        finally:
+            close_old_connections()
+
+    def publish(self, progress: dict, status: str):
+        try:
+            CeleryTask.objects.filter(id=self.task.id).update(progress=progress)
+            if self.group is not None:
+                send_progress(self.task.task_id, progress, status=status)
+            self.published += 1
+        except Exception as e:
+            logger.exception(f"unable to publish the progress of task {self.task.task_id}: {e}")
+
+
+class DiannProgressParser(ProcessSink):
+    """
+    Follow the output of DIA-NN and turn it into progress updates with the current file, the phase, the percent
+    complete and an estimated number of seconds left. The estimate uses the seconds per file observed in the running
+    process once a file completed and the median of previous analyses before that.
+    Updates are stored in CeleryTask.progress and sent to the alert channel group when the file or phase changes,
+    at most every min_interval seconds for updates within the same phase. They are published by a ProgressPublisher,
+    write only takes a snapshot.
+    """
+
+    def __init__(self, task: CeleryTask, total_files: int = None, file_seconds: float = None,
+                 min_interval: float = PROGRESS_INTERVAL, group: str | None = "alert"):
+        """
+        :param task: the task the progress is stored on
+        :param total_files: number of input files, replaced by the count printed by DIA-NN
+        :param file_seconds: historical seconds per file used until a file of this run completed
+        :param min_interval: minimum seconds between two updates of the same phase
+        :param group: channel group the updates are sent to, None to only store them
+        """
+        self.task = task
+        self.total_files = total_files or None
+        self.file_seconds = file_seconds
+        self.min_interval = min_interval
+        self.publisher = ProgressPublisher(task, group=group)
+        self.current_file = 0
+        self.phase = None
+        self.started = None
+        self.first_file_started = None
+        self.file_started = None
+        self.published = 0.0
+        self.updates = 0
+
+    def open(self):
+        self.started = time.monotonic()
+        self.publisher.open()
+
+    def parse(self, line: str) -> bool:
+        """
+        Update the state from one line.
+        :return: True if the file or the phase changed
+        """
+        line = ELAPSED_PATTERN.sub("", line)
+        match = FILE_PATTERN.match(line)
+        if match:
+            self.current_file = int(match.group(1))
+            self.total_files = int(match.group(2))
+            now = time.monotonic()
+            if self.first_file_started is None:
+                self.first_file_started = now
+            self.file_started = now
+            self.phase = "loading"
+            return True
+        for phase, pattern in PHASES:
+            if pattern.match(line):
+                if phase == self.phase or (self.phase in POST_PHASES and phase not in POST_PHASES):
+                    return False
+                self.phase = phase
+                return True
+        return False
+
+    def completed_files(self) -> int:
+        if self.phase in POST_PHASES:
+            return self.total_files or 0
+        return max(self.current_file - 1, 0)
+
+    def percent(self) -> float | None:
+        if self.phase == "finished":
+            return 100.0
+        if not self.total_files:
+            return None
+        if self.phase in POST_PHASES:
+            return FIRST_PASS_SHARE * 100 + (5.0 if self.phase == "report" else 0.0)
+        return round(FIRST_PASS_SHARE * 100 * self.completed_files() / self.total_files, 1)
+
+    def eta(self) -> float | None:
+        if self.phase == "finished":
+            return 0.0
+        if not self.total_files:
+            return None
+        now = time.monotonic()
+        if self.phase in POST_PHASES:
+            if self.file_seconds is None:
+                return None
+            return max(self.file_seconds * self.total_files - (now - self.started), 0.0)
+        completed = self.completed_files()
+        if completed > 0:
+            per_file = (self.file_started - self.first_file_started) / completed
+        elif self.file_seconds is not None:
+            per_file = self.file_seconds * FIRST_PASS_SHARE
+        else:
+            return None
+        remaining = (self.total_files - completed) * per_file - (now - (self.file_started or now))
+        # the cross-run analysis scales with the number of files, take its share from the first pass
+        remaining += per_file * self.total_files * (1 - FIRST_PASS_SHARE) / FIRST_PASS_SHARE
+        return round(max(remaining, 0.0), 1)
+
+    def snapshot(self) -> dict:
+        return {
+            "file": self.current_file,
+            "total_files": self.total_files,
+            "phase": self.phase,
+            "percent": self.percent(),
+            "eta_seconds": self.eta(),
+            "elapsed_seconds": round(time.monotonic() - self.started, 1) if self.started is not None else 0.0,
+            "updated_at": timezone.now().isoformat(),
+        }
+
+    def write(self, line: str, stream: str = STDOUT):
+        changed = self.parse(line)
+        if changed or (self.phase is not None and time.monotonic() - self.published >= self.min_interval):
+            self.publish()
+
+    def publish(self, status: str = "RUNNING"):
+        progress = self.snapshot()
+        self.published = time.monotonic()
+        self.updates += 1
+        self.task.progress = progress
+        self.publisher.submit(progress, status=status)
+
+    def close(self, result: ProcessResult = None):
+        if result is not None and result.returncode == 0:
+            self.phase = "finished"
+            self.publish()
+        self.publisher.close()
+
+
+def queue_eta() -> dict:
+    """
+    Estimate the seconds until the queued and running analyses are processed. Running tasks count with the
+    estimate of their progress, pending tasks with their number of files and the historical seconds per file.
+    The total is divided by the number of online workers.
+    """
+    file_seconds = historical_file_seconds()
+    running = CeleryTask.objects.filter(status="RUNNING")
+    running_seconds = 0.0
+    unknown = 0
+    for progress in running.values_list("progress", flat=True):
+        if progress and progress.get("eta_seconds") is not None:
+            running_seconds += progress["eta_seconds"]
+        else:
+            unknown += 1
+    pending_files = 0
+    pending = CeleryTask.objects.filter(status="PENDING")
+    for total_files in pending.values_list("analysis__total_files", flat=True):
+        if total_files:
+            pending_files += total_files
+        else:
+            unknown += 1
+    pending_seconds = pending_files * file_seconds if file_seconds is not None else None
+    workers = max(CeleryWorker.objects.filter(worker_status="ONLINE").count(), 1)
+    total = running_seconds + (pending_seconds or 0.0)
+    return {
+        "running": running.count(),
+        "pending": pending.count(),
+        "pending_files": pending_files,
+        "file_seconds": file_seconds,
+        "running_seconds": running_seconds,
+        "pending_seconds": pending_seconds,
+        "workers": workers,
+        "drain_seconds": total / workers,
+        "unknown": unknown,
+    }
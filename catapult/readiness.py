@@ -0,0 +1,312 @@
+import datetime
+import heapq
+import logging
+import os
+import time
+
+from django.db import transaction
+from django.db.models import QuerySet, OuterRef, Subquery, Exists, Count, Q, F, Case, When, Value, \
+    ExpressionWrapper, BooleanField, IntegerField, CharField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from catapult.models import File, CatapultRunConfig, Analysis, FastaFile, SpectralLibrary
+from catapult.notify import Listener, EXPERIMENT_CHANNEL, parse_ids
+from catapult.scheduling import config_priority
+from catapult.sharding import shard_commands
+from catapult.scanner import get_directory_size
+from catapult.size_tracker import stable_files, acquisition_folder_filter
+from catapult.tasks import run_diann, run_diann_worker
+
+logger = logging.getLogger("catapult.readiness")
+
+# seconds between full sweeps of unready files and pending configs when listening for notifications
+SWEEP_INTERVAL = 300
+
+
+def check_files_ready(files: QuerySet, threshold: int) -> set[int]:
+    """
+    Mark files whose size has not changed for threshold seconds as ready for processing.
+    Files are compared with their size on disk, Bruker .d folders tracked by the sentinel use their
+    recorded size change instead and only untracked folders are walked.
+    :return: ids of the experiments that received ready files
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=threshold)
+    files = files.filter(size__isnull=False, ready_for_processing=False, updated_at__lt=cutoff)
+    experiments = set()
+    file_d = files.filter(acquisition_folder_filter())
+    for r in files.filter(~acquisition_folder_filter()).select_related("folder_watching_location"):
+        try:
+            size = os.path.getsize(r.get_path())
+        except OSError:
+            continue
+        if r.size == size:
+            r.ready_for_processing = True
+            r.save()
+            experiments.add(r.experiment_id)
+    stable = stable_files(file_d, threshold)
+    experiments.update(stable.values_list("experiment_id", flat=True))
+    stable.update(ready_for_processing=True)
+    with transaction.atomic():
+        for f in file_d.filter(size_changed_at__isnull=True).select_related("folder_watching_location"):
+            try:
+                folder_size = get_directory_size(f.get_path())
+            except OSError:
+                continue
+            if folder_size == f.size:
+                f.ready_for_processing = True
+                experiments.add(f.experiment_id)
+            else:
+                f.size = folder_size
+            f.save()
+    return experiments
+
+
+def pending_configs() -> QuerySet:
+    return CatapultRunConfig.objects.filter(
+        analysis__isnull=False,
+        analysis__completed=False,
+        analysis__processing=False,
+    )
+
+
+def dispatch(analysis, config, commands: list, queue: bool, final: bool = False):
+    if not queue:
+        run_diann(commands=commands, analysis_id=analysis.id, config_id=config.id)
+    else:
+        task = run_diann_worker.using(priority=config_priority(config.content))
+        for shard, files in shard_commands(analysis, commands, final=final):
+            if files is None:
+                task.enqueue(commands=shard, analysis_id=analysis.id, config_id=config.id)
+            else:
+                task.enqueue(commands=shard, analysis_id=analysis.id, config_id=config.id, files=files)
+
+
+def check_input_files(model, config_ids: list[int]) -> int:
+    """
+    Check the unready fasta or spectral library files of configs on disk and persist the changes in bulk.
+    A file is ready once it is not empty and has the same size as at the previous check.
+    :param model: FastaFile or SpectralLibrary
+    :return: number of files that became ready
+    """
+    ready = []
+    resized = []
+    for f in model.objects.filter(config_id__in=config_ids, ready=False).select_related("config__folder_watching_location"):
+        try:
+            size = os.path.getsize(f.get_path())
+        except OSError:
+            continue
+        if size != f.size:
+            f.size = size
+            resized.append(f)
+        elif size > 0:
+            f.ready = True
+            ready.append(f)
+    with transaction.atomic():
+        if ready:
+            model.objects.bulk_update(ready, ["ready"])
+        if resized:
+            model.objects.bulk_update(resized, ["size"])
+    return len(ready)
+
+
+def annotate_readiness(configs: QuerySet) -> QuerySet:
+    """
+    Annotate configs with the state needed to decide whether DIA-NN can be dispatched:
+    - analysis_id and analysis_total_files: the first analysis of the config
+    - inputs_ready: whether every required fasta and spectral library file is ready
+    - generated_count: number of files with a quant file for the analysis
+    - ready_count: number of ready files of the experiment, without the files that failed too many shards
+    - exhausted_count: number of ready files of the experiment that failed too many shards
+    - dispatch_mode: "all" when every file but the exhausted ones has a quant file, "new" when ready files have
+      no quant file yet, None otherwise
+    """
+    first_analysis = Analysis.objects.filter(config=OuterRef("pk")).order_by("id")
+    generated = Analysis.generated_quant.through.objects.filter(
+        analysis_id=OuterRef("analysis_id")
+    ).order_by().values("analysis_id").annotate(count=Count("file_id")).values("count")
+    ready_files = File.objects.filter(
+        experiment_id=OuterRef("analysis_experiment_id"), ready_for_processing=True,
+        quant_failures__lt=File.MAX_QUANT_FAILURES
+    ).order_by().values("experiment_id").annotate(count=Count("id")).values("count")
+    exhausted_files = File.objects.filter(
+        experiment_id=OuterRef("analysis_experiment_id"), ready_for_processing=True,
+        quant_failures__gte=File.MAX_QUANT_FAILURES
+    ).order_by().values("experiment_id").annotate(count=Count("id")).values("count")
+    return configs.annotate(
+        analysis_id=Subquery(first_analysis.values("id")[:1]),
+        analysis_experiment_id=Subquery(first_analysis.values("experiment_id")[:1]),
+        analysis_total_files=Subquery(first_analysis.values("total_files")[:1]),
+        inputs_ready=ExpressionWrapper(
+            (Q(fasta_required=False) | ~Exists(FastaFile.objects.filter(config=OuterRef("pk"), ready=False))) &
+            (Q(spectral_library_required=False) | ~Exists(SpectralLibrary.objects.filter(config=OuterRef("pk"), ready=False))),
+            output_field=BooleanField()
+        ),
+        generated_count=Coalesce(Subquery(generated, output_field=IntegerField()), 0),
+        ready_count=Coalesce(Subquery(ready_files, output_field=IntegerField()), 0),
+        exhausted_count=Coalesce(Subquery(exhausted_files, output_field=IntegerField()), 0),
+    ).annotate(
+        dispatch_mode=Case(
+            When(inputs_ready=False, then=Value(None)),
+            When(Q(generated_count__gt=0) & Q(generated_count=F("analysis_total_files") - F("exhausted_count")),
+                 then=Value("all")),
+            When(generated_count__lt=F("ready_count"), then=Value("new")),
+            default=Value(None),
+            output_field=CharField(null=True),
+        )
+    )
+
+
+def update_input_flags(configs: QuerySet):
+    """
+    Persist fasta_ready and spectral_library_ready of configs with two UPDATE statements.
+    """
+    configs.filter(fasta_required=True).update(
+        fasta_ready=~Exists(FastaFile.objects.filter(config=OuterRef("pk"), ready=False))
+    )
+    configs.filter(spectral_library_required=True).update(
+        spectral_library_ready=~Exists(SpectralLibrary.objects.filter(config=OuterRef("pk"), ready=False))
+    )
+
+
+def evaluate_configs(configs: QuerySet, queue: bool) -> int:
+    """
+    Check the fasta and spectral library files of configs and dispatch DIA-NN for the configs that have
+    new ready files, or the final analysis once every file still dispatched has a quant file. Readiness of
+    every config is computed by a single annotated query and state changes are written in bulk.
+    :return: number of analyses dispatched
+    """
+    config_ids = list(configs.values_list("id", flat=True).distinct())
+    if not config_ids:
+        return 0
+    configs = CatapultRunConfig.objects.filter(id__in=config_ids)
+    check_input_files(FastaFile, config_ids)
+    check_input_files(SpectralLibrary, config_ids)
+    update_input_flags(configs)
+
+    dispatchable = list(
+        annotate_readiness(configs).filter(dispatch_mode__isnull=False).values_list("id", "analysis_id", "dispatch_mode")
+    )
+    if not dispatchable:
+        return 0
+    config_objects = CatapultRunConfig.objects.select_related("folder_watching_location").in_bulk(
+        [config_id for config_id, _, _ in dispatchable]
+    )
+    analyses = Analysis.objects.in_bulk([analysis_id for _, analysis_id, _ in dispatchable])
+    jobs = []
+    for config_id, analysis_id, mode in dispatchable:
+        analysis = analyses[analysis_id]
+        config = config_objects[config_id]
+        # the analysis reads its config through the relation, share the instance already loaded
+        analysis.config = config
+        commands = analysis.create_commands_from_config(dry_run=False, all_files=mode == "all")
+        jobs.append((analysis, config, commands, mode == "all"))
+    Analysis.objects.filter(id__in=analyses.keys()).update(processing=True)
+    dispatched = 0
+    for analysis, config, commands, final in jobs:
+        analysis.processing = True
+        if len(commands) > 0:
+            dispatch(analysis, config, commands, queue, final=final)
+            dispatched += 1
+    return dispatched
+
+
+class ReadinessScheduler:
+    """
+    Event driven replacement of the database_check polling loop. Unready files are kept in a priority queue
+    ordered by the time their size will have been stable for the threshold, the queue is fed by the experiment
+    ids the sentinel sends on Postgres NOTIFY whenever files change. Only the configs of experiments that
+    received ready files or notifications are evaluated, a full sweep runs every sweep_interval seconds to
+    pick up fasta and spectral library files and anything missed while the scheduler was down.
+    """
+
+    def __init__(self, threshold: int, queue: bool = False, sweep_interval: float = SWEEP_INTERVAL):
+        self.threshold = threshold
+        self.queue = queue
+        self.sweep_interval = sweep_interval
+        self.heap: list[tuple[float, int]] = []
+        self.deadlines: dict[int, float] = {}
+        self.dirty: set[int] = set()
+
+    def schedule(self, file_id: int, deadline: float):
+        if self.deadlines.get(file_id) == deadline:
+            return
+        self.deadlines[file_id] = deadline
+        heapq.heappush(self.heap, (deadline, file_id))
+
+    def schedule_files(self, files: QuerySet, not_before: float = None):
+        for file_id, updated_at, size_changed_at in files.filter(ready_for_processing=False).values_list(
+                "id", "updated_at", "size_changed_at"):
+            deadline = max(updated_at, size_changed_at or updated_at).timestamp() + self.threshold
+            if not_before is not None:
+                deadline = max(deadline, not_before)
+            self.schedule(file_id, deadline)
+
+    def schedule_experiments(self, experiment_ids: set[int]):
+        self.schedule_files(File.objects.filter(experiment_id__in=experiment_ids))
+        self.dirty.update(experiment_ids)
+
+    def pop_due(self, now: float) -> list[int]:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, file_id = heapq.heappop(self.heap)
+            # entries superseded by a later deadline are skipped
+            if self.deadlines.get(file_id) != deadline:
+                continue
+            del self.deadlines[file_id]
+            due.append(file_id)
+        return due
+
+    def next_deadline(self) -> float | None:
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def process_due(self, now: float = None):
+        now = time.time() if now is None else now
+        due = self.pop_due(now)
+        if not due:
+            return
+        files = File.objects.filter(id__in=due)
+        self.dirty.update(check_files_ready(files, self.threshold))
+        # files still changing are checked again once they can have been stable for the threshold
+        self.schedule_files(files, not_before=now + self.threshold)
+
+    def evaluate_dirty(self) -> int:
+        if not self.dirty:
+            return 0
+        experiments, self.dirty = self.dirty, set()
+        return evaluate_configs(pending_configs().filter(experiment_id__in=experiments), self.queue)
+
+    def sweep(self) -> int:
+        self.schedule_files(File.objects.filter(size__isnull=False))
+        self.dirty.clear()
+        return evaluate_configs(pending_configs(), self.queue)
+
+    def run(self, fallback_interval: float):
+        """
+        :param fallback_interval: seconds between sweeps when the database does not support LISTEN/NOTIFY
+        """
+        with Listener(EXPERIMENT_CHANNEL) as listener:
+            sweep_interval = self.sweep_interval
+            if not listener.listening:
+                logger.warning("LISTEN/NOTIFY is not available, sweeping the database every %ss", fallback_interval)
+                sweep_interval = fallback_interval
+            self.sweep()
+            next_sweep = time.time() + sweep_interval
+            while True:
+                now = time.time()
+                timeout = next_sweep - now
+                deadline = self.next_deadline()
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+                experiments = set()
+                for _, payload in listener.wait(timeout):
+                    experiments.update(parse_ids(payload))
+                if experiments:
+                    self.schedule_experiments(experiments)
+                self.process_due()
+                self.evaluate_dirty()
+                if time.time() >= next_sweep:
+                    self.sweep()
+                    next_sweep = time.time() + sweep_interval
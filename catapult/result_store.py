@@ -0,0 +1,220 @@
+import logging
+import operator
+import os
+import shutil
+from functools import reduce
+
+import pandas as pd
+from django.conf import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger("catapult.result_store")
+
+PRECURSOR_TABLE = "precursor"
+PROTEIN_GROUP_TABLE = "protein_group"
+
+# text fields that can be filtered with a case-insensitive substring match
+TEXT_FIELDS = {
+    PRECURSOR_TABLE: ["gene_names", "protein_group", "precursor_id"],
+    PROTEIN_GROUP_TABLE: ["gene_names", "protein_group"],
+}
+
+# columns of the files of each table and their Arrow type, so a file whose text column is entirely empty is not
+# written with a null column the other files cannot be read with
+STORE_COLUMNS = {
+    PRECURSOR_TABLE: [
+        ("result_summary_id", "int64"),
+        ("precursor_id", "string"),
+        ("gene_names", "string"),
+        ("protein_group", "string"),
+        ("proteotypic", "bool"),
+        ("intensity", "double"),
+    ],
+    PROTEIN_GROUP_TABLE: [
+        ("result_summary_id", "int64"),
+        ("gene_names", "string"),
+        ("protein_group", "string"),
+        ("intensity", "double"),
+    ],
+}
+PARTITION_COLUMNS = [("analysis_id", "int64"), ("file_id", "int64")]
+
+
+class ResultStore:
+    """
+    Columnar store of precursor and protein group report content as Parquet files partitioned by analysis and file:
+    <root>/<table>/analysis_id=<id>/file_id=<id>/part-0.parquet
+    """
+
+    def __init__(self, root: str):
+        if pa is None:
+            raise ImportError("pyarrow is required for the Parquet result store")
+        self.root = root
+
+    def table_path(self, table: str) -> str:
+        return os.path.join(self.root, table)
+
+    def partition_path(self, table: str, analysis_id: int, file_id: int) -> str:
+        return os.path.join(self.table_path(table), f"analysis_id={analysis_id}", f"file_id={file_id}")
+
+    def file_schema(self, table: str):
+        return pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in STORE_COLUMNS[table]])
+
+    def partitioning(self):
+        return ds.partitioning(
+            pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in PARTITION_COLUMNS]), flavor="hive"
+        )
+
+    def schema(self, table: str):
+        """
+        Schema of a whole table, its files and partition columns, given to the dataset instead of taking the schema
+        of whichever file comes first.
+        """
+        schema = self.file_schema(table)
+        for field in self.partitioning().schema:
+            schema = schema.append(field)
+        return schema
+
+    def write_rows(self, table: str, analysis_id: int, rows: pd.DataFrame):
+        """
+        Write prepared report content rows, replacing the partition of every file present in the rows.
+        :param table: PRECURSOR_TABLE or PROTEIN_GROUP_TABLE
+        :param analysis_id: the analysis the rows belong to
+        :param rows: frame whose columns are report content field names, including file_id
+        """
+        for file_id, file_rows in rows.groupby("file_id", sort=False):
+            path = self.partition_path(table, analysis_id, int(file_id))
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+            arrow_table = pa.Table.from_pandas(file_rows, schema=self.file_schema(table), preserve_index=False)
+            pq.write_table(arrow_table, os.path.join(path, "part-0.parquet"))
+
+    def delete_analysis(self, analysis_id: int):
+        for table in TEXT_FIELDS:
+            path = os.path.join(self.table_path(table), f"analysis_id={analysis_id}")
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def dataset(self, table: str):
+        path = self.table_path(table)
+        if not os.path.exists(path):
+            return None
+        return ds.dataset(path, schema=self.schema(table), format="parquet", partitioning=self.partitioning())
+
+    def query(self, table: str, filters: dict, ordering: str = None) -> "ResultStoreQuery":
+        """
+        Build a lazy query over a table. Filters on analysis and file prune partitions,
+        intensity and id filters are pushed down to the Parquet row group statistics.
+        :param table: PRECURSOR_TABLE or PROTEIN_GROUP_TABLE
+        :param filters: supported keys are analysis (list), file, result_summary (list), min_intensity,
+        max_intensity and the text fields of the table
+        :param ordering: field to order by, prefixed with "-" for descending order
+        """
+        expression = None
+
+        def add(condition):
+            nonlocal expression
+            expression = condition if expression is None else expression & condition
+
+        if filters.get("analysis"):
+            add(ds.field("analysis_id").isin([int(a) for a in filters["analysis"]]))
+        if filters.get("file"):
+            add(ds.field("file_id") == int(filters["file"]))
+        if filters.get("result_summary") is not None:
+            add(ds.field("result_summary_id").isin([int(r) for r in filters["result_summary"]]))
+        if filters.get("min_intensity"):
+            add(ds.field("intensity") >= float(filters["min_intensity"]))
+        if filters.get("max_intensity"):
+            add(ds.field("intensity") <= float(filters["max_intensity"]))
+        for field in TEXT_FIELDS[table]:
+            if filters.get(field):
+                # ;-separated terms match any of them, like the database filters
+                terms = [term.strip() for term in filters[field].split(";") if term.strip()]
+                if terms:
+                    add(reduce(operator.or_, [pc.match_substring(ds.field(field), term, ignore_case=True) for term in terms]))
+        return ResultStoreQuery(self.dataset(table), expression, ordering)
+
+
+class ResultStoreQuery:
+    """
+    A lazily evaluated, sliceable query over a Parquet table, usable with the rest framework paginators
+    """
+
+    def __init__(self, dataset, expression, ordering: str = None):
+        self.dataset = dataset
+        self.expression = expression
+        self.ordering = ordering
+        self._count = None
+
+    def count(self) -> int:
+        if self._count is None:
+            if self.dataset is None:
+                self._count = 0
+            else:
+                self._count = self.dataset.count_rows(filter=self.expression)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        if self.dataset is None:
+            return []
+        start = item.start or 0
+        if self.ordering:
+            sort_keys = [(self.ordering.lstrip("-"), "descending" if self.ordering.startswith("-") else "ascending")]
+            if item.stop is None:
+                table = self.dataset.to_table(filter=self.expression).sort_by(sort_keys)
+                stop = table.num_rows
+            else:
+                stop = item.stop
+                table = self.top_rows(stop, sort_keys)
+            table = table.slice(start, stop - start)
+        else:
+            stop = item.stop if item.stop is not None else self.count()
+            table = self.dataset.scanner(filter=self.expression).head(stop).slice(start, stop - start)
+        return table.to_pylist()
+
+    def top_rows(self, k: int, sort_keys: list[tuple[str, str]]):
+        """
+        First k rows in the given order. The batches of the scan are merged into the k best rows seen so far, so
+        only about k rows plus one batch are held at once and the filtered rows are never sorted as a whole.
+        """
+        if k <= 0:
+            return self.dataset.schema.empty_table()
+        top = None
+        for batch in self.dataset.scanner(filter=self.expression).to_batches():
+            if batch.num_rows == 0:
+                continue
+            table = pa.Table.from_batches([batch])
+            if top is not None:
+                table = pa.concat_tables([top, table])
+            if table.num_rows > k:
+                table = table.take(pc.select_k_unstable(table, k, sort_keys))
+            top = table
+        if top is None:
+            return self.dataset.schema.empty_table()
+        return top.sort_by(sort_keys)
+
+
+def get_result_store() -> ResultStore | None:
+    """
+    Return the configured Parquet result store, or None if it is disabled or pyarrow is not installed.
+    """
+    root = getattr(settings, "PARQUET_RESULT_STORE", "")
+    if not root:
+        return None
+    if pa is None:
+        logger.warning("PARQUET_RESULT_STORE is set but pyarrow is not installed, the Parquet result store is disabled")
+        return None
+    return ResultStore(root)
@@ -0,0 +1,390 @@
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.db import transaction
+from django.utils import timezone
+
+from catapult.models import File, Experiment, FolderWatchingLocation, DirectoryScanState
+from catapult.notify import notify, EXPERIMENT_CHANNEL
+
+logger = logging.getLogger("catapult.scanner")
+
+# number of threads used to walk a folder watching location
+SCAN_WORKERS = 8
+# number of rows per bulk insert or update
+SCAN_BATCH_SIZE = 1000
+# deleting more than this fraction of the known files of a location in one pass is refused, a network share that
+# is not mounted looks like an empty folder
+MAX_DELETE_FRACTION = 0.5
+# number of files that can always be deleted in one pass, so small locations can lose most of their files
+MIN_DELETE_GUARD = 20
+
+Acquisition = namedtuple("Acquisition", ["path", "size", "modified_time"])
+
+
+class DirectoryListing:
+    """
+    The watched entries of a single directory
+    - modified_time: the modification time of the directory when it was listed
+    - acquisitions: instrument files and folders (e.g. Bruker .d) with a watched extension
+    - configs: .cat.yml and .cat.yaml run configs
+    - stats_files: DIA-NN report.stats.tsv files and their modification time
+    - subdirectories: directories to scan
+    - changed: whether the directory was listed again rather than taken from the scan-state cache
+    """
+
+    def __init__(self, path: str, modified_time: float = None):
+        self.path = path
+        self.modified_time = modified_time
+        self.acquisitions: list[Acquisition] = []
+        self.configs: list[str] = []
+        self.stats_files: list[tuple[str, float]] = []
+        self.subdirectories: list[str] = []
+        self.entries = 0
+        self.changed = True
+
+    def to_state(self) -> dict:
+        return {
+            "acquisitions": [[os.path.basename(a.path), a.size, a.modified_time] for a in self.acquisitions],
+            "configs": [os.path.basename(c) for c in self.configs],
+            "stats_files": [[os.path.basename(p), m] for p, m in self.stats_files],
+            "subdirectories": [os.path.basename(d) for d in self.subdirectories],
+            "entries": self.entries,
+        }
+
+    @classmethod
+    def from_state(cls, path: str, modified_time: float, state: dict) -> "DirectoryListing":
+        listing = cls(path, modified_time)
+        listing.acquisitions = [Acquisition(os.path.join(path, n), size, m) for n, size, m in state["acquisitions"]]
+        listing.configs = [os.path.join(path, n) for n in state["configs"]]
+        listing.stats_files = [(os.path.join(path, n), m) for n, m in state["stats_files"]]
+        listing.subdirectories = [os.path.join(path, n) for n in state["subdirectories"]]
+        listing.entries = state["entries"]
+        listing.changed = False
+        return listing
+
+
+class ScanResult:
+    """
+    Entries found while scanning a folder watching location
+    - acquisitions: every instrument file and folder found
+    - changed_acquisitions: acquisitions of directories whose listing changed since the last scan
+    - removed_acquisitions: paths of acquisitions that no longer exist
+    - configs: run configs of directories whose listing changed
+    - stats_files: report.stats.tsv files that are new or were modified
+    - listings: listing of every directory that was listed again, to be stored in the scan-state cache
+    - removed_directories: cached directories that no longer exist
+    - unavailable: the root could not be read or was empty while the cache knew entries in it, nothing is
+    reported as removed and the cache is left as it was
+    """
+
+    def __init__(self):
+        self.acquisitions: list[Acquisition] = []
+        self.changed_acquisitions: list[Acquisition] = []
+        self.removed_acquisitions: list[str] = []
+        self.configs: list[str] = []
+        self.stats_files: list[str] = []
+        self.listings: list[DirectoryListing] = []
+        self.removed_directories: list[str] = []
+        self.unavailable = False
+        self.directories = 0
+        self.cached_directories = 0
+        self.entries = 0
+        self.elapsed = 0.0
+
+    @property
+    def entries_per_second(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.entries / self.elapsed
+
+
+def get_extensions(folder_watching_location: FolderWatchingLocation) -> set[str]:
+    if not folder_watching_location.extensions:
+        return set()
+    return set(e.strip() for e in folder_watching_location.extensions.split(",") if e.strip())
+
+
+def get_directory_size(path: str) -> int:
+    """
+    Sum the size of every file below a directory, using the stat results returned by os.scandir.
+    """
+    total_size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                total_size += get_directory_size(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total_size += entry.stat(follow_symlinks=False).st_size
+    return total_size
+
+
+def scan_directory(path: str, extensions: set[str], ignore_term: str | None, cached: DirectoryScanState = None) -> DirectoryListing | None:
+    """
+    List the direct children of a directory. When the directory has the same modification time as in the
+    scan-state cache, its children were not added, removed or renamed and the cached listing is returned instead.
+    :return: the listing, or None if the directory no longer exists or cannot be read and is not cached
+    """
+    try:
+        modified_time = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        # keep the cached listing rather than deleting the files of a directory that is temporarily unreachable
+        logger.warning(f"unable to stat {path}: {e}")
+        return DirectoryListing.from_state(path, cached.modified_time, cached.entries) if cached is not None else None
+    if cached is not None and cached.modified_time == modified_time:
+        return DirectoryListing.from_state(path, modified_time, cached.entries)
+
+    listing = DirectoryListing(path, modified_time)
+    try:
+        iterator = os.scandir(path)
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"unable to scan {path}: {e}")
+        return DirectoryListing.from_state(path, cached.modified_time, cached.entries) if cached is not None else None
+    with iterator as it:
+        for entry in it:
+            listing.entries += 1
+            if ignore_term and ignore_term in entry.name:
+                continue
+            extension = os.path.splitext(entry.name)[1]
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if extension in extensions:
+                        stat = entry.stat(follow_symlinks=False)
+                        listing.acquisitions.append(Acquisition(entry.path, get_directory_size(entry.path), stat.st_mtime))
+                    else:
+                        listing.subdirectories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    if extension in extensions:
+                        stat = entry.stat(follow_symlinks=False)
+                        listing.acquisitions.append(Acquisition(entry.path, stat.st_size, stat.st_mtime))
+                    elif entry.name.endswith(".cat.yml") or entry.name.endswith(".cat.yaml"):
+                        listing.configs.append(entry.path)
+                    elif entry.name.endswith("report.stats.tsv"):
+                        listing.stats_files.append((entry.path, entry.stat(follow_symlinks=False).st_mtime))
+            except OSError as e:
+                logger.warning(f"unable to stat {entry.path}: {e}")
+    return listing
+
+
+def stats_file_changed(file_path: str, cached_modified_time: float) -> bool:
+    try:
+        return os.stat(file_path).st_mtime != cached_modified_time
+    except OSError:
+        return False
+
+
+def scan_tree(root: str, extensions: set[str], ignore_term: str | None = None, max_workers: int = SCAN_WORKERS,
+              cache: dict[str, DirectoryScanState] = None) -> ScanResult:
+    """
+    Walk a directory tree with os.scandir, scanning subdirectories concurrently on a thread pool.
+    With a scan-state cache, only directories whose modification time changed are listed again,
+    the others only cost a stat of the directory and of their report.stats.tsv files.
+    Files modified in place inside an unchanged directory are not detected, the readiness check of
+    database_check covers acquisitions that were still being written.
+    :param root: the directory to walk
+    :param extensions: file and folder extensions of instrument acquisitions
+    :param ignore_term: entries whose name contains this term are skipped
+    :param max_workers: number of threads
+    :param cache: scan-state cache of the location, mapping directory path to DirectoryScanState
+    """
+    result = ScanResult()
+    started = time.perf_counter()
+    visited = set()
+    root_entries = 0
+    if cache is None:
+        cache = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(scan_directory, root, extensions, ignore_term, cache.get(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                listing = future.result()
+                if listing is None:
+                    continue
+                visited.add(listing.path)
+                if listing.path == root:
+                    root_entries = listing.entries
+                result.directories += 1
+                result.entries += listing.entries
+                result.acquisitions.extend(listing.acquisitions)
+                if listing.changed:
+                    result.listings.append(listing)
+                    result.changed_acquisitions.extend(listing.acquisitions)
+                    result.configs.extend(listing.configs)
+                    result.stats_files.extend(p for p, _ in listing.stats_files)
+                    cached = cache.get(listing.path)
+                    if cached is not None:
+                        current = set(a.path for a in listing.acquisitions)
+                        result.removed_acquisitions.extend(
+                            os.path.join(listing.path, a[0]) for a in cached.entries["acquisitions"]
+                            if os.path.join(listing.path, a[0]) not in current
+                        )
+                else:
+                    result.cached_directories += 1
+                    result.stats_files.extend(p for p, m in listing.stats_files if stats_file_changed(p, m))
+                for subdirectory in listing.subdirectories:
+                    pending.add(executor.submit(scan_directory, subdirectory, extensions, ignore_term, cache.get(subdirectory)))
+    for path, cached in cache.items():
+        if path not in visited:
+            result.removed_directories.append(path)
+            result.removed_acquisitions.extend(os.path.join(path, a[0]) for a in cached.entries["acquisitions"])
+    if cache and (root not in visited or root_entries == 0):
+        logger.warning(f"{root} is unreachable or empty, keeping the files and the scan-state cache of its folders")
+        result.unavailable = True
+        result.removed_acquisitions = []
+        result.removed_directories = []
+        result.listings = []
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def get_scan_signature(folder_watching_location: FolderWatchingLocation) -> str:
+    return f"{folder_watching_location.extensions or ''}|{folder_watching_location.ignore_term or ''}"
+
+
+def load_scan_cache(folder_watching_location: FolderWatchingLocation) -> dict[str, DirectoryScanState]:
+    """
+    Load the scan-state cache of a location. The cache is dropped when the extensions or the ignore term
+    of the location changed since it was written.
+    """
+    states = DirectoryScanState.objects.filter(folder_watching_location=folder_watching_location)
+    if states.exclude(scan_signature=get_scan_signature(folder_watching_location)).exists():
+        logger.info(f"scan settings of {folder_watching_location.folder_path} changed, discarding its scan-state cache")
+        states.delete()
+        return {}
+    return {state.path: state for state in states}
+
+
+def save_scan_cache(folder_watching_location: FolderWatchingLocation, result: ScanResult, batch_size: int = SCAN_BATCH_SIZE):
+    """
+    Store the listings of the directories that were listed again and forget the removed directories.
+    """
+    signature = get_scan_signature(folder_watching_location)
+    with transaction.atomic():
+        if result.removed_directories:
+            for start in range(0, len(result.removed_directories), batch_size):
+                DirectoryScanState.objects.filter(
+                    folder_watching_location=folder_watching_location,
+                    path__in=result.removed_directories[start:start + batch_size]
+                ).delete()
+        if result.listings:
+            DirectoryScanState.objects.bulk_create(
+                [
+                    DirectoryScanState(
+                        folder_watching_location=folder_watching_location,
+                        path=listing.path,
+                        modified_time=listing.modified_time,
+                        scan_signature=signature,
+                        entries=listing.to_state(),
+                    ) for listing in result.listings
+                ],
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["folder_watching_location", "path"],
+                update_fields=["modified_time", "scan_signature", "entries", "updated_at"],
+            )
+
+
+def get_experiments(names: set[str], batch_size: int = SCAN_BATCH_SIZE) -> dict[str, int]:
+    """
+    Return the id of the experiment of each name, creating the missing experiments in bulk.
+    """
+    names = list(names)
+    experiments = {}
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        experiments.update(Experiment.objects.filter(experiment_name__in=batch).values_list("experiment_name", "id"))
+        missing = [n for n in batch if n not in experiments]
+        if missing:
+            Experiment.objects.bulk_create([Experiment(experiment_name=n) for n in missing], ignore_conflicts=True)
+            experiments.update(Experiment.objects.filter(experiment_name__in=missing).values_list("experiment_name", "id"))
+    return experiments
+
+
+def sync_files(folder_watching_location: FolderWatchingLocation, acquisitions: list[Acquisition],
+               removed: list[str] = None, batch_size: int = SCAN_BATCH_SIZE, known_paths_only: bool = False,
+               max_delete_fraction: float = MAX_DELETE_FRACTION) -> dict:
+    """
+    Compare scanned acquisitions with the files known for a folder watching location using a single query,
+    then create the new files, update the sizes that changed and delete the removed files in batches.
+    Deleting a file cascades to its quantifications and results, so the deletions are refused when more than
+    max_delete_fraction of the known files would go at once.
+    :param folder_watching_location: the location that was scanned
+    :param acquisitions: acquisitions to create or update
+    :param removed: paths of acquisitions that no longer exist
+    :param batch_size: number of rows per bulk insert, update or delete
+    :param known_paths_only: only load the known files matching the given paths, in batches, instead of every file
+    of the location. Used for the small batches of the file system event queue.
+    :param max_delete_fraction: largest fraction of the known files of the location deleted in one pass
+    :return: number of created, updated and deleted files, and of the files whose deletion was refused
+    """
+    folder_path = folder_watching_location.folder_path
+    files = File.objects.filter(folder_watching_location=folder_watching_location)
+    if known_paths_only:
+        paths = [a.path.replace(folder_path, "") for a in acquisitions] + [r.replace(folder_path, "") for r in removed or []]
+        known = {}
+        for start in range(0, len(paths), batch_size):
+            known.update(
+                (file_path, (file_id, size, experiment_id))
+                for file_id, file_path, size, experiment_id in files.filter(
+                    file_path__in=paths[start:start + batch_size]
+                ).values_list("id", "file_path", "size", "experiment_id")
+            )
+    else:
+        known = {
+            file_path: (file_id, size, experiment_id)
+            for file_id, file_path, size, experiment_id in files.values_list("id", "file_path", "size", "experiment_id")
+        }
+    new = []
+    updated = []
+    changed_experiments = set()
+    now = timezone.now()
+    for acquisition in acquisitions:
+        file_path = acquisition.path.replace(folder_path, "")
+        if file_path in known:
+            file_id, size, experiment_id = known[file_path]
+            if size != acquisition.size:
+                updated.append(File(id=file_id, size=acquisition.size, updated_at=now, size_changed_at=now))
+                changed_experiments.add(experiment_id)
+        else:
+            new.append((file_path, acquisition))
+
+    deleted = [known[p][0] for p in (r.replace(folder_path, "") for r in removed or []) if p in known]
+    refused = 0
+    if len(deleted) > MIN_DELETE_GUARD:
+        total = files.count() if known_paths_only else len(known)
+        if len(deleted) > max_delete_fraction * total:
+            logger.warning(
+                f"refusing to delete {len(deleted)} of the {total} files of {folder_path}, "
+                f"check that the folder is mounted"
+            )
+            refused = len(deleted)
+            deleted = []
+
+    experiments = get_experiments({os.path.dirname(a.path) for _, a in new}, batch_size=batch_size)
+    with transaction.atomic():
+        if new:
+            File.objects.bulk_create([
+                File(
+                    file_path=file_path,
+                    folder_watching_location=folder_watching_location,
+                    size=acquisition.size,
+                    size_changed_at=now,
+                    experiment_id=experiments[os.path.dirname(acquisition.path)],
+                ) for file_path, acquisition in new
+            ], batch_size=batch_size, ignore_conflicts=True)
+        if updated:
+            File.objects.bulk_update(updated, ["size", "updated_at", "size_changed_at"], batch_size=batch_size)
+        for start in range(0, len(deleted), batch_size):
+            File.objects.filter(id__in=deleted[start:start + batch_size]).delete()
+    changed_experiments.update(experiments[os.path.dirname(a.path)] for _, a in new)
+    # wake up the readiness scheduler of database_check
+    notify(EXPERIMENT_CHANNEL, changed_experiments)
+    return {"created": len(new), "updated": len(updated), "deleted": len(deleted), "refused": refused}
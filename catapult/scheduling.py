@@ -0,0 +1,129 @@
+import datetime
+import statistics
+
+from django.db.models import Count, QuerySet
+from django.utils import timezone
+from django_tasks.backends.database.models import DBTaskResult
+from django_tasks.task import ResultStatus
+
+from catapult.models import CatapultRunConfig, CeleryTask, FolderWatchingLocation
+
+# priority of a run config without cat_priority
+DEFAULT_PRIORITY = 0
+# lowest priority of a run config with cat_qc set
+QC_PRIORITY = 50
+MAX_PRIORITY = 100
+# priority points a queued task gains per minute of waiting, so low priority work is never starved
+AGING_PER_MINUTE = 1.0
+# priority points a task loses per task of its folder watching location already running, divided by the location weight
+FAIR_SHARE_PENALTY = 10.0
+
+
+def config_priority(content: dict | None) -> int:
+    """
+    Priority of the tasks of a run config from its cat_priority (0 to MAX_PRIORITY) and cat_qc entries,
+    QC runs get at least QC_PRIORITY.
+    """
+    if not content:
+        return DEFAULT_PRIORITY
+    try:
+        priority = int(content.get("cat_priority") or DEFAULT_PRIORITY)
+    except (TypeError, ValueError):
+        priority = DEFAULT_PRIORITY
+    priority = min(max(priority, 0), MAX_PRIORITY)
+    if content.get("cat_qc"):
+        priority = max(priority, QC_PRIORITY)
+    return priority
+
+
+def candidate_ids(tasks: QuerySet, limit: int) -> list:
+    """
+    Ids of the highest priority and of the longest waiting ready tasks, so aged tasks are considered even when
+    more than limit tasks of a higher priority are queued.
+    """
+    ids = list(tasks.order_by("-priority", "enqueued_at").values_list("id", flat=True)[:limit])
+    ids += [i for i in tasks.order_by("enqueued_at").values_list("id", flat=True)[:limit] if i not in ids]
+    return ids
+
+
+def task_locations(task_results: list[DBTaskResult]) -> dict:
+    """
+    Folder watching location id of each task, from the config_id of its arguments.
+    """
+    config_ids = {t.args_kwargs.get("kwargs", {}).get("config_id") for t in task_results} - {None}
+    locations = dict(CatapultRunConfig.objects.filter(id__in=config_ids).values_list("id", "folder_watching_location_id"))
+    return {t.id: locations.get(t.args_kwargs.get("kwargs", {}).get("config_id")) for t in task_results}
+
+
+def running_per_location() -> dict:
+    return {
+        row["analysis__config__folder_watching_location"]: row["count"]
+        for row in CeleryTask.objects.filter(
+            status="RUNNING", analysis__config__folder_watching_location__isnull=False
+        ).values("analysis__config__folder_watching_location").annotate(count=Count("id"))
+    }
+
+
+def rank_tasks(task_results: list[DBTaskResult], now: datetime.datetime = None) -> list[tuple[float, DBTaskResult]]:
+    """
+    Order ready tasks by their effective priority: the enqueued priority, plus AGING_PER_MINUTE per minute waited,
+    minus FAIR_SHARE_PENALTY per task of the same folder watching location already running divided by the weight
+    of the location.
+    :return: (score, task) from the highest score
+    """
+    if not task_results:
+        return []
+    now = now or timezone.now()
+    locations = task_locations(task_results)
+    weights = dict(FolderWatchingLocation.objects.filter(
+        id__in=set(locations.values()) - {None}
+    ).values_list("id", "weight"))
+    running = running_per_location()
+    ranked = []
+    for task_result in task_results:
+        score = task_result.priority + AGING_PER_MINUTE * (now - task_result.enqueued_at).total_seconds() / 60
+        location = locations[task_result.id]
+        if location is not None:
+            score -= FAIR_SHARE_PENALTY * running.get(location, 0) / max(weights.get(location) or 1.0, 0.01)
+        ranked.append((score, task_result))
+    ranked.sort(key=lambda item: (-item[0], item[1].enqueued_at))
+    return ranked
+
+
+def queue_metrics(now: datetime.datetime = None) -> list[dict]:
+    """
+    Number of ready and running tasks with the waiting time of the ready tasks of each queue, and the ready tasks
+    per folder watching location.
+    """
+    now = now or timezone.now()
+    queues = {}
+    for queue_name, status, priority, enqueued_at, run_after, args_kwargs in DBTaskResult.objects.filter(
+            status__in=[ResultStatus.NEW, ResultStatus.RUNNING]).values_list(
+            "queue_name", "status", "priority", "enqueued_at", "run_after", "args_kwargs").iterator():
+        queue = queues.setdefault(queue_name, {"queue_name": queue_name, "ready": 0, "running": 0, "waits": [],
+                                               "priorities": {}, "config_ids": []})
+        if status == ResultStatus.RUNNING:
+            queue["running"] += 1
+        elif run_after is None or run_after <= now:
+            queue["ready"] += 1
+            queue["waits"].append((now - enqueued_at).total_seconds())
+            queue["priorities"][priority] = queue["priorities"].get(priority, 0) + 1
+            config_id = args_kwargs.get("kwargs", {}).get("config_id")
+            if config_id is not None:
+                queue["config_ids"].append(config_id)
+    metrics = []
+    for queue in queues.values():
+        waits = queue.pop("waits")
+        config_ids = queue.pop("config_ids")
+        locations = dict(CatapultRunConfig.objects.filter(id__in=set(config_ids)).values_list("id", "folder_watching_location_id"))
+        per_location = {}
+        for config_id in config_ids:
+            location = locations.get(config_id)
+            per_location[location] = per_location.get(location, 0) + 1
+        queue["max_wait_seconds"] = max(waits) if waits else 0.0
+        queue["mean_wait_seconds"] = statistics.mean(waits) if waits else 0.0
+        queue["median_wait_seconds"] = statistics.median(waits) if waits else 0.0
+        queue["ready_per_location"] = [{"folder_watching_location": k, "ready": v} for k, v in per_location.items()]
+        queue["priorities"] = [{"priority": k, "ready": v} for k, v in sorted(queue["priorities"].items(), reverse=True)]
+        metrics.append(queue)
+    return sorted(metrics, key=lambda q: q["queue_name"])
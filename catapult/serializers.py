@@ -1,7 +1,58 @@
+from django.db.models import prefetch_related_objects, Count, OuterRef, Subquery, IntegerField, QuerySet, Prefetch, F, Q, ExpressionWrapper, \
+    BooleanField
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 
 from catapult.models import Experiment, File, Analysis, FolderWatchingLocation, UserAPIKey, UploadedFile, CeleryTask, \
-    CeleryWorker, ResultSummary, LogRecord, PrecursorReportContent, ProteinGroupReportContent, CatapultRunConfig
+    CeleryWorker, ResultSummary, LogRecord, PrecursorReportContent, ProteinGroupReportContent, CatapultRunConfig, \
+    TaskResourceSample
+
+
+def get_expand(context: dict) -> set[str]:
+    """
+    Related objects to nest in the representation, from the comma separated ?expand= parameter of the request.
+    """
+    request = context.get("request", None)
+    if request is None:
+        return set(context.get("expand", []))
+    return {name.strip() for name in request.query_params.get("expand", "").split(",") if name.strip()}
+
+
+def annotate_ready(queryset: QuerySet) -> QuerySet:
+    """
+    Annotate analyses with is_ready, the readiness of Analysis.ready computed by the query instead of per row.
+    """
+    ready_files = File.objects.filter(
+        experiment_id=OuterRef("experiment_id"), ready_for_processing=True
+    ).order_by().values("experiment_id").annotate(count=Count("id")).values("count")
+    return queryset.annotate(
+        ready_file_count=Coalesce(Subquery(ready_files, output_field=IntegerField()), 0),
+    ).annotate(
+        is_ready=ExpressionWrapper(Q(ready_file_count=F("experiment__sample_count")), output_field=BooleanField()),
+    )
+
+
+class ExpandableSerializer(serializers.ModelSerializer):
+    """
+    Serializer of rows whose related objects are ids by default. The related objects named in ?expand= are nested
+    with the serializer given in expandable, as {field: (serializer class, attribute path)}.
+    setup_queryset loads what the representation needs with joins and prefetches instead of queries per row.
+    """
+    expandable: dict = {}
+
+    @classmethod
+    def setup_queryset(cls, queryset: QuerySet, expand: set[str]) -> QuerySet:
+        return queryset
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for field in get_expand(self.context) & self.expandable.keys():
+            serializer_class, source = self.expandable[field]
+            related = instance
+            for attribute in source.split("."):
+                related = getattr(related, attribute) if related is not None else None
+            data[field] = serializer_class(related).data if related is not None else None
+        return data
 
 
 class ExperimentSerializer(serializers.ModelSerializer):
@@ -20,6 +71,8 @@ class AnalysisSerializer(serializers.ModelSerializer):
     ready = serializers.SerializerMethodField()
 
     def get_ready(self, obj):
+        if hasattr(obj, "is_ready"):
+            return bool(obj.is_ready)
         return obj.ready()
 
     class Meta:
@@ -52,6 +105,12 @@ class CeleryTaskSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class TaskResourceSampleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TaskResourceSample
+        fields = ['timestamp', 'cpu_percent', 'rss', 'read_bytes', 'write_bytes', 'threads']
+
+
 class CeleryWorkerSerializer(serializers.ModelSerializer):
     current_tasks = serializers.SerializerMethodField()
 
@@ -60,48 +119,78 @@ class CeleryWorkerSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CeleryWorker
-        fields = ["id", "worker_hostname", "worker_os", "worker_status", "current_tasks", "worker_info"]
+        fields = ["id", "worker_hostname", "worker_os", "worker_status", "current_tasks", "worker_info", "heartbeat", "slots"]
 
 
-class ResultSummarySerializer(serializers.ModelSerializer):
-    analysis = serializers.SerializerMethodField()
-    file = serializers.SerializerMethodField()
+class ResultSummarySerializer(ExpandableSerializer):
+    expandable = {"analysis": (AnalysisSerializer, "analysis"), "file": (FileSerializer, "file")}
 
-    def get_analysis(self, obj: ResultSummary):
-        return AnalysisSerializer(obj.analysis).data
-
-    def get_file(self, obj: ResultSummary):
-        return FileSerializer(obj.file).data
+    @classmethod
+    def setup_queryset(cls, queryset: QuerySet, expand: set[str]) -> QuerySet:
+        if "analysis" in expand:
+            queryset = queryset.prefetch_related(Prefetch("analysis", queryset=annotate_ready(Analysis.objects.all())))
+        if "file" in expand:
+            queryset = queryset.select_related("file")
+        return queryset
 
     class Meta:
         model = ResultSummary
         fields = ['id', 'created_at', 'updated_at', 'analysis', 'file', 'protein_identified', 'precursor_identified', 'stats_file', 'log_file']
 
 class LogRecordSerializer(serializers.ModelSerializer):
+    # line number of the lines served from log chunks, None for LogRecord rows
+    line = serializers.SerializerMethodField()
+
+    def get_line(self, obj):
+        return getattr(obj, "line", None)
+
     class Meta:
         model = LogRecord
         fields = '__all__'
 
-class PrecursorReportContentSerializer(serializers.ModelSerializer):
-    analysis = serializers.SerializerMethodField()
-    file = serializers.SerializerMethodField()
-
-    def get_analysis(self, obj: PrecursorReportContent):
-        return AnalysisSerializer(obj.result_summary.analysis).data
+class PrecursorReportContentSerializer(ExpandableSerializer):
+    precursor_id = serializers.CharField(read_only=True)
+    gene_names = serializers.CharField(read_only=True, allow_null=True)
+    protein_group = serializers.CharField(read_only=True, allow_null=True)
+    expandable = {"analysis": (AnalysisSerializer, "analysis"), "file": (FileSerializer, "file")}
+
+    @classmethod
+    def setup_queryset(cls, queryset: QuerySet, expand: set[str]) -> QuerySet:
+        queryset = queryset.with_text()
+        if "analysis" in expand:
+            queryset = queryset.prefetch_related(Prefetch("analysis", queryset=annotate_ready(Analysis.objects.all())))
+        if "file" in expand:
+            queryset = queryset.select_related("file")
+        return queryset
+
+    @classmethod
+    def setup_instances(cls, instances: list, expand: set[str]) -> list:
+        """
+        Load the expanded relations of rows that do not come from a queryset, like the rows of the result store.
+        """
+        if "analysis" in expand:
+            prefetch_related_objects(instances, Prefetch("analysis", queryset=annotate_ready(Analysis.objects.all())))
+        if "file" in expand:
+            prefetch_related_objects(instances, "file")
+        return instances
 
-    def get_file(self, obj: PrecursorReportContent):
-        return FileSerializer(obj.file).data
     class Meta:
         model = PrecursorReportContent
         fields = ["id", "result_summary", "precursor_id", "gene_names", "protein_group", "proteotypic", "intensity", "analysis", "file"]
 
-class ProteinGroupReportContentSerializer(serializers.ModelSerializer):
-    analysis = serializers.SerializerMethodField()
-    file = serializers.SerializerMethodField()
-    def get_analysis(self, obj: ProteinGroupReportContent):
-        return AnalysisSerializer(obj.result_summary.analysis).data
-    def get_file(self, obj: ProteinGroupReportContent):
-        return FileSerializer(obj.file).data
+class ProteinGroupReportContentSerializer(ExpandableSerializer):
+    gene_names = serializers.CharField(read_only=True, allow_null=True)
+    protein_group = serializers.CharField(read_only=True)
+    expandable = {"analysis": (AnalysisSerializer, "analysis"), "file": (FileSerializer, "file")}
+
+    @classmethod
+    def setup_queryset(cls, queryset: QuerySet, expand: set[str]) -> QuerySet:
+        return PrecursorReportContentSerializer.setup_queryset(queryset, expand)
+
+    @classmethod
+    def setup_instances(cls, instances: list, expand: set[str]) -> list:
+        return PrecursorReportContentSerializer.setup_instances(instances, expand)
+
     class Meta:
         model = ProteinGroupReportContent
         fields = ["id", "result_summary", "protein_group", "gene_names", "intensity", "analysis", "file"]
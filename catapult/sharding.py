@@ -0,0 +1,124 @@
+import logging
+import os
+
+from django.db import transaction
+from django.db.models import F
+
+from catapult.models import Analysis, File
+
+logger = logging.getLogger("catapult.sharding")
+
+# name of the report written by a shard, next to the report of the analysis
+SHARD_REPORT = "report.shard-{shard}.tsv"
+
+
+def shard_size(content: dict | None) -> int | None:
+    """
+    Number of files per first pass job from the cat_shard_size entry of a run config, None when the first pass
+    is not sharded.
+    """
+    if not content:
+        return None
+    try:
+        size = int(content.get("cat_shard_size") or 0)
+    except (TypeError, ValueError):
+        return None
+    return size if size > 0 else None
+
+
+def can_shard(analysis: Analysis) -> bool:
+    """
+    Only searches against a spectral library are sharded, the quant files of every shard then refer to the same
+    library and can be combined by the final --use-quant run.
+    """
+    return analysis.analysis_type == "diann-spectral"
+
+
+def split_commands(commands: list[str], file_ids: dict[str, int], size: int) -> list[tuple[list[str], list[int]]] | None:
+    """
+    Split a DIA-NN first pass command into commands of at most size --f files each. The options are shared, the
+    --temp folder holding the quant files included, each shard writes its own report.
+    :param commands: the command built by Analysis.create_commands_from_config
+    :param file_ids: File id of each --f path
+    :return: (commands, file ids) of each shard, None if a --f path is not a known file
+    """
+    files = []
+    options = []
+    i = 0
+    while i < len(commands):
+        if commands[i] == "--f" and i + 1 < len(commands):
+            files.append(commands[i + 1])
+            i += 2
+        else:
+            options.append(commands[i])
+            i += 1
+    if any(path not in file_ids for path in files):
+        return None
+    shards = []
+    for start in range(0, len(files), size):
+        paths = files[start:start + size]
+        ids = [file_ids[path] for path in paths]
+        shard = options[:1]
+        for path in paths:
+            shard.extend(["--f", path])
+        shard.extend(options[1:])
+        if "--out" in shard:
+            index = shard.index("--out") + 1
+            shard[index] = os.path.join(os.path.dirname(shard[index]), SHARD_REPORT.format(shard=ids[0]))
+        shards.append((shard, ids))
+    return shards
+
+
+def shard_commands(analysis: Analysis, commands: list[str], final: bool = False) -> list[tuple[list[str], list[int] | None]]:
+    """
+    Jobs to dispatch for the commands of an analysis. The final run over every file reuses the quant files of the
+    shards, a first pass with more files than the shard size of the config is split into shards. Anything else
+    is a single job.
+    :param final: the commands are the final run over every file of the analysis
+    :return: (commands, file ids of the shard or None) of each job
+    """
+    size = shard_size(analysis.config.content if analysis.config else None)
+    if size is None or not can_shard(analysis):
+        return [(commands, None)]
+    if final:
+        if "--use-quant" not in commands:
+            commands = commands + ["--use-quant"]
+        return [(commands, None)]
+    files = list(analysis.generating_quant.all())
+    if len(files) <= size:
+        return [(commands, None)]
+    file_ids = {f.get_path(): f.id for f in files}
+    shards = split_commands(commands, file_ids, size)
+    if shards is None:
+        return [(commands, None)]
+    return shards
+
+
+def finish_shard(analysis_id: int, file_ids: list[int], succeeded: bool) -> bool:
+    """
+    Record the end of a shard. The files of a successful shard move to generated_quant, the files of a failed
+    shard are released to be dispatched again until they failed File.MAX_QUANT_FAILURES shards, the final run then
+    leaves them out. The analysis stops processing once no shard is left.
+    :return: True if this was the last running shard of the analysis
+    """
+    with transaction.atomic():
+        analysis = Analysis.objects.select_for_update().get(id=analysis_id)
+        files = list(File.objects.filter(id__in=file_ids))
+        analysis.generating_quant.remove(*files)
+        if succeeded:
+            analysis.generated_quant.add(*files)
+        else:
+            File.objects.filter(id__in=file_ids).update(processing=False, quant_failures=F("quant_failures") + 1)
+            exhausted = list(File.objects.filter(
+                id__in=file_ids, quant_failures__gte=File.MAX_QUANT_FAILURES
+            ).values_list("file_path", flat=True))
+            if exhausted:
+                logger.error(
+                    f"{len(exhausted)} files of analysis {analysis_id} failed {File.MAX_QUANT_FAILURES} shards and are "
+                    f"left out of the analysis: {', '.join(exhausted)}"
+                )
+        last = not analysis.generating_quant.exists()
+        if last:
+            analysis.processing = False
+            analysis.save(update_fields=["processing"])
+    return last
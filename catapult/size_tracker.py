@@ -0,0 +1,110 @@
+import datetime
+import logging
+import os
+import threading
+
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from catapult.models import File
+
+logger = logging.getLogger("catapult.size_tracker")
+
+
+class AcquisitionSizeTracker:
+    """
+    In-memory sizes of the files inside Bruker .d acquisition folders. A folder is walked once the first time it
+    is seen, afterwards only the children touched by file system events are stat'ed again and the total of the
+    folder is updated with the difference.
+    """
+
+    def __init__(self):
+        self.children: dict[str, dict[str, int]] = {}
+        self.totals: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def load(self, acquisition_path: str) -> int:
+        """
+        Walk an acquisition folder and record the size of every file below it.
+        :return: the total size of the folder
+        """
+        sizes = {}
+        pending = [acquisition_path]
+        while pending:
+            try:
+                iterator = os.scandir(pending.pop())
+            except OSError:
+                continue
+            with iterator as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            sizes[entry.path] = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        total = sum(sizes.values())
+        with self.lock:
+            self.children[acquisition_path] = sizes
+            self.totals[acquisition_path] = total
+        return total
+
+    def update(self, acquisition_path: str, child_paths) -> int:
+        """
+        Stat the given children of an acquisition folder again and apply the size differences to its total.
+        Children that no longer exist are removed, directories are walked as new subtrees.
+        :return: the total size of the folder
+        """
+        if acquisition_path not in self.children:
+            return self.load(acquisition_path)
+        updates = {}
+        for child_path in child_paths:
+            if child_path == acquisition_path:
+                continue
+            try:
+                if os.path.isdir(child_path):
+                    # a directory created or moved in, walk it once
+                    for root, _, filenames in os.walk(child_path):
+                        for filename in filenames:
+                            path = os.path.join(root, filename)
+                            updates[path] = os.path.getsize(path)
+                else:
+                    updates[child_path] = os.path.getsize(child_path)
+            except OSError:
+                updates[child_path] = None
+        with self.lock:
+            sizes = self.children[acquisition_path]
+            total = self.totals[acquisition_path]
+            for path, size in updates.items():
+                if size is None:
+                    prefix = path + os.sep
+                    removed = [p for p in sizes if p == path or p.startswith(prefix)]
+                    for p in removed:
+                        total -= sizes.pop(p)
+                else:
+                    total += size - sizes.get(path, 0)
+                    sizes[path] = size
+            self.totals[acquisition_path] = total
+        return total
+
+    def forget(self, acquisition_path: str):
+        with self.lock:
+            self.children.pop(acquisition_path, None)
+            self.totals.pop(acquisition_path, None)
+
+    def size(self, acquisition_path: str) -> int | None:
+        return self.totals.get(acquisition_path)
+
+
+def stable_files(files: QuerySet, threshold: int) -> QuerySet:
+    """
+    Filter files whose size, as reported by the sentinel, has not changed for at least threshold seconds.
+    Files without a recorded size change are excluded and have to be checked on disk.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=threshold)
+    return files.filter(size_changed_at__isnull=False, size_changed_at__lt=cutoff)
+
+
+def acquisition_folder_filter() -> Q:
+    return Q(experiment__vendor=".d") | Q(file_path__endswith=".d")
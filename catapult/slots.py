@@ -0,0 +1,127 @@
+import logging
+
+import psutil
+from django.db.models import Max
+from django_tasks.backends.database.models import DBTaskResult
+
+from catapult.models import Analysis, CatapultRunConfig, File
+
+logger = logging.getLogger("catapult.slots")
+
+# memory reserved for a task regardless of its input files
+BASE_TASK_MEMORY = 2 * 1024 ** 3
+# memory reserved per byte of the largest input file, DIA-NN processes one run at a time
+MEMORY_PER_INPUT_BYTE = 2
+
+
+class TaskCost:
+    """
+    Cpu cores and bytes of memory a task is expected to use while it runs
+    """
+
+    def __init__(self, cpu: int = 1, memory: int = BASE_TASK_MEMORY):
+        self.cpu = cpu
+        self.memory = memory
+
+    def clamp(self, capacity: "WorkerCapacity") -> "TaskCost":
+        """
+        Limit the cost to the capacity of the worker, so a task larger than the worker still runs on its own.
+        """
+        return TaskCost(min(self.cpu, capacity.cpu), min(self.memory, capacity.memory))
+
+    def to_dict(self) -> dict:
+        return {"cpu": self.cpu, "memory": self.memory}
+
+    def __repr__(self):
+        return f"TaskCost(cpu={self.cpu}, memory={self.memory})"
+
+
+class WorkerCapacity:
+    """
+    Cpu cores, memory and slots of a worker with the part reserved by running tasks
+    """
+
+    def __init__(self, slots: int = 1, cpu: int = None, memory: int = None):
+        self.slots = slots
+        self.cpu = cpu or psutil.cpu_count(logical=True) or 1
+        self.memory = memory or psutil.virtual_memory().total
+        self.used_cpu = 0
+        self.used_memory = 0
+        self.running: dict[int, TaskCost] = {}
+
+    @property
+    def free_cpu(self) -> int:
+        return self.cpu - self.used_cpu
+
+    @property
+    def free_memory(self) -> int:
+        return self.memory - self.used_memory
+
+    def free_slot(self) -> int | None:
+        for slot in range(self.slots):
+            if slot not in self.running:
+                return slot
+        return None
+
+    def fits(self, cost: TaskCost) -> bool:
+        if self.free_slot() is None:
+            return False
+        if not self.running:
+            return True
+        return cost.cpu <= self.free_cpu and cost.memory <= self.free_memory
+
+    def reserve(self, cost: TaskCost) -> int:
+        slot = self.free_slot()
+        self.running[slot] = cost
+        self.used_cpu += cost.cpu
+        self.used_memory += cost.memory
+        return slot
+
+    def release(self, slot: int):
+        cost = self.running.pop(slot)
+        self.used_cpu -= cost.cpu
+        self.used_memory -= cost.memory
+
+    def to_dict(self) -> dict:
+        return {
+            "slots": self.slots,
+            "cpu": self.cpu,
+            "memory": self.memory,
+            "free_slots": self.slots - len(self.running),
+            "free_cpu": self.free_cpu,
+            "free_memory": self.free_memory,
+        }
+
+
+def config_threads(content: dict | None) -> int | None:
+    if not content:
+        return None
+    try:
+        threads = int(content.get("threads") or 0)
+    except (TypeError, ValueError):
+        return None
+    return threads if threads > 0 else None
+
+
+def task_cost(task_result: DBTaskResult, default_cpu: int = 1) -> TaskCost:
+    """
+    Derive the cost of a queued task from the threads of its run config and the size of its largest input file.
+    Tasks without a config or an analysis cost default_cpu cores and the base memory.
+    """
+    kwargs = task_result.args_kwargs.get("kwargs", {})
+    args = task_result.args_kwargs.get("args", [])
+    config_id = kwargs.get("config_id")
+    analysis_id = kwargs.get("analysis_id", args[0] if args and isinstance(args[0], int) else None)
+    content = None
+    if config_id is not None:
+        content = CatapultRunConfig.objects.filter(id=config_id).values_list("content", flat=True).first()
+    elif analysis_id is not None:
+        content = Analysis.objects.filter(id=analysis_id).values_list("config__content", flat=True).first()
+    cpu = config_threads(content) or default_cpu
+    memory = BASE_TASK_MEMORY
+    if analysis_id is not None:
+        experiment_id = Analysis.objects.filter(id=analysis_id).values_list("experiment_id", flat=True).first()
+        if experiment_id is not None:
+            largest = File.objects.filter(experiment_id=experiment_id).aggregate(size=Max("size"))["size"] or 0
+            memory += largest * MEMORY_PER_INPUT_BYTE
+    return TaskCost(cpu, memory)
@@ -12,7 +12,14 @@ from typing_extensions import Self
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
-from catapult.models import Analysis, CeleryTask, CeleryWorker, CatapultRunConfig, LogRecord
+from catapult.logsink import LogSink
+from catapult.process import ProcessRunner, ProcessResult
+from catapult.telemetry import ResourceSampler
+from catapult.progress import DiannProgressParser, historical_file_seconds
+from catapult.placement import analysis_input_bytes, observe_runtime
+from catapult.sharding import finish_shard
+from catapult.models import Analysis, CeleryTask, CeleryWorker, CatapultRunConfig
+from catapult.notify import notify, EXPERIMENT_CHANNEL
 
 from celery import shared_task, Task
 from django_tasks import Task as DjangoTask, BaseTaskBackend
@@ -398,8 +405,24 @@ def calculate_meaning_of_life(task_id: str = "", worker_hostname: str = "") -> i
     print(worker_hostname)
     return 42
 
+def record_process_result(task: CeleryTask, result: ProcessResult):
+    task.exit_code = result.returncode
+    task.resource_usage = {"elapsed": result.elapsed, **(result.resource_usage or {})}
+    task.save(update_fields=["exit_code", "resource_usage"])
+
+
+def progress_parser(task: CeleryTask, analysis: Analysis, commands: list[str]) -> DiannProgressParser:
+    total_files = commands.count("--f") or analysis.total_files
+    return DiannProgressParser(task, total_files=total_files, file_seconds=historical_file_seconds(analysis.analysis_type))
+
+
 @native_task()
-def run_diann_worker(commands: list[str], task_id: str = "", worker_hostname: str = "", analysis_id: int = None, config_id: int = None):
+def run_diann_worker(commands: list[str], task_id: str = "", worker_hostname: str = "", analysis_id: int = None, config_id: int = None,
+                     files: list[int] = None):
+    """
+    Run DIA-NN for an analysis on a native worker. With files the run is one shard of a sharded first pass over
+    these files, its results are the quant files, the report of the analysis comes from the final run.
+    """
     cWorker = CeleryWorker.objects.get(worker_hostname=worker_hostname)
     logging_path = cWorker.worker_params["options"]["logfile"]
     logger = logging.getLogger(f"catapult.worker{logging_path}")
@@ -427,31 +450,31 @@ def run_diann_worker(commands: list[str], task_id: str = "", worker_hostname: st
     task.analysis_params = json.dumps(commands)
     task.save()
     try:
-        process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         analysis.commands = subprocess.list2cmdline(commands)
         analysis.output_folder = os.path.join(str(parent_folder.replace(config.folder_watching_location.folder_path, "")), config.content["prefix"])
+        if files is None:
+            analysis.start_time = timezone.now()
         analysis.save()
-        for line in process.stdout:
-            print(line)
-            output_line = line.decode("utf-8").strip()
-            if output_line:
-                LogRecord.objects.create(
-                    task=task,
-                    log=output_line.strip()
-                )
-                async_to_sync(channel_layer.group_send)(
-                    "analysis_log", {
-                        "type": "log_message",
-                        "message": {
-                            "task_id": task_id,
-                            "log": output_line,
-                            "hostname": worker_hostname,
-                            "timestamp": f"{datetime.now().timestamp()}",
-                        },
-                    }
-                )
-
-        if analysis.generating_quant.all().count() == analysis.total_files:
+        input_bytes = analysis_input_bytes(analysis.id, files)
+        runner = ProcessRunner(commands, sinks=[
+            LogSink(task, task_id=task_id, hostname=worker_hostname),
+            progress_parser(task, analysis, commands),
+        ])
+        ResourceSampler(task).attach(runner)
+        result = runner.run()
+        record_process_result(task, result)
+        if result.returncode == 0:
+            observe_runtime(cWorker, config.content.get("engine") or "DIA-NN", input_bytes, result.elapsed,
+                            config.folder_watching_location)
+        if files is not None:
+            finish_shard(analysis.id, files, succeeded=result.returncode == 0)
+            task.status = "SUCCESS" if result.returncode == 0 else "FAILED"
+            task.save()
+            cWorker.tasks.remove(task)
+            notify(EXPERIMENT_CHANNEL, [analysis.experiment_id])
+            return analysis_id
+
+        if analysis.generating_quant.all().count() == analysis.quant_total_files():
             analysis.completed = True
             analysis.save()
         for file in analysis.generating_quant.all():
@@ -468,6 +491,8 @@ def run_diann_worker(commands: list[str], task_id: str = "", worker_hostname: st
     except Exception as e:
         task.status = "FAILED"
         task.save()
+        if files is not None:
+            finish_shard(analysis.id, files, succeeded=False)
         raise e
     report_stats_file = os.path.join(parent_folder, config.content["prefix"],
                                      "report.stats.tsv")
@@ -475,6 +500,7 @@ def run_diann_worker(commands: list[str], task_id: str = "", worker_hostname: st
     analysis.processing = False
     analysis.stop_time = timezone.now()
     analysis.save(update_fields=["processing", "stop_time"])
+    notify(EXPERIMENT_CHANNEL, [analysis.experiment_id])
     return analysis_id
 
 
@@ -504,21 +530,19 @@ def run_diann(commands: list[str], task_id: str = "", worker_hostname: str = "",
     task.analysis_params = json.dumps(commands)
     task.save()
     try:
-        process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         analysis.commands = subprocess.list2cmdline(commands)
         analysis.output_folder = os.path.join(parent_folder, config.content["prefix"])
+        analysis.start_time = timezone.now()
         analysis.save()
-        for line in process.stdout:
-            line = line.decode("utf-8").strip()
-            if line:
-                LogRecord.objects.create(
-                    task=task,
-                    log=line
-                )
+        result = ProcessRunner(commands, sinks=[
+            LogSink(task, task_id=task_id, hostname=worker_hostname, group=None),
+            progress_parser(task, analysis, commands),
+        ]).run()
+        record_process_result(task, result)
 
         analysis.processing = False
         analysis.save(update_fields=["processing"])
-        if analysis.generating_quant.all().count() == analysis.total_files:
+        if analysis.generating_quant.all().count() == analysis.quant_total_files():
             analysis.completed = True
             analysis.save()
 
@@ -545,6 +569,7 @@ def run_diann(commands: list[str], task_id: str = "", worker_hostname: str = "",
     analysis.processing = False
     analysis.stop_time = timezone.now()
     analysis.save(update_fields=["processing", "stop_time"])
+    notify(EXPERIMENT_CHANNEL, [analysis.experiment_id])
     return analysis_id
 
 
@@ -0,0 +1,141 @@
+import logging
+import subprocess
+import threading
+
+import psutil
+from django.db import close_old_connections
+from django.utils import timezone
+
+from catapult.models import CeleryTask, TaskResourceSample
+from catapult.process import ProcessSink, ProcessRunner, ProcessResult, STDOUT
+
+logger = logging.getLogger("catapult.telemetry")
+
+# seconds between two samples
+RESOURCE_SAMPLE_INTERVAL = 5.0
+# number of samples buffered before they are written
+RESOURCE_SAMPLE_BATCH = 12
+
+
+class ResourceSampler(ProcessSink):
+    """
+    Sample the cpu, memory, io and thread usage of a process and its children at a fixed interval into
+    TaskResourceSample rows. Attached to a ProcessRunner, sampling starts with the process and stops once
+    it exited, samples are written in batches.
+    """
+
+    def __init__(self, task: CeleryTask, interval: float = RESOURCE_SAMPLE_INTERVAL, batch_size: int = RESOURCE_SAMPLE_BATCH):
+        self.task = task
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+        self.thread = None
+        self.samples: list[TaskResourceSample] = []
+        self.sample_count = 0
+
+    def attach(self, runner: ProcessRunner) -> "ResourceSampler":
+        runner.add_sink(self)
+        runner.on_start.append(self.start)
+        return self
+
+    def start(self, process: subprocess.Popen):
+        try:
+            root = psutil.Process(process.pid)
+        except psutil.Error:
+            return
+        self.thread = threading.Thread(target=self.run, args=(root,), name=f"sampler-{self.task.task_id}", daemon=True)
+        self.thread.start()
+
+    def write(self, line: str, stream: str = STDOUT):
+        pass
+
+    def close(self, result: ProcessResult = None):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def processes(self, root: psutil.Process) -> list[psutil.Process]:
+        try:
+            return [root] + root.children(recursive=True)
+        except psutil.Error:
+            return [root]
+
+    def sample(self, root: psutil.Process, known: dict[int, psutil.Process]) -> TaskResourceSample | None:
+        cpu_percent = 0.0
+        rss = 0
+        read_bytes = None
+        write_bytes = None
+        threads = 0
+        alive = False
+        for process in self.processes(root):
+            # reuse Process objects so cpu_percent measures the time since the previous sample
+            process = known.setdefault(process.pid, process)
+            try:
+                with process.oneshot():
+                    cpu_percent += process.cpu_percent(None)
+                    rss += process.memory_info().rss
+                    threads += process.num_threads()
+                    if hasattr(process, "io_counters"):
+                        io = process.io_counters()
+                        read_bytes = (read_bytes or 0) + io.read_bytes
+                        write_bytes = (write_bytes or 0) + io.write_bytes
+                alive = True
+            except psutil.Error:
+                continue
+        if not alive:
+            return None
+        return TaskResourceSample(
+            task=self.task,
+            timestamp=timezone.now(),
+            cpu_percent=cpu_percent,
+            rss=rss,
+            read_bytes=read_bytes,
+            write_bytes=write_bytes,
+            threads=threads,
+        )
+
+    def run(self, root: psutil.Process):
+        known = {}
+        try:
+            # the first cpu_percent call of a process only sets its reference point
+            self.sample(root, known)
+            while not self.stopped.wait(self.interval):
+                sample = self.sample(root, known)
+                if sample is None:
+                    break
+                self.samples.append(sample)
+                if len(self.samples) >= self.batch_size:
+                    self.flush()
+            self.flush()
+        except Exception as e:
+            logger.exception(f"resource sampling of task {self.task.task_id} failed: {e}")
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        if self.samples:
+            TaskResourceSample.objects.bulk_create(self.samples)
+            self.sample_count += len(self.samples)
+            self.samples = []
+
+
+def summarize_samples(samples) -> dict:
+    """
+    Peak and mean usage of a task, to tell whether a run was cpu, memory or io bound.
+    """
+    samples = list(samples)
+    if not samples:
+        return {}
+    elapsed = (samples[-1].timestamp - samples[0].timestamp).total_seconds()
+    summary = {
+        "samples": len(samples),
+        "mean_cpu_percent": sum(s.cpu_percent for s in samples) / len(samples),
+        "max_cpu_percent": max(s.cpu_percent for s in samples),
+        "max_rss": max(s.rss for s in samples),
+        "max_threads": max(s.threads for s in samples),
+    }
+    if samples[-1].read_bytes is not None and samples[0].read_bytes is not None and elapsed > 0:
+        summary["read_bytes_per_second"] = (samples[-1].read_bytes - samples[0].read_bytes) / elapsed
+        summary["write_bytes_per_second"] = (samples[-1].write_bytes - samples[0].write_bytes) / elapsed
+    return summary
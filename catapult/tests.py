@@ -1,7 +1,23 @@
+import datetime
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
 
+import pandas as pd
 from celery.result import AsyncResult
-from django.test import TestCase
+from unittest import skipIf
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
 
 # Create your tests here.
 from celery.exceptions import Retry
@@ -9,7 +25,28 @@ from glob import glob
 from unittest.mock import patch, Mock
 
 from catapult.tasks import run_analysis, run_quant
-from catapult.models import Experiment, FolderWatchingLocation, Analysis, File
+from catapult.models import Experiment, FolderWatchingLocation, Analysis, File, CatapultRunConfig, ResultSummary, \
+    PrecursorReportContent, ProteinGroupReportContent, DirectoryScanState, FastaFile, CeleryTask, LogRecord, LogChunk, \
+    TaskResourceSample, CeleryWorker, GeneGroup, Precursor
+from catapult.partitions import drop_partitions, ensure_partitions, partition_name, partitions
+from catapult.result_store import PROTEIN_GROUP_TABLE, ResultStore, pa
+from catapult.logsink import LogSink
+from catapult.process import ProcessRunner, CallbackSink, FileSink
+from catapult.logstore import LogLines, append_chunk, tail
+from catapult.telemetry import ResourceSampler
+from catapult.progress import DiannProgressParser, historical_file_seconds
+from catapult.slots import TaskCost, WorkerCapacity, task_cost
+from catapult.notify import TASK_CHANNEL
+from catapult.scheduling import config_priority, rank_tasks, candidate_ids, queue_metrics
+from catapult.placement import PlacementEngine, TaskProfile, observe_runtime, parse_memory, GB
+from catapult.sharding import shard_commands, finish_shard
+from catapult.management.commands.worker_native import CatapultWorker
+from django_tasks.backends.database.models import DBTaskResult
+from catapult.readiness import ReadinessScheduler, annotate_readiness, check_input_files, update_input_flags
+from catapult.events import EventCoalescer, CREATED, MODIFIED, DELETED
+from catapult.size_tracker import AcquisitionSizeTracker, stable_files
+from catapult.scanner import scan_tree, sync_files, get_extensions, load_scan_cache, save_scan_cache
+from catapult.util import add_stats_and_report
 from django.test.utils import override_settings
 
 
@@ -36,3 +73,838 @@ class TestRunAnalysis(TestCase):
             spectral_library=r"D:\watch_folder\MRC-Astral\20230102_UniprotSwissProt_Human_Cano+Iso - Ox+Ac.predicted.speclib",
             fasta_file=r"D:\watch_folder\MRC-Astral\20230102_UniprotSwissProt_Human_Cano+Iso.fasta")
         task = run_analysis.delay(analysis.id)
+
+
+class ReportTestCase(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = FolderWatchingLocation.objects.create(folder_path=self.folder)
+        self.experiment = Experiment.objects.create(experiment_name=os.path.join(self.folder, "experiment"))
+        self.runs = [os.path.join(self.folder, "experiment", f"run{i}.raw") for i in range(3)]
+        self.files = [
+            File.objects.create(
+                file_path=run.replace(self.folder, ""),
+                folder_watching_location=self.location,
+                experiment=self.experiment,
+                size=1
+            ) for run in self.runs
+        ]
+        self.config = CatapultRunConfig.objects.create(
+            experiment=self.experiment,
+            folder_watching_location=self.location,
+            config_file_path=os.path.join(self.folder, "experiment", "config.yml"),
+            content={"prefix": "output"}
+        )
+        self.analysis = Analysis.objects.create(
+            experiment=self.experiment,
+            analysis_path=self.config.config_file_path,
+            analysis_type="diann-spectral",
+            config=self.config
+        )
+        output = os.path.join(self.folder, "experiment", "output")
+        os.makedirs(output)
+        pd.DataFrame({
+            "File.Name": self.runs,
+            "Precursors.Identified": [2, 1, 2],
+            "Proteins.Identified": [2, 1, 1],
+        }).to_csv(os.path.join(output, "report.stats.tsv"), sep="\t", index=False)
+        pd.DataFrame({
+            "Protein.Group": ["P1", "P2"],
+            "Genes": ["G1", None],
+            "Precursor.Id": ["AAK2", "CCK2"],
+            "Proteotypic": [1, 0],
+            self.runs[0]: [1.0, 2.0],
+            self.runs[1]: [3.0, None],
+            self.runs[2]: [4.0, 5.0],
+        }).to_csv(os.path.join(output, "report.pr_matrix.tsv"), sep="\t", index=False)
+        pd.DataFrame({
+            "Protein.Group": ["P1", "P2"],
+            "Genes": ["G1", None],
+            self.runs[0]: [1.0, 2.0],
+            self.runs[1]: [3.0, None],
+            self.runs[2]: [4.0, None],
+        }).to_csv(os.path.join(output, "report.pg_matrix.tsv"), sep="\t", index=False)
+        self.stats_file = os.path.join(output, "report.stats.tsv")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+class TestReportIngestion(ReportTestCase):
+
+    def test_add_stats_and_report(self):
+        result = add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        self.assertEqual(result["rows"], 9)
+        self.assertEqual(ResultSummary.objects.filter(analysis=self.analysis).count(), 3)
+        self.assertEqual(PrecursorReportContent.objects.count(), 5)
+        self.assertEqual(ProteinGroupReportContent.objects.count(), 4)
+        precursor = PrecursorReportContent.objects.with_text().get(file=self.files[1])
+        self.assertEqual(precursor.precursor_id, "AAK2")
+        self.assertTrue(precursor.proteotypic)
+        self.assertEqual(precursor.intensity, 3.0)
+        self.assertIsNone(PrecursorReportContent.objects.with_text().get(file=self.files[2], precursor_id="CCK2").gene_names)
+        self.assertEqual(Precursor.objects.count(), 2)
+        self.assertEqual(GeneGroup.objects.count(), 1)
+
+        result = add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        self.assertTrue(result["skipped"])
+        self.assertEqual(ResultSummary.objects.filter(analysis=self.analysis).count(), 3)
+        self.assertEqual(PrecursorReportContent.objects.count(), 5)
+
+    def test_reimport_only_changed_runs(self):
+        parent_folder = os.path.dirname(self.config.config_file_path)
+        add_stats_and_report(self.analysis, self.config, parent_folder, self.stats_file)
+        unchanged_ids = set(PrecursorReportContent.objects.filter(file=self.files[0]).values_list("id", flat=True))
+        matrix_path = os.path.join(os.path.dirname(self.stats_file), "report.pr_matrix.tsv")
+        matrix = pd.read_csv(matrix_path, sep="\t")
+        matrix[self.runs[1]] = [6.0, 7.0]
+        matrix.to_csv(matrix_path, sep="\t", index=False)
+
+        result = add_stats_and_report(self.analysis, self.config, parent_folder, self.stats_file)
+        self.assertFalse(result["skipped"])
+        self.assertEqual(result["runs"], 1)
+        self.assertEqual(set(PrecursorReportContent.objects.filter(file=self.files[0]).values_list("id", flat=True)), unchanged_ids)
+        self.assertEqual(PrecursorReportContent.objects.filter(file=self.files[1]).count(), 2)
+        self.assertEqual(PrecursorReportContent.objects.count(), 6)
+
+
+@skipIf(pa is None, "pyarrow is not installed")
+class TestParquetResultStore(ReportTestCase):
+
+    def test_list_from_result_store(self):
+        store_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_folder)
+        with override_settings(PARQUET_RESULT_STORE=store_folder, STORE_REPORT_CONTENT_IN_DB=False):
+            add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+            self.assertEqual(PrecursorReportContent.objects.count(), 0)
+            client = APIClient()
+            response = client.get("/api/precursor/", {"analysis": self.analysis.id, "min_intensity": 3, "ordering": "-intensity"})
+            self.assertEqual(response.data["count"], 3)
+            self.assertEqual([r["intensity"] for r in response.data["results"]], [5.0, 4.0, 3.0])
+            response = client.get("/api/precursor/", {"analysis": self.analysis.id, "ordering": "-intensity", "limit": 2, "offset": 1})
+            self.assertEqual([r["intensity"] for r in response.data["results"]], [4.0, 3.0])
+            row = response.data["results"][0]
+            self.assertEqual(list(row.keys()), ["id", "result_summary", "precursor_id", "gene_names", "protein_group",
+                                                "proteotypic", "intensity", "analysis", "file"])
+            self.assertIsNone(row["id"])
+            self.assertEqual(row["analysis"], self.analysis.id)
+            response = client.get("/api/proteingroup/", {"gene_names": "g1", "file": self.files[2].id, "expand": "file"})
+            self.assertEqual(response.data["count"], 1)
+            self.assertEqual(response.data["results"][0]["file"]["id"], self.files[2].id)
+
+    def test_empty_text_column(self):
+        store = ResultStore(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, store.root)
+        rows = pd.DataFrame({"result_summary_id": [1], "file_id": [1], "gene_names": ["G1"], "protein_group": ["P1"], "intensity": [1.0]})
+        store.write_rows(PROTEIN_GROUP_TABLE, 9, rows)
+        # analysis_id=10 comes first in path order, its gene names are all missing
+        store.write_rows(PROTEIN_GROUP_TABLE, 10, rows.assign(file_id=2, gene_names=[None]))
+        query = store.query(PROTEIN_GROUP_TABLE, {"gene_names": "g1"}, ordering="intensity")
+        self.assertEqual(query.count(), 1)
+        self.assertEqual(query[0:5][0]["analysis_id"], 9)
+
+
+class TestFolderScanner(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = FolderWatchingLocation.objects.create(folder_path=self.folder)
+        experiment = os.path.join(self.folder, "experiment")
+        os.makedirs(os.path.join(experiment, "run2.d", "sub"))
+        with open(os.path.join(experiment, "run1.raw"), "wb") as f:
+            f.write(b"0" * 10)
+        with open(os.path.join(experiment, "run1_DONOTPROCESS.raw"), "wb") as f:
+            f.write(b"0" * 10)
+        with open(os.path.join(experiment, "run2.d", "analysis.tdf"), "wb") as f:
+            f.write(b"0" * 5)
+        with open(os.path.join(experiment, "run2.d", "sub", "analysis.tdf_bin"), "wb") as f:
+            f.write(b"0" * 7)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_scan_and_sync(self):
+        result = scan_tree(self.folder, get_extensions(self.location), self.location.ignore_term, max_workers=2)
+        sizes = {os.path.basename(a.path): a.size for a in result.acquisitions}
+        self.assertEqual(sizes, {"run1.raw": 10, "run2.d": 12})
+
+        self.assertEqual(sync_files(self.location, result.acquisitions), {"created": 2, "updated": 0, "deleted": 0, "refused": 0})
+        self.assertEqual(File.objects.filter(experiment__experiment_name=os.path.join(self.folder, "experiment")).count(), 2)
+
+        with open(os.path.join(self.folder, "experiment", "run1.raw"), "ab") as f:
+            f.write(b"0")
+        result = scan_tree(self.folder, get_extensions(self.location), self.location.ignore_term)
+        self.assertEqual(sync_files(self.location, result.acquisitions), {"created": 0, "updated": 1, "deleted": 0, "refused": 0})
+        self.assertEqual(File.objects.get(file_path=os.path.join("/experiment", "run1.raw")).size, 11)
+
+    def test_scan_state_cache(self):
+        extensions = get_extensions(self.location)
+        result = scan_tree(self.folder, extensions, self.location.ignore_term, cache=load_scan_cache(self.location))
+        sync_files(self.location, result.changed_acquisitions, removed=result.removed_acquisitions)
+        save_scan_cache(self.location, result)
+        self.assertEqual(DirectoryScanState.objects.filter(folder_watching_location=self.location).count(), 2)
+
+        result = scan_tree(self.folder, extensions, self.location.ignore_term, cache=load_scan_cache(self.location))
+        self.assertEqual(result.cached_directories, 2)
+        self.assertEqual(result.changed_acquisitions, [])
+        self.assertEqual(len(result.acquisitions), 2)
+
+        experiment = os.path.join(self.folder, "experiment")
+        os.remove(os.path.join(experiment, "run1.raw"))
+        with open(os.path.join(experiment, "run3.raw"), "wb") as f:
+            f.write(b"0" * 3)
+        # make sure the modification time of the directory changes on file systems with a coarse resolution
+        modified_time = os.stat(experiment).st_mtime + 1
+        os.utime(experiment, (modified_time, modified_time))
+        result = scan_tree(self.folder, extensions, self.location.ignore_term, cache=load_scan_cache(self.location))
+        self.assertEqual(result.cached_directories, 1)
+        self.assertEqual(result.removed_acquisitions, [os.path.join(experiment, "run1.raw")])
+        counts = sync_files(self.location, result.changed_acquisitions, removed=result.removed_acquisitions)
+        self.assertEqual(counts, {"created": 1, "updated": 0, "deleted": 1, "refused": 0})
+        save_scan_cache(self.location, result)
+        self.assertEqual(
+            sorted(File.objects.filter(folder_watching_location=self.location).values_list("file_path", flat=True)),
+            [os.path.join("/experiment", "run2.d"), os.path.join("/experiment", "run3.raw")]
+        )
+
+    def test_unmounted_location(self):
+        extensions = get_extensions(self.location)
+        result = scan_tree(self.folder, extensions, self.location.ignore_term, cache=load_scan_cache(self.location))
+        sync_files(self.location, result.changed_acquisitions, removed=result.removed_acquisitions)
+        save_scan_cache(self.location, result)
+
+        # an unmounted share leaves an empty mount point
+        shutil.rmtree(os.path.join(self.folder, "experiment"))
+        result = scan_tree(self.folder, extensions, self.location.ignore_term, cache=load_scan_cache(self.location))
+        self.assertTrue(result.unavailable)
+        self.assertEqual(result.removed_acquisitions, [])
+        save_scan_cache(self.location, result)
+        self.assertEqual(DirectoryScanState.objects.filter(folder_watching_location=self.location).count(), 2)
+
+        experiment = os.path.join(self.folder, "experiment")
+        removed = [os.path.join(experiment, f"run{i}.raw") for i in range(10, 40)]
+        experiment_id = File.objects.filter(folder_watching_location=self.location).first().experiment_id
+        File.objects.bulk_create([
+            File(file_path=path.replace(self.folder, ""), folder_watching_location=self.location, size=1,
+                 experiment_id=experiment_id) for path in removed
+        ])
+        counts = sync_files(self.location, [], removed=removed)
+        self.assertEqual(counts, {"created": 0, "updated": 0, "deleted": 0, "refused": 30})
+        self.assertEqual(File.objects.filter(folder_watching_location=self.location).count(), 32)
+        counts = sync_files(self.location, [], removed=removed, max_delete_fraction=1)
+        self.assertEqual(counts["deleted"], 30)
+
+
+class TestEventCoalescer(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = FolderWatchingLocation.objects.create(folder_path=self.folder)
+        self.experiment = os.path.join(self.folder, "experiment")
+        os.makedirs(os.path.join(self.experiment, "run2.d"))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_coalesce_events(self):
+        events = EventCoalescer(self.location, window=0)
+        raw = os.path.join(self.experiment, "run1.raw")
+        events.submit(CREATED, raw)
+        for i in range(100):
+            with open(raw, "ab") as f:
+                f.write(b"0")
+            events.submit(MODIFIED, raw)
+        for i in range(3):
+            with open(os.path.join(self.experiment, "run2.d", f"part{i}.bin"), "wb") as f:
+                f.write(b"0" * 5)
+            events.submit(CREATED, os.path.join(self.experiment, "run2.d", f"part{i}.bin"))
+        events.submit(MODIFIED, os.path.join(self.experiment, "notes.txt"))
+        self.assertEqual(len(events.pending), 2)
+
+        self.assertEqual(events.flush(force=True), 2)
+        sizes = dict(File.objects.filter(folder_watching_location=self.location).values_list("file_path", "size"))
+        self.assertEqual(sizes, {"/experiment/run1.raw": 100, "/experiment/run2.d": 15})
+
+        os.remove(raw)
+        events.submit(DELETED, raw)
+        events.submit(DELETED, os.path.join(self.experiment, "run2.d", "part0.bin"))
+        os.remove(os.path.join(self.experiment, "run2.d", "part0.bin"))
+        events.flush(force=True)
+        sizes = dict(File.objects.filter(folder_watching_location=self.location).values_list("file_path", "size"))
+        self.assertEqual(sizes, {"/experiment/run2.d": 10})
+
+    def test_requeue_failed_events(self):
+        configs = []
+        events = EventCoalescer(self.location, window=0, on_config=configs.append)
+        raw = os.path.join(self.experiment, "run1.raw")
+        with open(raw, "wb") as f:
+            f.write(b"0" * 4)
+        events.submit(CREATED, raw)
+        events.submit(CREATED, os.path.join(self.experiment, "run.cat.yml"))
+        with patch("catapult.events.sync_files", side_effect=RuntimeError("database unavailable")):
+            self.assertEqual(events.flush(force=True), 1)
+        self.assertEqual(list(events.pending), [raw])
+        self.assertEqual(events.pending[raw].attempts, 1)
+        self.assertEqual(File.objects.filter(folder_watching_location=self.location).count(), 0)
+
+        self.assertEqual(events.flush(force=True), 1)
+        self.assertEqual(events.pending, {})
+        self.assertEqual(File.objects.get(folder_watching_location=self.location).size, 4)
+        self.assertEqual(configs, [os.path.join(self.experiment, "run.cat.yml")])
+
+    def test_acquisition_size_tracker(self):
+        tracker = AcquisitionSizeTracker()
+        folder = os.path.join(self.experiment, "run2.d")
+        with open(os.path.join(folder, "analysis.tdf_bin"), "wb") as f:
+            f.write(b"0" * 10)
+        self.assertEqual(tracker.update(folder, []), 10)
+
+        os.makedirs(os.path.join(folder, "sub"))
+        with open(os.path.join(folder, "sub", "part.bin"), "wb") as f:
+            f.write(b"0" * 4)
+        with open(os.path.join(folder, "analysis.tdf_bin"), "ab") as f:
+            f.write(b"0" * 2)
+        self.assertEqual(tracker.update(folder, [os.path.join(folder, "sub"), os.path.join(folder, "analysis.tdf_bin")]), 16)
+        shutil.rmtree(os.path.join(folder, "sub"))
+        self.assertEqual(tracker.update(folder, [os.path.join(folder, "sub")]), 12)
+
+        events = EventCoalescer(self.location, window=0)
+        events.submit(MODIFIED, os.path.join(folder, "analysis.tdf_bin"))
+        events.flush(force=True)
+        file = File.objects.get(file_path="/experiment/run2.d")
+        self.assertEqual(file.size, 12)
+        self.assertEqual(stable_files(File.objects.all(), 60).count(), 0)
+        File.objects.filter(id=file.id).update(size_changed_at=file.size_changed_at - datetime.timedelta(seconds=120))
+        self.assertEqual(list(stable_files(File.objects.all(), 60)), [file])
+
+
+class TestReadinessScheduler(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.location = FolderWatchingLocation.objects.create(folder_path=self.folder)
+        self.experiment = Experiment.objects.create(experiment_name=os.path.join(self.folder, "experiment"))
+        os.makedirs(self.experiment.experiment_name)
+        for name, size in [("run1.raw", 10), ("run2.raw", 20)]:
+            with open(os.path.join(self.experiment.experiment_name, name), "wb") as f:
+                f.write(b"0" * size)
+            File.objects.create(
+                file_path=f"/experiment/{name}", folder_watching_location=self.location, experiment=self.experiment, size=10
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_process_due_files(self):
+        scheduler = ReadinessScheduler(threshold=60)
+        scheduler.schedule_experiments({self.experiment.id})
+        self.assertEqual(len(scheduler.deadlines), 2)
+        scheduler.dirty.clear()
+        now = time.time()
+        scheduler.process_due(now)
+        self.assertEqual(File.objects.filter(ready_for_processing=True).count(), 0)
+
+        File.objects.update(updated_at=timezone.now() - datetime.timedelta(seconds=120))
+        scheduler.schedule_experiments({self.experiment.id})
+        scheduler.dirty.clear()
+        scheduler.process_due(now + 60)
+        self.assertEqual(list(File.objects.filter(ready_for_processing=True).values_list("file_path", flat=True)), ["/experiment/run1.raw"])
+        self.assertEqual(scheduler.dirty, {self.experiment.id})
+        # the file whose size differs on disk is checked again after the threshold
+        self.assertGreaterEqual(scheduler.next_deadline(), now + 120)
+        self.assertEqual(scheduler.evaluate_dirty(), 0)
+
+    def test_annotate_readiness(self):
+        File.objects.update(ready_for_processing=True)
+        config = CatapultRunConfig.objects.create(
+            experiment=self.experiment, folder_watching_location=self.location, config_file_path="config",
+            fasta_required=True
+        )
+        analysis = Analysis.objects.create(
+            experiment=self.experiment, analysis_path="analysis", config=config, total_files=2, analysis_type="diann-create"
+        )
+        with open(os.path.join(self.folder, "human.fasta"), "wb") as f:
+            f.write(b">P1\nPEPTIDE\n")
+        FastaFile.objects.create(file_path="/human.fasta", config=config, size=0)
+
+        def dispatch_mode():
+            return annotate_readiness(CatapultRunConfig.objects.filter(id=config.id)).get().dispatch_mode
+
+        self.assertIsNone(dispatch_mode())
+        # the first check records the size of the fasta file, the second one marks it ready
+        self.assertEqual(check_input_files(FastaFile, [config.id]), 0)
+        self.assertEqual(check_input_files(FastaFile, [config.id]), 1)
+        update_input_flags(CatapultRunConfig.objects.filter(id=config.id))
+        config.refresh_from_db()
+        self.assertTrue(config.fasta_ready)
+        self.assertEqual(dispatch_mode(), "new")
+        analysis.generated_quant.add(*File.objects.all())
+        self.assertEqual(dispatch_mode(), "all")
+
+
+class TestLogSink(TransactionTestCase):
+
+    def test_batched_flush(self):
+        task = CeleryTask.objects.create(task_id="log-sink", task_name="run_diann_worker", status="RUNNING")
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)("analysis_log", channel_name)
+        with LogSink(task, task_id=task.task_id, hostname="worker", max_lines=500, max_delay=60) as sink:
+            for i in range(1200):
+                sink.write(f"line {i}")
+        self.assertEqual(sink.flushes, 3)
+        self.assertEqual(list(LogChunk.objects.filter(task=task).values_list("start_line", "line_count")), [(0, 500), (500, 500), (1000, 200)])
+        self.assertEqual([line["log"] for line in LogLines(LogChunk.objects.filter(task=task))[499:501]], ["line 499", "line 500"])
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(message["message"]["log"].split("\n")[-1], "line 499")
+
+
+class TestLogChunks(TestCase):
+
+    def setUp(self):
+        self.task = CeleryTask.objects.create(task_id="log-chunks", task_name="run_diann_worker", status="SUCCESS")
+        for i in range(25):
+            LogRecord.objects.create(task=self.task, log=f"line {i}")
+        LogRecord.objects.filter(task=self.task).update(created_at=timezone.now() - datetime.timedelta(hours=1))
+        append_chunk(self.task, [(time.time(), "sink line")])
+        call_command("migrate_log_records", chunk_lines=10, stdout=StringIO())
+
+    def test_migrate_and_read(self):
+        self.assertFalse(LogRecord.objects.exists())
+        chunks = LogChunk.objects.filter(task=self.task)
+        self.assertEqual(list(chunks.values_list("start_line", "end_line")), [(0, 10), (10, 20), (20, 25), (25, 26)])
+        lines = LogLines(chunks)
+        self.assertEqual(lines.count(), 26)
+        self.assertEqual([line["log"] for line in lines[8:12]], ["line 8", "line 9", "line 10", "line 11"])
+        self.assertEqual([line["line"] for line in LogLines(chunks, from_line=23)[:]], [23, 24, 25])
+        recent = LogLines(chunks, since=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual([line["log"] for line in recent[:]], ["sink line"])
+        self.assertEqual([line["log"] for line in tail(chunks, 2)], ["line 24", "sink line"])
+
+    def test_viewset(self):
+        client = APIClient()
+        response = client.get("/api/logrecords/", {"task": self.task.id, "limit": 5, "offset": 20})
+        self.assertEqual(response.data["count"], 26)
+        self.assertEqual([line["log"] for line in response.data["results"]], ["line 20", "line 21", "line 22", "line 23", "line 24"])
+        response = client.get("/api/logrecords/", {"task": self.task.id, "tail": 1})
+        self.assertEqual(response.data[0]["log"], "sink line")
+        self.assertEqual(response.data[0]["line"], 25)
+        self.assertIsNone(response.data[0]["id"])
+        found = client.get("/api/logrecords/", {"task": self.task.id, "search": "LINE 1", "limit": 3}).data
+        self.assertEqual(found["count"], 11)
+        self.assertEqual([line["log"] for line in found["results"]], ["line 1", "line 10", "line 11"])
+        latest = client.get("/api/logrecords/", {"task": self.task.id, "ordering": "-created_at", "limit": 2}).data
+        self.assertEqual([line["line"] for line in latest["results"]], [25, 24])
+
+        # rows that were not migrated have the same fields
+        task = CeleryTask.objects.create(task_id="log-rows", task_name="run_diann_worker", status="SUCCESS")
+        LogRecord.objects.create(task=task, log="row line")
+        row = client.get("/api/logrecords/", {"task": task.id}).data["results"][0]
+        self.assertEqual(set(row.keys()), set(response.data[0].keys()))
+        self.assertIsNone(row["line"])
+        append_chunk(task, [(time.time(), "sink line")])
+        self.assertEqual(client.get("/api/logrecords/", {"ordering": "created_at"}).status_code, 400)
+
+
+class TestProcessRunner(TestCase):
+
+    def test_drain_both_streams(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        script = "import sys\nfor i in range(5000):\n    print('x' * 50, file=sys.stderr)\nprint('done')\nsys.exit(3)"
+        lines = []
+        runner = ProcessRunner(
+            [sys.executable, "-c", script],
+            sinks=[CallbackSink(lambda line, stream: lines.append(stream)), FileSink(os.path.join(folder, "process.log"))]
+        )
+        result = runner.run()
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.lines, {"stdout": 1, "stderr": 5000})
+        self.assertEqual(lines.count("stderr"), 5000)
+        with open(os.path.join(folder, "process.log")) as f:
+            content = f.read().splitlines()
+        self.assertIn("done", content)
+        self.assertEqual(content.count("[stderr] " + "x" * 50), 5000)
+        with self.assertRaises(subprocess.CalledProcessError):
+            result.check()
+
+
+class TestResourceSampler(TransactionTestCase):
+
+    def test_sample_process(self):
+        task = CeleryTask.objects.create(task_id="sampler", task_name="run_diann_worker", status="RUNNING")
+        runner = ProcessRunner([sys.executable, "-c", "import time\ntime.sleep(1)"])
+        sampler = ResourceSampler(task, interval=0.1, batch_size=3).attach(runner)
+        runner.run()
+        self.assertGreater(sampler.sample_count, 3)
+        self.assertEqual(TaskResourceSample.objects.filter(task=task).count(), sampler.sample_count)
+        self.assertGreater(TaskResourceSample.objects.filter(task=task).first().rss, 0)
+
+        response = APIClient().get(f"/api/tasks/{task.id}/resources/")
+        self.assertEqual(response.data["summary"]["samples"], sampler.sample_count)
+
+
+class TestDiannProgress(TransactionTestCase):
+
+    def test_parse_progress(self):
+        experiment = Experiment.objects.create(experiment_name="progress")
+        now = timezone.now()
+        for i, minutes in enumerate([10, 20, 30]):
+            Analysis.objects.create(
+                experiment=experiment, analysis_path=f"/history/{i}", analysis_type="diann-create", completed=True,
+                total_files=2, start_time=now - datetime.timedelta(minutes=minutes), stop_time=now
+            )
+        self.assertEqual(historical_file_seconds("diann-create"), 600)
+
+        task = CeleryTask.objects.create(task_id="progress", task_name="run_diann_worker", status="RUNNING")
+        parser = DiannProgressParser(task, total_files=2, file_seconds=600, group=None)
+        parser.open()
+        parser.write("[0:00] Loading FASTA /data/human.fasta")
+        self.assertEqual(parser.phase, "library")
+        self.assertEqual(parser.eta(), 1200)
+        for line in ["File #1/4", "[0:07] Loading run /data/a.raw", "[0:20] Calibrating with mass accuracies 20, 10",
+                     "[0:50] Quantification", "File #2/4", "[1:02] Calibrating with mass accuracies 20, 10"]:
+            parser.write(line)
+        self.assertTrue(parser.publisher.wait(timeout=10))
+        task.refresh_from_db()
+        self.assertEqual(task.progress["file"], 2)
+        self.assertEqual(task.progress["total_files"], 4)
+        self.assertEqual(task.progress["phase"], "calibration")
+        self.assertEqual(task.progress["percent"], 22.5)
+        self.assertIsNotNone(task.progress["eta_seconds"])
+
+        parser.write("[3:00] Cross-run analysis")
+        parser.write("[3:10] Calculating q-values for protein and gene groups")
+        self.assertEqual(parser.phase, "cross-run")
+        parser.close(Mock(returncode=0))
+        task.refresh_from_db()
+        self.assertEqual(task.progress["percent"], 100.0)
+        self.assertEqual(task.progress["eta_seconds"], 0.0)
+
+        response = APIClient().get("/api/tasks/drain/")
+        self.assertEqual(response.data["running"], 1)
+
+
+class TestSlotWorker(TransactionTestCase):
+
+    def test_capacity(self):
+        capacity = WorkerCapacity(slots=3, cpu=8, memory=16 * 1024 ** 3)
+        large = TaskCost(6, 4 * 1024 ** 3)
+        small = TaskCost(2, 2 * 1024 ** 3)
+        first = capacity.reserve(large)
+        self.assertTrue(capacity.fits(small))
+        self.assertFalse(capacity.fits(large))
+        capacity.reserve(small)
+        self.assertFalse(capacity.fits(TaskCost(1, 1024)))
+        capacity.release(first)
+        self.assertTrue(capacity.fits(large))
+        self.assertEqual(TaskCost(32, 1024).clamp(capacity).cpu, 8)
+
+    def test_run_slots(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        config_path = os.path.join(folder, "config.cat.yml")
+        with open(config_path, "w") as f:
+            f.write("threads: 4\n")
+        config = CatapultRunConfig.objects.create(config_file_path=config_path)
+        worker = CeleryWorker.objects.create(worker_name="slots", worker_hostname="slots@host", worker_status="ONLINE")
+        self.assertEqual(task_cost(DBTaskResult(args_kwargs={"args": [], "kwargs": {"config_id": config.id}})).cpu, 4)
+        for _ in range(3):
+            DBTaskResult.objects.create(
+                args_kwargs={"args": [], "kwargs": {}},
+                task_path="catapult.tasks.calculate_meaning_of_life", backend_name="default",
+            )
+
+        catapult_worker = CatapultWorker(
+            queue_names=["*"], interval=0, batch=True, backend_name="default", c_worker=worker,
+            capacity=WorkerCapacity(slots=2, cpu=8, memory=64 * 1024 ** 3),
+        )
+        with patch.object(catapult_worker, "configure_signals"):
+            catapult_worker.start()
+        self.assertEqual(DBTaskResult.objects.complete().count(), 3)
+        worker.refresh_from_db()
+        self.assertIsNotNone(worker.heartbeat)
+        self.assertEqual(worker.slots["capacity"]["free_slots"], 2)
+        self.assertEqual(worker.slots["running"], [])
+
+    def test_wake_on_enqueue(self):
+        with patch("catapult.models.notify") as notify:
+            DBTaskResult.objects.create(
+                args_kwargs={"args": [], "kwargs": {}}, queue_name="analysis",
+                task_path="catapult.tasks.calculate_meaning_of_life", backend_name="default",
+            )
+        notify.assert_called_once_with(TASK_CHANNEL, ["analysis"])
+
+        worker = CeleryWorker.objects.create(worker_name="listen", worker_hostname="listen@host", worker_status="ONLINE")
+        catapult_worker = CatapultWorker(
+            queue_names=["analysis"], interval=0, batch=False, backend_name="default", c_worker=worker,
+            fallback_interval=60,
+        )
+        catapult_worker.listening = True
+        catapult_worker.last_poll = time.monotonic()
+        catapult_worker.heartbeat_interval = 0.1
+        self.assertFalse(catapult_worker.wait_for_tasks())
+        catapult_worker.wake.set()
+        self.assertTrue(catapult_worker.wait_for_tasks())
+
+
+class TestFairShareScheduling(TestCase):
+
+    def enqueue(self, config, priority=0, minutes_ago=0):
+        task_result = DBTaskResult.objects.create(
+            args_kwargs={"args": [], "kwargs": {"config_id": config.id}}, priority=priority,
+            task_path="catapult.tasks.run_diann_worker", backend_name="default",
+        )
+        DBTaskResult.objects.filter(id=task_result.id).update(enqueued_at=timezone.now() - datetime.timedelta(minutes=minutes_ago))
+        return task_result.id
+
+    def test_rank_tasks(self):
+        self.assertEqual(config_priority({"cat_priority": 500}), 100)
+        self.assertEqual(config_priority({"cat_priority": 10, "cat_qc": True}), 50)
+        self.assertEqual(config_priority(None), 0)
+
+        experiment = Experiment.objects.create(experiment_name="fair share")
+        busy = FolderWatchingLocation.objects.create(folder_path="/busy")
+        quiet = FolderWatchingLocation.objects.create(folder_path="/quiet", weight=2.0)
+        busy_config = CatapultRunConfig.objects.create(config_file_path="/busy/a.yml", folder_watching_location=busy)
+        quiet_config = CatapultRunConfig.objects.create(config_file_path="/quiet/b.yml", folder_watching_location=quiet)
+        analysis = Analysis.objects.create(experiment=experiment, analysis_path="/busy/a.yml", config=busy_config)
+        for i in range(2):
+            CeleryTask.objects.create(task_id=f"running-{i}", task_name="run_diann_worker", status="RUNNING", analysis=analysis)
+
+        busy_task = self.enqueue(busy_config)
+        quiet_task = self.enqueue(quiet_config)
+        qc_task = self.enqueue(busy_config, priority=50)
+        aged_task = self.enqueue(busy_config, minutes_ago=120)
+        ranked = [task.id for _, task in rank_tasks(list(DBTaskResult.objects.all()))]
+        self.assertEqual(ranked, [aged_task, qc_task, quiet_task, busy_task])
+        self.assertIn(aged_task, candidate_ids(DBTaskResult.objects.ready(), 1))
+
+        metrics = queue_metrics()
+        self.assertEqual(metrics[0]["ready"], 4)
+        self.assertGreaterEqual(metrics[0]["max_wait_seconds"], 7200)
+        response = APIClient().get("/api/tasks/queues/")
+        self.assertEqual(response.data[0]["queue_name"], "default")
+
+
+class TestPlacement(TestCase):
+
+    def test_should_claim(self):
+        location = FolderWatchingLocation.objects.create(folder_path="/instrument")
+        small = CeleryWorker.objects.create(worker_name="small", worker_hostname="small@host", worker_status="ONLINE",
+                                            worker_info={"Total cores": 8, "Total Memory": "32.00GB"}, heartbeat=timezone.now())
+        large = CeleryWorker.objects.create(worker_name="large", worker_hostname="large@host", worker_status="ONLINE",
+                                            worker_info={"Total cores": 64, "Total Memory": "512.00GB"}, heartbeat=timezone.now(),
+                                            slots={"capacity": {"cpu": 64, "memory": 512 * GB, "free_slots": 1}})
+        self.assertEqual(parse_memory("32.00GB"), 32 * GB)
+        task_result = DBTaskResult(args_kwargs={"args": [], "kwargs": {}}, enqueued_at=timezone.now())
+        profile = TaskProfile(input_bytes=10 * GB, location=location)
+
+        engine = PlacementEngine(small)
+        engine.refresh()
+        self.assertFalse(engine.should_claim(task_result, profile))
+        self.assertTrue(engine.should_claim(task_result, TaskProfile(input_bytes=10 * GB, threads=8, location=location)))
+        self.assertTrue(engine.should_claim(DBTaskResult(args_kwargs={}, enqueued_at=timezone.now() - datetime.timedelta(hours=1)), profile))
+
+        large.slots["capacity"]["free_slots"] = 0
+        large.save()
+        engine.refresh()
+        self.assertTrue(engine.should_claim(task_result, profile))
+
+        small.folder_path_translations = {"/other": "/mnt/other"}
+        engine.refresh()
+        self.assertFalse(engine.should_claim(task_result, profile))
+
+        observe_runtime(small, "DIA-NN", 10 * GB, 1000)
+        cost_profile = observe_runtime(small, "DIA-NN", 10 * GB, 2000)
+        self.assertEqual(cost_profile.runs, 2)
+        self.assertAlmostEqual(cost_profile.seconds_per_gb, 130)
+
+
+class TestShardedFirstPass(TestCase):
+
+    def test_shard_and_finish(self):
+        location = FolderWatchingLocation.objects.create(folder_path="/data")
+        experiment = Experiment.objects.create(experiment_name="cohort")
+        config = CatapultRunConfig.objects.create(config_file_path="/data/cohort/config.yml",
+                                                  folder_watching_location=location, content={"cat_shard_size": 2})
+        analysis = Analysis.objects.create(experiment=experiment, analysis_path="/data/cohort/config.yml", config=config,
+                                           analysis_type="diann-spectral", total_files=5, processing=True)
+        files = [
+            File.objects.create(file_path=f"/cohort/run{i}.raw", folder_watching_location=location, experiment=experiment,
+                                size=10, processing=True)
+            for i in range(5)
+        ]
+        analysis.generating_quant.add(*files)
+        commands = ["diann"]
+        for f in files:
+            commands.extend(["--f", f.get_path()])
+        commands.extend(["--lib", "/data/cohort/lib.speclib", "--out", "/data/cohort/out/report.tsv", "--temp", "/data/cohort/out/temp"])
+
+        shards = shard_commands(analysis, commands)
+        self.assertEqual([ids for _, ids in shards], [[files[0].id, files[1].id], [files[2].id, files[3].id], [files[4].id]])
+        first = shards[0][0]
+        self.assertEqual(first.count("--f"), 2)
+        self.assertEqual(first[first.index("--out") + 1], f"/data/cohort/out/report.shard-{files[0].id}.tsv")
+        self.assertEqual(first[first.index("--temp") + 1], "/data/cohort/out/temp")
+
+        self.assertFalse(finish_shard(analysis.id, shards[0][1], succeeded=True))
+        self.assertFalse(finish_shard(analysis.id, shards[1][1], succeeded=False))
+        self.assertTrue(finish_shard(analysis.id, shards[2][1], succeeded=True))
+        analysis.refresh_from_db()
+        self.assertFalse(analysis.processing)
+        self.assertEqual(analysis.generated_quant.count(), 3)
+        self.assertEqual(File.objects.filter(processing=False).count(), 2)
+
+        final = shard_commands(analysis, commands, final=True)
+        self.assertEqual(len(final), 1)
+        self.assertIn("--use-quant", final[0][0])
+
+        # a shard that keeps failing is no longer dispatched
+        File.objects.update(ready_for_processing=True)
+        config = annotate_readiness(CatapultRunConfig.objects.filter(id=config.id)).get()
+        self.assertEqual((config.ready_count, config.dispatch_mode), (5, "new"))
+        for attempt in range(File.MAX_QUANT_FAILURES - 1):
+            analysis.generating_quant.add(*shards[1][1])
+            finish_shard(analysis.id, shards[1][1], succeeded=False)
+        self.assertEqual(set(File.objects.filter(quant_failures=File.MAX_QUANT_FAILURES).values_list("id", flat=True)),
+                         set(shards[1][1]))
+        config = annotate_readiness(CatapultRunConfig.objects.filter(id=config.id)).get()
+        # the final run covers the files that have a quant file
+        self.assertEqual((config.ready_count, config.exhausted_count, config.dispatch_mode), (3, 2, "all"))
+        self.assertEqual(analysis.quant_total_files(), 3)
+        analysis.config.content.update({"engine": "DIA-NN", "f": None})
+        self.assertEqual(analysis.create_commands_from_config(), [])
+
+
+class TestSerializerQueries(ReportTestCase):
+
+    def test_flat_and_expanded(self):
+        add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        client = APIClient()
+        with self.assertNumQueries(2):
+            response = client.get("/api/precursor/", {"limit": 100})
+        self.assertEqual(response.data["results"][0]["analysis"], self.analysis.id)
+        self.assertIsInstance(response.data["results"][0]["file"], int)
+
+        with self.assertNumQueries(3):
+            response = client.get("/api/precursor/", {"limit": 100, "expand": "analysis,file"})
+        row = response.data["results"][0]
+        self.assertEqual(row["analysis"]["id"], self.analysis.id)
+        self.assertFalse(row["analysis"]["ready"])
+        self.assertEqual(row["file"]["id"], PrecursorReportContent.objects.order_by("id").first().file_id)
+
+        with self.assertNumQueries(2):
+            response = client.get("/api/proteingroup/", {"limit": 100, "expand": "file"})
+        self.assertIsInstance(response.data["results"][0]["file"], dict)
+
+        self.experiment.sample_count = 3
+        self.experiment.save()
+        File.objects.update(ready_for_processing=True)
+        with self.assertNumQueries(2):
+            response = client.get("/api/analyses/")
+        self.assertTrue(response.data["results"][0]["ready"])
+
+
+class TestKeysetPagination(ReportTestCase):
+
+    def walk(self, client, params):
+        ids = []
+        response = client.get("/api/precursor/", dict(params, cursor=""))
+        pages = [response.data]
+        while response.data["next"]:
+            response = client.get(response.data["next"])
+            pages.append(response.data)
+        for page in pages:
+            ids += [row["id"] for row in page["results"]]
+        return ids, pages
+
+    def test_cursor_pages(self):
+        add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        PrecursorReportContent.objects.filter(id=PrecursorReportContent.objects.order_by("id").first().id).update(intensity=None)
+        client = APIClient()
+        rows = list(PrecursorReportContent.objects.values_list("id", "intensity"))
+        self.assertGreater(len(rows), 2)
+
+        ids, pages = self.walk(client, {"limit": 2})
+        self.assertEqual(ids, sorted(i for i, _ in rows))
+        self.assertIsNone(pages[0]["count"])
+        self.assertIsNone(pages[0]["previous"])
+
+        ids, pages = self.walk(client, {"limit": 2, "ordering": "-intensity", "count": "exact"})
+        with_value = sorted((r for r in rows if r[1] is not None), key=lambda r: (-r[1], -r[0]))
+        without_value = sorted((r for r in rows if r[1] is None), key=lambda r: -r[0])
+        self.assertEqual(ids, [i for i, _ in with_value + without_value])
+        self.assertEqual(pages[-1]["count"], len(rows))
+
+        response = client.get(pages[-1]["previous"])
+        self.assertEqual([row["id"] for row in response.data["results"]], [row["id"] for row in pages[-2]["results"]])
+
+        response = client.get("/api/precursor/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+        response = client.get("/api/precursor/", {"limit": 2, "offset": 2})
+        self.assertEqual(response.data["count"], len(rows))
+        self.assertEqual([row["id"] for row in response.data["results"]], sorted(i for i, _ in rows)[2:4])
+
+
+class TestReportSearch(ReportTestCase):
+
+    def test_multiple_genes(self):
+        add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        PrecursorReportContent.objects.filter(precursor_key__value="CCK2").update(
+            gene_names_key=GeneGroup.objects.create(value="G2;G3")
+        )
+        client = APIClient()
+        genes = lambda response: {row["gene_names"] for row in response.data["results"]}
+        self.assertEqual(genes(client.get("/api/precursor/", {"gene_names": "g1", "limit": 100})), {"G1"})
+        self.assertEqual(genes(client.get("/api/precursor/", {"gene_names": "G1;G3", "limit": 100})), {"G1", "G2;G3"})
+        self.assertEqual(genes(client.get("/api/precursor/", {"search": "G1;g3", "limit": 100})), {"G1", "G2;G3"})
+        self.assertEqual(genes(client.get("/api/precursor/", {"search": "G2 CCK", "limit": 100})), {"G2;G3"})
+        self.assertEqual(client.get("/api/precursor/", {"search": "G4;G5", "limit": 100}).data["count"], 0)
+
+
+class TestReportPartitions(ReportTestCase):
+
+    def test_analysis_rows(self):
+        add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        self.assertEqual(PrecursorReportContent.objects.filter(analysis=self.analysis).count(), 5)
+        self.assertEqual(ProteinGroupReportContent.objects.filter(analysis=self.analysis).count(), 4)
+        client = APIClient()
+        response = client.get("/api/proteingroup/", {"analysis": self.analysis.id})
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(response.data["results"][0]["analysis"], self.analysis.id)
+        self.assertEqual(client.get("/api/precursor/", {"analysis": self.analysis.id + 1}).data["count"], 0)
+
+        self.analysis.delete()
+        self.assertEqual(PrecursorReportContent.objects.count(), 0)
+        self.assertEqual(ProteinGroupReportContent.objects.count(), 0)
+        self.assertEqual(ResultSummary.objects.count(), 3)
+
+    @skipIf(connection.vendor != "postgresql", "the report tables are only partitioned on PostgreSQL")
+    def test_partition_foreign_keys(self):
+        # rows written before the analysis had partitions are in the default partitions, within their bound
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model in [PrecursorReportContent, ProteinGroupReportContent]:
+                default = quote(f"{model._meta.db_table}_default")
+                bound = quote(f"{model._meta.db_table}_default_analysis_bound")
+                cursor.execute(f"ALTER TABLE {default} DROP CONSTRAINT {bound}")
+                cursor.execute(f"ALTER TABLE {default} ADD CONSTRAINT {bound} CHECK (analysis_id <= %s)", [self.analysis.id])
+        with patch("catapult.ingestion.ensure_partitions"):
+            add_stats_and_report(self.analysis, self.config, os.path.dirname(self.config.config_file_path), self.stats_file)
+        ensure_partitions(self.analysis.id)
+        for model, rows in [(PrecursorReportContent, 5), (ProteinGroupReportContent, 4)]:
+            table = model._meta.db_table
+            name = partition_name(table, self.analysis.id)
+            self.assertIn(name, [partition["table"] for partition in partitions(table)])
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {quote(name)}")
+                self.assertEqual(cursor.fetchone()[0], rows)
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                with self.assertRaises(IntegrityError), transaction.atomic():
+                    cursor.execute(f"UPDATE {quote(name)} SET file_id = %s", [File.objects.order_by("-id")[0].id + 1])
+
+        self.assertEqual(len(drop_partitions(self.analysis.id)), 2)
+        self.assertEqual(PrecursorReportContent.objects.count(), 0)
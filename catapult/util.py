@@ -1,14 +1,12 @@
 import os
 import shlex
 
-import pandas as pd
 import yaml
 import click
-from django.db import transaction
 
-from catapult.models import File, ResultSummary, PrecursorReportContent, ProteinGroupReportContent
+from catapult.ingestion import ingest_diann_report
 
-blank_diann_config = {'cat_file_auto': 'bool', 'cat_ready': 'bool', 'cat_total_files': 'number', 'channel_run_norm': 'bool', 'channel_spec_norm': 'bool', 'channels': 'list', 'clear_mods': 'bool', 'compact_report': 'bool', 'cont_quant_exclude': 'bool', 'convert': 'bool', 'cut': 'str', 'decoy_channel': 'str', 'decoys_preserve_spectrum': 'bool', 'diann_path': 'str', 'dir': 'str', 'direct_quant': 'bool', 'dl_no_im': 'bool', 'dl_no_rt': 'bool', 'duplicate_proteins': 'bool', 'exact_fdr': 'bool', 'export_quant': 'bool', 'ext': 'str', 'f': 'list', 'fasta': 'list', 'fasta_filter': 'str', 'fasta_search': 'bool', 'fixed_mod': 'list', 'force_swissprot': 'bool', 'foreign_decoys': 'bool', 'full_unimod': 'bool', 'gen_fr_restriction': 'bool', 'gen_spec_lib': 'bool', 'global_mass_cal': 'bool', 'global_norm': 'bool', 'high_acc': 'bool', 'ids_to_names': 'bool', 'il_eq': 'bool', 'im_window': 'str', 'im_window_factor': 'str', 'individual_mass_acc': 'bool', 'individual_reports': 'bool', 'individual_windows': 'bool', 'int_removal': 'str', 'lib': 'list', 'lib_fixed_mod': 'list', 'library_headers': 'list', 'mass_acc': 'number', 'mass_acc_cal': 'str', 'mass_acc_ms1': 'number', 'matrices': 'bool', 'matrix_ch_qvalue': 'str', 'matrix_qvalue': 'str', 'matrix_spec_q': 'bool', 'matrix_tr_qvalue': 'str', 'max_fr': 'str', 'max_fr_mz': 'number', 'max_pep_len': 'number', 'max_pr_charge': 'number', 'max_pr_mz': 'number', 'mbr_fix_settings': 'bool', 'met_excision': 'bool', 'min_fr': 'str', 'min_fr_mz': 'number', 'min_peak': 'str', 'min_pep_len': 'number', 'min_pr_charge': 'number', 'min_pr_mz': 'number', 'missed_cleavages': 'number', 'mod': 'list', 'mod_no_scoring': 'str', 'mod_only': 'bool', 'no_calibration': 'bool', 'no_cut_after_mod': 'str', 'no_decoy_channel': 'bool', 'no_fr_selection': 'bool', 'no_im_window': 'bool', 'no_isotopes': 'bool', 'no_lib_filter': 'bool', 'no_main_report': 'bool', 'no_maxlfq': 'bool', 'no_norm': 'bool', 'no_peptidoforms': 'bool', 'no_prot_inf': 'bool', 'no_quant_files': 'bool', 'no_rt_window': 'bool', 'no_stats': 'bool', 'no_swissprot': 'bool', 'original_mods': 'bool', 'out': 'str', 'out_lib': 'str', 'out_lib_copy': 'bool', 'out_measured_rt': 'bool', 'peak_translation': 'bool', 'peptidoforms': 'bool', 'pg_level': 'str', 'pr_filter': 'str', 'predict_n_frag': 'str', 'predictor': 'bool', 'prefix': 'str', 'ptm_qvalues': 'bool', 'quant_acc': 'str', 'quant_fr': 'str', 'quant_no_ms1': 'bool', 'quant_sel_runs': 'str', 'quant_train_runs': 'str', 'quick_mass_acc': 'bool', 'qvalue': 'number', 'reanalyse': 'bool', 'reannotate': 'bool', 'ref': 'str', 'regular_swath': 'bool', 'relaxed_prot_inf': 'bool', 'report_lib_info': 'bool', 'restrict_fr': 'bool', 'scanning_swath': 'bool', 'semi': 'bool', 'skip_unknown_mods': 'bool', 'smart_profiling': 'bool', 'species_genes': 'bool', 'species_ids': 'bool', 'sptxt_acc': 'str', 'tag_to_ids': 'str', 'temp': 'str', 'threads': 'number', 'tims_min_int': 'str', 'tims_ms1_cycle': 'str', 'tims_scan': 'bool', 'tims_skip_errors': 'bool', 'unimod': 'list', 'use_quant': 'bool', 'var_mod': 'list', 'var_mods': 'number', 'verbose': 'number', 'window': 'str', 'xic': 'str', 'xic_theoretical_fr': 'bool'}
+blank_diann_config = {'cat_file_auto': 'bool', 'cat_priority': 'number', 'cat_qc': 'bool', 'cat_ready': 'bool', 'cat_shard_size': 'number', 'cat_total_files': 'number', 'channel_run_norm': 'bool', 'channel_spec_norm': 'bool', 'channels': 'list', 'clear_mods': 'bool', 'compact_report': 'bool', 'cont_quant_exclude': 'bool', 'convert': 'bool', 'cut': 'str', 'decoy_channel': 'str', 'decoys_preserve_spectrum': 'bool', 'diann_path': 'str', 'dir': 'str', 'direct_quant': 'bool', 'dl_no_im': 'bool', 'dl_no_rt': 'bool', 'duplicate_proteins': 'bool', 'exact_fdr': 'bool', 'export_quant': 'bool', 'ext': 'str', 'f': 'list', 'fasta': 'list', 'fasta_filter': 'str', 'fasta_search': 'bool', 'fixed_mod': 'list', 'force_swissprot': 'bool', 'foreign_decoys': 'bool', 'full_unimod': 'bool', 'gen_fr_restriction': 'bool', 'gen_spec_lib': 'bool', 'global_mass_cal': 'bool', 'global_norm': 'bool', 'high_acc': 'bool', 'ids_to_names': 'bool', 'il_eq': 'bool', 'im_window': 'str', 'im_window_factor': 'str', 'individual_mass_acc': 'bool', 'individual_reports': 'bool', 'individual_windows': 'bool', 'int_removal': 'str', 'lib': 'list', 'lib_fixed_mod': 'list', 'library_headers': 'list', 'mass_acc': 'number', 'mass_acc_cal': 'str', 'mass_acc_ms1': 'number', 'matrices': 'bool', 'matrix_ch_qvalue': 'str', 'matrix_qvalue': 'str', 'matrix_spec_q': 'bool', 'matrix_tr_qvalue': 'str', 'max_fr': 'str', 'max_fr_mz': 'number', 'max_pep_len': 'number', 'max_pr_charge': 'number', 'max_pr_mz': 'number', 'mbr_fix_settings': 'bool', 'met_excision': 'bool', 'min_fr': 'str', 'min_fr_mz': 'number', 'min_peak': 'str', 'min_pep_len': 'number', 'min_pr_charge': 'number', 'min_pr_mz': 'number', 'missed_cleavages': 'number', 'mod': 'list', 'mod_no_scoring': 'str', 'mod_only': 'bool', 'no_calibration': 'bool', 'no_cut_after_mod': 'str', 'no_decoy_channel': 'bool', 'no_fr_selection': 'bool', 'no_im_window': 'bool', 'no_isotopes': 'bool', 'no_lib_filter': 'bool', 'no_main_report': 'bool', 'no_maxlfq': 'bool', 'no_norm': 'bool', 'no_peptidoforms': 'bool', 'no_prot_inf': 'bool', 'no_quant_files': 'bool', 'no_rt_window': 'bool', 'no_stats': 'bool', 'no_swissprot': 'bool', 'original_mods': 'bool', 'out': 'str', 'out_lib': 'str', 'out_lib_copy': 'bool', 'out_measured_rt': 'bool', 'peak_translation': 'bool', 'peptidoforms': 'bool', 'pg_level': 'str', 'pr_filter': 'str', 'predict_n_frag': 'str', 'predictor': 'bool', 'prefix': 'str', 'ptm_qvalues': 'bool', 'quant_acc': 'str', 'quant_fr': 'str', 'quant_no_ms1': 'bool', 'quant_sel_runs': 'str', 'quant_train_runs': 'str', 'quick_mass_acc': 'bool', 'qvalue': 'number', 'reanalyse': 'bool', 'reannotate': 'bool', 'ref': 'str', 'regular_swath': 'bool', 'relaxed_prot_inf': 'bool', 'report_lib_info': 'bool', 'restrict_fr': 'bool', 'scanning_swath': 'bool', 'semi': 'bool', 'skip_unknown_mods': 'bool', 'smart_profiling': 'bool', 'species_genes': 'bool', 'species_ids': 'bool', 'sptxt_acc': 'str', 'tag_to_ids': 'str', 'temp': 'str', 'threads': 'number', 'tims_min_int': 'str', 'tims_ms1_cycle': 'str', 'tims_scan': 'bool', 'tims_skip_errors': 'bool', 'unimod': 'list', 'use_quant': 'bool', 'var_mod': 'list', 'var_mods': 'number', 'verbose': 'number', 'window': 'str', 'xic': 'str', 'xic_theoretical_fr': 'bool'}
 
 
 def diann_yaml_parser(yaml_path):
@@ -72,7 +70,7 @@ def convert_cmd_array_to_config(cmd_array: list[str]):
         config = yaml.safe_load(stream)
     config["diann_path"] = cmd_array[0]
     for key, value in config.items():
-        if key not in ["diann_path", "cat_ready", "cat_total_files", "cat_file_auto"]:
+        if key not in ["diann_path", "cat_ready", "cat_total_files", "cat_file_auto", "cat_priority", "cat_qc", "cat_shard_size"]:
             cmd_key = key.replace("_", "-")
             if key == "temp":
                 if "--temp" in cmd_array:
@@ -190,82 +188,9 @@ if __name__ == "__main__":
     main()
 
 
-def add_stats_and_report(analysis, config, parent_folder, report_stats_file):
+def add_stats_and_report(analysis, config, parent_folder, report_stats_file, loader=None):
     if os.path.exists(report_stats_file):
-        data = pd.read_csv(str(report_stats_file), sep="\t")
-        for i, r in data.iterrows():
-            file_path = r["File.Name"].replace(config.folder_watching_location.folder_path,
-                                               "")
-            file = File.objects.get(file_path=file_path)
-            result_summary = ResultSummary.objects.filter(analysis=analysis, file=file)
-            if not result_summary.exists():
-                result_summary = ResultSummary.objects.create(
-                    analysis=analysis,
-                    file=file,
-                    protein_identified=r["Proteins.Identified"],
-                    precursor_identified=r["Precursors.Identified"],
-                    stats_file=os.path.join(
-                        str(parent_folder.replace(config.folder_watching_location.folder_path, "")),
-                        config.content["prefix"],
-                        "report.stats.tsv"
-                    ),
-                    log_file=os.path.join(
-                        str(parent_folder.replace(config.folder_watching_location.folder_path, "")),
-                        config.content["prefix"],
-                        "report.log.txt"
-                    )
-                )
-            else:
-                result_summary = result_summary.first()
-                if r["Proteins.Identified"] != result_summary.protein_identified or r[
-                    "Precursors.Identified"] != result_summary.precursor_identified:
-                    result_summary.protein_identified = r["Proteins.Identified"]
-                    result_summary.precursor_identified = r["Precursors.Identified"]
-                    result_summary.stats_file = os.path.join(
-                        str(parent_folder.replace(config.folder_watching_location.folder_path, "")),
-                        config.content["prefix"],
-                        "report.stats.tsv"
-                    )
-                    result_summary.save()
-            result_summary.precursor_report_content.all().delete()
-            result_summary.protein_group_report_content.all().delete()
-            file_obj = File.objects.get(file_path=file_path)
-            precursor_file = pd.read_csv(
-                str(os.path.join(parent_folder, config.content["prefix"], "report.pr_matrix.tsv")), sep="\t")
-            with transaction.atomic():
-                filtered_precursor_file = precursor_file[pd.notnull(precursor_file[r["File.Name"]])]
-                data = [
-                    PrecursorReportContent(
-                        file=file_obj,
-                        proteotypic=row["Proteotypic"] == 1,
-                        protein_group=row["Protein.Group"],
-                        intensity=row[r["File.Name"]],
-                        gene_names=row["Genes"],
-                        precursor_id=row["Precursor.Id"],
-                        result_summary=result_summary
-                    )
-                    for _, row in filtered_precursor_file.iterrows()
-                ]
-                if len(data) > 0:
-                    PrecursorReportContent.objects.bulk_create(data)
-            protein_file = pd.read_csv(
-                str(os.path.join(parent_folder, config.content["prefix"], "report.pg_matrix.tsv")), sep="\t")
-            with transaction.atomic():
-                filtered_protein_file = protein_file[pd.notnull(protein_file[r["File.Name"]])]
-
-                data = [
-                    ProteinGroupReportContent(
-                        file=file_obj,
-                        protein_group=row["Protein.Group"],
-                        intensity=row[r["File.Name"]],
-                        gene_names=row["Genes"],
-                        result_summary=result_summary
-                    )
-                    for _, row in filtered_protein_file.iterrows()
-                ]
-
-                if len(data) > 0:
-                    ProteinGroupReportContent.objects.bulk_create(data)
+        return ingest_diann_report(analysis, config, parent_folder, report_stats_file, loader=loader)
 
 def load_diann_default_confg():
     commands_folder = os.path.join(os.path.dirname(__file__), "management", "commands")
@@ -1,10 +1,12 @@
 import json
 from datetime import timedelta
 
+from django.conf import settings
 from django.db import transaction
 from django.db.models import Q, Avg, Count, Case, When, IntegerField
 from django.template.smartif import prefix
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework import viewsets, permissions, status
@@ -14,13 +16,20 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters.views import FilterMixin
 
-from catapult.filters import CatapultRunConfigFilter
+from catapult.filters import CatapultRunConfigFilter, ReportSearchFilter, text_query
 from catapult.models import File, Experiment, Analysis, FolderWatchingLocation, UserAPIKey, UploadedFile, CeleryTask, \
-    CeleryWorker, ResultSummary, LogRecord, PrecursorReportContent, ProteinGroupReportContent, CatapultRunConfig
+    CeleryWorker, ResultSummary, LogRecord, PrecursorReportContent, ProteinGroupReportContent, CatapultRunConfig, LogChunk
+from catapult.logstore import LogLines, line_records, tail
+from catapult.pagination import KeysetPagination
+from catapult.telemetry import summarize_samples
+from catapult.progress import queue_eta
+from catapult.scheduling import queue_metrics
 from catapult.serializers import FileSerializer, ExperimentSerializer, AnalysisSerializer, \
     FolderWatchLocationSerializer, UserAPIKeySerializer, UploadedFileSerializer, CeleryTaskSerializer, \
     CeleryWorkerSerializer, ResultSummarySerializer, LogRecordSerializer, PrecursorReportContentSerializer, \
-    ProteinGroupReportContentSerializer, CatapultRunConfigSerializer
+    ProteinGroupReportContentSerializer, CatapultRunConfigSerializer, TaskResourceSampleSerializer, \
+    get_expand, annotate_ready
+from catapult.result_store import get_result_store, TEXT_FIELDS, PRECURSOR_TABLE, PROTEIN_GROUP_TABLE
 from catapult.tasks import run_analysis
 from catapult.util import blank_diann_config
 
@@ -190,7 +199,7 @@ class ExperimentViewSet(viewsets.ModelViewSet, FilterMixin):
     @action(detail=True, methods=["get"])
     def get_associated_analyses(self, request, pk=None):
         experiment = self.get_object()
-        analyses = experiment.analysis.all()
+        analyses = annotate_ready(experiment.analysis.all())
         data = AnalysisSerializer(analyses, many=True, context={"request": request}).data
         return Response(data=data, status=status.HTTP_200_OK)
 
@@ -205,7 +214,9 @@ class ExperimentViewSet(viewsets.ModelViewSet, FilterMixin):
     def get_result_summaries(self, request, pk=None):
         experiment = self.get_object()
         analyses = experiment.analysis.all()
-        result_summary = ResultSummary.objects.filter(analysis__in=analyses)
+        result_summary = ResultSummarySerializer.setup_queryset(
+            ResultSummary.objects.filter(analysis__in=analyses), get_expand({"request": request})
+        )
         return Response(data=ResultSummarySerializer(result_summary, many=True, context={"request": request}).data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=["post"])
@@ -316,7 +327,7 @@ class AnalysisViewSet(viewsets.ModelViewSet, FilterMixin):
                 else:
                     query &= Q(**{f"config__content__{i}__contains": config_item})
 
-        return queryset.filter(query)
+        return annotate_ready(queryset.filter(query))
 
     def create(self, request, *args, **kwargs):
         analysis = Analysis.objects.create(
@@ -394,7 +405,7 @@ class AnalysisViewSet(viewsets.ModelViewSet, FilterMixin):
     @action(detail=True, methods=["get"])
     def get_result_summaries(self, request, pk=None):
         analysis = self.get_object()
-        result_summary = analysis.result_summary.all()
+        result_summary = ResultSummarySerializer.setup_queryset(analysis.result_summary.all(), get_expand({"request": request}))
         data = ResultSummarySerializer(result_summary, many=True, context={"request": request}).data
         return Response(data=data, status=status.HTTP_200_OK)
 
@@ -525,9 +536,46 @@ class CeleryTaskViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
         data = AnalysisSerializer(analysis, many=False, context={"request": request}).data
         return Response(data=data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["get"])
+    def drain(self, request):
+        """
+        Estimated seconds until the running and pending tasks are processed.
+        """
+        return Response(data=queue_eta(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"])
+    def queues(self, request):
+        """
+        Ready and running tasks of each queue with the waiting time of the ready tasks.
+        """
+        return Response(data=queue_metrics(), status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def resources(self, request, pk=None):
+        """
+        Resource usage samples of the process of the task with their summary, optionally restricted with
+        since and until (ISO date times).
+        """
+        task = self.get_object()
+        samples = task.resource_samples.all()
+        since = request.query_params.get("since", None)
+        if since:
+            samples = samples.filter(timestamp__gte=parse_datetime(since))
+        until = request.query_params.get("until", None)
+        if until:
+            samples = samples.filter(timestamp__lte=parse_datetime(until))
+        samples = list(samples)
+        data = {
+            "exit_code": task.exit_code,
+            "resource_usage": task.resource_usage,
+            "summary": summarize_samples(samples),
+            "samples": TaskResourceSampleSerializer(samples, many=True).data,
+        }
+        return Response(data=data, status=status.HTTP_200_OK)
+
 
 class CeleryWorkerViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
-    queryset = CeleryWorker.objects.all()
+    queryset = CeleryWorker.objects.prefetch_related("tasks")
     serializer_class = CeleryWorkerSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [OrderingFilter, SearchFilter]
@@ -539,7 +587,7 @@ class ResultSummaryViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
     queryset = ResultSummary.objects.all()
     serializer_class = ResultSummarySerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
     search_fields = ["analysis__experiment__experiment_name", "analysis__analysis_path"]
     ordering_fields = ["id", "analysis__experiment__experiment_name", "analysis__analysis_path", "created_at"]
 
@@ -564,7 +612,7 @@ class ResultSummaryViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
         if max_precursor:
             query &= Q(precursor_identified__lte=max_precursor)
 
-        return self.queryset.filter(query)
+        return ResultSummarySerializer.setup_queryset(self.queryset.filter(query), get_expand({"request": self.request}))
 
     def get_object(self):
         object = super().get_object()
@@ -591,44 +639,174 @@ class ResultSummaryViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
 
 
 class LogRecordViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
+    """
+    Log lines of tasks, from the compressed log chunks or from the LogRecord rows of tasks logged before the
+    chunks. Chunked lines can be filtered with task, worker_id, line (first line number), since and until (ISO
+    date times) and search, ordered by created_at or -created_at within a task, or the last lines of the log
+    returned with tail.
+    """
     queryset = LogRecord.objects.all()
     serializer_class = LogRecordSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
     search_fields = ["log"]
     ordering_fields = ["created_at"]
-    pagination_class = LimitOffsetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         worker_id = self.request.query_params.get("worker_id", None)
+        task = self.request.query_params.get("task", None)
+        queryset = self.queryset
         if worker_id:
-            return self.queryset.filter(task__worker_id=worker_id)
-        return self.queryset
+            queryset = queryset.filter(task__worker_id=worker_id)
+        if task:
+            queryset = queryset.filter(task_id=task)
+        return queryset
+
+    def get_chunks(self):
+        params = self.request.query_params
+        chunks = LogChunk.objects.all()
+        worker_id = params.get("worker_id", None)
+        if worker_id:
+            chunks = chunks.filter(task__worker_id=worker_id)
+        task = params.get("task", None)
+        if task:
+            chunks = chunks.filter(task_id=task)
+        if not chunks.exists() and self.get_queryset().exists():
+            return None
+        return chunks
+
+    def list(self, request, *args, **kwargs):
+        chunks = self.get_chunks()
+        if chunks is None:
+            return super().list(request, *args, **kwargs)
+        params = request.query_params
+        tail_lines = params.get("tail", None)
+        if tail_lines:
+            return Response(data=self.serialize_lines(tail(chunks, int(tail_lines))), status=status.HTTP_200_OK)
+        ordering = params.get("ordering", None)
+        if ordering and ordering not in ("created_at", "-created_at"):
+            return Response(data={"ordering": "chunked log lines can only be ordered by created_at"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if ordering and len(chunks.order_by().values_list("task_id", flat=True).distinct()[:2]) > 1:
+            return Response(data={"ordering": "chunked log lines can only be ordered within a task"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        line = params.get("line", None)
+        since = params.get("since", None)
+        until = params.get("until", None)
+        lines = LogLines(
+            chunks,
+            from_line=int(line) if line else None,
+            since=parse_datetime(since) if since else None,
+            until=parse_datetime(until) if until else None,
+            search=params.get("search", None),
+            descending=ordering == "-created_at",
+        )
+        page = self.paginate_queryset(lines)
+        if page is not None:
+            return self.get_paginated_response(self.serialize_lines(page))
+        return Response(data=self.serialize_lines(lines[:]), status=status.HTTP_200_OK)
+
+    def serialize_lines(self, lines):
+        return self.get_serializer(line_records(lines), many=True).data
 
     def get_object(self):
         object = super().get_object()
         return object
 
-class PrecursorReportContentViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
+class ResultStoreListMixin:
+    """
+    Answer list requests from the Parquet result store when ?source=parquet is given,
+    or by default when report content is not kept in the database.
+    The rows of the store are serialized like the database rows, with a null id as they have none.
+    """
+    result_store_table = None
+
+    def get_result_store(self):
+        source = self.request.query_params.get("source", None)
+        if source == "db":
+            return None
+        store = get_result_store()
+        if store and (source == "parquet" or not settings.STORE_REPORT_CONTENT_IN_DB):
+            return store
+        return None
+
+    def list(self, request, *args, **kwargs):
+        store = self.get_result_store()
+        if store is None:
+            return super().list(request, *args, **kwargs)
+        params = request.query_params
+        filters = {}
+        for key in ["file", "min_intensity", "max_intensity"] + TEXT_FIELDS[self.result_store_table]:
+            filters[key] = params.get(key, None)
+        analysis = params.get("analysis", None)
+        if analysis:
+            filters["analysis"] = analysis.split(",")
+
+        summary_query = Q()
+        result_summary = params.get("result_summary", None)
+        if result_summary:
+            summary_query &= Q(id=result_summary)
+        min_protein = params.get("min_protein", None)
+        if min_protein:
+            summary_query &= Q(protein_identified__gte=min_protein)
+        max_protein = params.get("max_protein", None)
+        if max_protein:
+            summary_query &= Q(protein_identified__lte=max_protein)
+        min_precursor = params.get("min_precursor", None)
+        if min_precursor:
+            summary_query &= Q(precursor_identified__gte=min_precursor)
+        max_precursor = params.get("max_precursor", None)
+        if max_precursor:
+            summary_query &= Q(precursor_identified__lte=max_precursor)
+        if summary_query:
+            filters["result_summary"] = list(ResultSummary.objects.filter(summary_query).values_list("id", flat=True))
+
+        ordering = params.get("ordering", None)
+        if ordering and (ordering.lstrip("-") not in self.ordering_fields or ordering.lstrip("-") == "id"):
+            ordering = None
+        query = store.query(self.result_store_table, filters, ordering)
+        page = self.paginate_queryset(query)
+        if page is not None:
+            return self.get_paginated_response(self.serialize_store_rows(page))
+        return Response(data=self.serialize_store_rows(query[:]), status=status.HTTP_200_OK)
+
+    def serialize_store_rows(self, rows):
+        serializer_class = self.get_serializer_class()
+        instances = []
+        for row in rows:
+            # the columns of the store are the attribute names of the report content rows
+            instance = serializer_class.Meta.model()
+            for column, value in row.items():
+                setattr(instance, column, value)
+            instances.append(instance)
+        serializer_class.setup_instances(instances, get_expand({"request": self.request}))
+        return self.get_serializer(instances, many=True).data
+
+
+class PrecursorReportContentViewSet(ResultStoreListMixin, viewsets.ReadOnlyModelViewSet, FilterMixin):
     queryset = PrecursorReportContent.objects.all()
     serializer_class = PrecursorReportContentSerializer
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
-    pagination_class = LimitOffsetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ReportSearchFilter]
+    pagination_class = KeysetPagination
     search_fields = ["gene_names", "protein_group", "precursor_id"]
     ordering_fields = ["id", "gene_names", "protein_group", "precursor_id", "intensity"]
+    # the text fields are matched by substring in get_queryset, not by the exact filters of DjangoFilterBackend
+    filterset_fields = ["id", "result_summary", "proteotypic", "intensity", "file"]
+    result_store_table = PRECURSOR_TABLE
 
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = PrecursorReportContentSerializer.setup_queryset(super().get_queryset(), get_expand({"request": self.request}))
         query = Q()
         gene_names = self.request.query_params.get("gene_names", None)
         if gene_names:
-            query &= Q(gene_names__icontains=gene_names)
+            query &= text_query("gene_names", gene_names)
         protein_group = self.request.query_params.get("protein_group", None)
         if protein_group:
-            query &= Q(protein_group__icontains=protein_group)
+            query &= text_query("protein_group", protein_group)
         precursor_id = self.request.query_params.get("precursor_id", None)
         if precursor_id:
-            query &= Q(precursor_id__icontains=precursor_id)
+            query &= text_query("precursor_id", precursor_id)
         file = self.request.query_params.get("file", None)
         if file:
             query &= Q(file__id=file)
@@ -645,7 +823,8 @@ class PrecursorReportContentViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
         if analysis:
             analysis = analysis.split(",")
             if len(analysis)> 0:
-                query &= Q(result_summary__analysis__id__in=analysis)
+                # filter on the partition key of the table, so PostgreSQL only scans the partitions of the analyses
+                query &= Q(analysis_id__in=analysis)
 
         min_protein = self.request.query_params.get("min_protein", None)
         if min_protein:
@@ -666,22 +845,26 @@ class PrecursorReportContentViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
         object = super().get_object()
         return object
 
-class ProteinGroupReportContentViewSet(viewsets.ReadOnlyModelViewSet, FilterMixin):
+class ProteinGroupReportContentViewSet(ResultStoreListMixin, viewsets.ReadOnlyModelViewSet, FilterMixin):
     queryset = ProteinGroupReportContent.objects.all()
     serializer_class = ProteinGroupReportContentSerializer
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
-    pagination_class = LimitOffsetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ReportSearchFilter]
+    pagination_class = KeysetPagination
     search_fields = ["gene_names", "protein_group"]
     ordering_fields = ["id", "gene_names", "protein_group", "intensity"]
+    # the text fields are matched by substring in get_queryset, not by the exact filters of DjangoFilterBackend
+    filterset_fields = ["id", "result_summary", "intensity", "file"]
+    result_store_table = PROTEIN_GROUP_TABLE
 
     def get_queryset(self):
+        queryset = ProteinGroupReportContentSerializer.setup_queryset(self.queryset.all(), get_expand({"request": self.request}))
         query = Q()
         gene_names = self.request.query_params.get("gene_names", None)
         if gene_names:
-            query &= Q(gene_names__icontains=gene_names)
+            query &= text_query("gene_names", gene_names)
         protein_group = self.request.query_params.get("protein_group", None)
         if protein_group:
-            query &= Q(protein_group__icontains=protein_group)
+            query &= text_query("protein_group", protein_group)
         file = self.request.query_params.get("file", None)
         if file:
             query &= Q(file__id=file)
@@ -694,6 +877,9 @@ class ProteinGroupReportContentViewSet(viewsets.ReadOnlyModelViewSet, FilterMixi
         max_intensity = self.request.query_params.get("max_intensity", None)
         if max_intensity:
             query &= Q(intensity__lte=max_intensity)
+        analysis = self.request.query_params.get("analysis", None)
+        if analysis:
+            query &= Q(analysis_id__in=analysis.split(","))
 
         min_protein = self.request.query_params.get("min_protein", None)
         if min_protein:
@@ -708,7 +894,7 @@ class ProteinGroupReportContentViewSet(viewsets.ReadOnlyModelViewSet, FilterMixi
         if max_precursor:
             query &= Q(result_summary__precursor_identified__lte=max_precursor)
 
-        return self.queryset.filter(query)
+        return queryset.filter(query)
 
     def get_object(self):
         object = super().get_object()
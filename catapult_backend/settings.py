@@ -290,6 +290,12 @@ MSCONVERT_PATH = os.environ.get("MSCONVERT_PATH", r"C:\Program Files\ProteoWizar
 DEFAULT_MSCONVERT_PARAMS = "-v"
 #DEFAULT_DIANN_PARAMS = "--min-fr-mz 200 --max-fr-mz 1800 --cut K*,R* --missed-cleavages 2 --min-pep-len 7 --max-pep-len 30 --min-pr-mz 300 --max-pr-mz 1800 --min-pr-charge 1 --max-pr-charge 4 --unimod4 --var-mods 1 --var-mod UniMod:35,15.994915,M --mass-acc 20 --mass-acc-ms1 20 --individual-mass-acc --individual-windows --reanalyse --smart-profiling --peak-center --no-ifs-removal"
 DEFAULT_DIANN_PARAMS = ""
+# Loader used to write precursor and protein group report content, "copy" (PostgreSQL COPY FROM STDIN) or "orm"
+REPORT_LOADER = os.environ.get("REPORT_LOADER", "copy")
+# Folder of the optional Parquet result store (requires pyarrow), leave empty to disable it
+PARQUET_RESULT_STORE = os.environ.get("PARQUET_RESULT_STORE", "")
+# Keep writing precursor and protein group report content to the database when the Parquet result store is enabled
+STORE_REPORT_CONTENT_IN_DB = os.environ.get("STORE_REPORT_CONTENT_IN_DB", "True") == "True"
 
 # Django Tasls
 TASKS = {